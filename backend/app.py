@@ -5,20 +5,39 @@ Provides REST API and WebSocket for scanner control and image processing
 
 import os
 import json
+import time
 import logging
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, List, Optional, Any
 from functools import wraps
 
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, g, Response, stream_with_context
 from flask_cors import CORS
-from flask_socketio import SocketIO, emit, join_room, leave_room
+from flask_socketio import SocketIO, ConnectionRefusedError, emit
 from werkzeug.exceptions import HTTPException
 
-from scanner_manager import ScannerManager
-from image_processor import ImageProcessor
-from websocket_handler import WebSocketHandler
+from scanner_manager import ScannerManager, ScanStatus
+from image_processor import ImageProcessor, RENDITION_SIZES
+from image_engine import ImageEngine, EngineBusyError
+from image_pipeline import PipelineError
+from document_builder import DocumentError, DOCUMENT_CONTENT_TYPES
+from websocket_handler import WebSocketHandler, SubscriptionError, ConnectionLimitError
+from event_bus import EventBus
+from sync_log import SyncLog, SYNC_ENTITIES
+from history_store import InvalidCursorError
+from capabilities import validate_scan_params
+from scan_queue import (
+    ScanJobQueue, ScanJob, QueueFullError, QueueClosedError, JobPriority, FINISHED_STATES
+)
+from discovery import DiscoveryService
+from simulated_scanner import SimulatedScannerDriver
+from coordination import Coordinator, create_coordination_store, socketio_queue_options
+from metrics import (
+    REGISTRY, HTTP_REQUEST_DURATION, IMAGE_BYTES_SERVED, CACHE_HITS, CACHE_MISSES, SOCKETIO_CONNECTIONS,
+    IMAGE_ENGINE_PENDING, SYNC_REQUESTS,
+    CONTENT_TYPE as METRICS_CONTENT_TYPE, merge_snapshots, add_ratio, render as render_metrics
+)
 
 # Configure logging
 logging.basicConfig(
@@ -27,26 +46,306 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+def load_config() -> Dict[str, Any]:
+    """Load configuration file, falling back to defaults"""
+    config_path = Path("../config/scanner.config.json")
+    if config_path.exists():
+        with open(config_path, 'r') as f:
+            return json.load(f)
+    return {}
+
+
+config = load_config()
+
 # Initialize Flask app
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max request size
 CORS(app, resources={r"/api/*": {"origins": ["http://localhost:3000", "http://localhost:*"]}})
 
 # Initialize extensions
-socketio = SocketIO(app, cors_allowed_origins="*")
+# Threading mode matches the gthread gunicorn worker and the scan worker threads.
+# With several workers, a message queue fans events out to clients on all of them.
+coordination_config = config.get('coordination', {})
+connections_config = config.get('connections', {})
+socketio = SocketIO(
+    app,
+    cors_allowed_origins="*",
+    async_mode=config.get('server', {}).get('async_mode', 'threading'),
+    # Engine.IO transport heartbeat; unanswered pings close the socket
+    ping_interval=connections_config.get('ping_interval', 25),
+    ping_timeout=connections_config.get('ping_timeout', 20),
+    **socketio_queue_options(
+        coordination_config.get('message_queue'),
+        channel=coordination_config.get('channel', 'scanner-bridge')
+    )
+)
 
 # Initialize managers
-scanner_manager = ScannerManager()
-image_processor = ImageProcessor()
-websocket_handler = WebSocketHandler(socketio)
+storage_config = config.get('storage', {})
+scanner_config = config.get('scanner', {})
+engine_config = config.get('image_engine', {})
+image_engine = None
+if engine_config.get('enabled', True):
+    # Split the cores between gunicorn workers, each of which has its own pool
+    server_workers = int(os.environ.get('SCANNER_BRIDGE_WORKERS', config.get('server', {}).get('workers', 1)))
+    image_engine = ImageEngine(
+        workers=engine_config.get('workers') or max(1, (os.cpu_count() or 1) // max(1, server_workers)),
+        max_pending=engine_config.get('max_pending'),
+        queue_timeout=engine_config.get('queue_timeout', 10)
+    )
+scanner_manager = ScannerManager(
+    scan_dir=storage_config.get('scan_dir', './scans'),
+    history_db=storage_config.get('history_db'),
+    max_history_items=config.get('features', {}).get('max_history_items'),
+    capability_cache=storage_config.get('capability_cache'),
+    sane_driver=scanner_config.get('sane_driver', 'scanimage'),
+    image_engine=image_engine
+)
+image_processor = ImageProcessor(
+    cache_dir=storage_config.get('cache_dir', './cache'),
+    max_cache_size=storage_config.get('max_cache_size'),
+    rendition_dir=str(Path(storage_config.get('scan_dir', './scans')) / 'renditions'),
+    engine=image_engine
+)
+simulator_config = scanner_config.get('simulator', {})
+if simulator_config.get('enabled'):
+    scanner_manager.register_driver(SimulatedScannerDriver(
+        devices=simulator_config.get('devices', 1),
+        line_rate=simulator_config.get('line_rate', 0),
+        warmup_seconds=simulator_config.get('warmup_seconds', 0),
+        feeder_pages=simulator_config.get('feeder_pages', 5),
+        jam_rate=simulator_config.get('jam_rate', 0),
+        timeout_rate=simulator_config.get('timeout_rate', 0),
+        timeout=scanner_config.get('timeout', 30),
+        seed=simulator_config.get('seed'),
+        page_cache_size=simulator_config.get('page_cache_size', 64 * 1024 * 1024)
+    ))
+events_config = config.get('events', {})
+event_bus = EventBus(
+    socketio,
+    flush_interval=events_config.get('flush_interval', 0.05),
+    max_batch_size=events_config.get('max_batch_size', 100)
+)
+websocket_handler = WebSocketHandler(
+    socketio,
+    bus=event_bus,
+    max_connections=connections_config.get('max_connections', 1000),
+    idle_timeout=connections_config.get('idle_timeout', 120),
+    max_outbound_queue=connections_config.get('max_outbound_queue', 1000),
+    reap_interval=connections_config.get('reap_interval', 10)
+)
+queue_config = config.get('queue', {})
+coordinator = Coordinator(
+    create_coordination_store(
+        coordination_config.get('store', 'local://'),
+        max_finished_jobs=queue_config.get('max_finished_jobs', 500)
+    ),
+    lease_seconds=coordination_config.get('lease_seconds', 15),
+    poll_interval=coordination_config.get('poll_interval', 0.5),
+    metrics_interval=coordination_config.get('metrics_interval', 10)
+)
+scanner_manager.on_scanners_changed = coordinator.publish_scanners
+coordinator.metrics_provider = REGISTRY.snapshot
+CACHE_HITS.function = lambda: image_processor.derivatives.hits
+CACHE_MISSES.function = lambda: image_processor.derivatives.misses
+SOCKETIO_CONNECTIONS.function = websocket_handler.get_connection_count
+IMAGE_ENGINE_PENDING.function = lambda: image_engine.pending if image_engine else 0
+sync_config = config.get('sync', {})
+sync_log = SyncLog(coordinator.store, capacity=sync_config.get('log_size', 1000))
+sync_log.on_change = lambda change: websocket_handler.broadcast_sync_change(change, sync_log.epoch)
+
+
+def on_scan_removed(scan_id: str):
+    """Drop a removed scan's renditions and record its deletion for sync"""
+    image_processor.delete_renditions(scan_id)
+    sync_log.record('scan', scan_id)
+
+
+def on_scanner_changes(delta: Dict[str, list]):
+    """Record a discovery pass's changes for sync and broadcast them"""
+    for scanner in delta.get('added', []) + delta.get('changed', []):
+        sync_log.record('scanner', scanner['id'], scanner)
+    for scanner_id in delta.get('removed', []):
+        sync_log.record('scanner', scanner_id)
+    websocket_handler.broadcast_scanner_changes(delta)
+
+
+scanner_manager.on_scan_removed = on_scan_removed
+scanner_manager.on_scan_recorded = lambda record: sync_log.record('scan', record['scan_id'], record)
+discovery = DiscoveryService(
+    scanner_manager,
+    interval=scanner_config.get('detection_interval', 5) if scanner_config.get('auto_detect', True) else 0,
+    max_interval=scanner_config.get('detection_max_interval', 300),
+    on_change=on_scanner_changes
+)
+
+
+def on_job_update(job: ScanJob):
+    """Share scan job state changes and relay them to WebSocket clients"""
+    job_info = job.to_dict()
+    coordinator.publish_job(job_info)
+    websocket_handler.broadcast_job_update(job_info)
+    rooms = {'scanner_id': job.scanner_id, 'job_id': job.job_id, 'session_id': job.client_id}
+    if job.status == ScanStatus.SCANNING.value:
+        websocket_handler.broadcast_scan_started(job.scan_id, job.scanner_id, job.job_id, job.client_id)
+    elif job.status == ScanStatus.COMPLETED.value and not job.pages:
+        info = scanner_manager.get_scan_info(job.scan_id) or {}
+        if info.get('file_path'):
+            image_processor.schedule_renditions(info['file_path'], job.scan_id)
+        websocket_handler.broadcast_scan_completed(
+            job.scan_id,
+            info.get('file_path', ''),
+            info.get('file_size', 0),
+            **rooms
+        )
+    elif job.status == ScanStatus.ERROR.value:
+        websocket_handler.broadcast_scan_error(job.scan_id, job.error or "Scan failed", **rooms)
+
+
+def on_job_page(job: ScanJob, page: Dict[str, Any]):
+    """Announce each batch page as soon as it is stored"""
+    image_processor.schedule_renditions(page['file_path'], page['scan_id'])
+    job_info = job.to_dict()
+    coordinator.publish_job(job_info)
+    websocket_handler.broadcast_job_update(job_info)
+    websocket_handler.broadcast_scan_completed(
+        page['scan_id'],
+        page['file_path'],
+        page['file_size'],
+        scanner_id=job.scanner_id,
+        job_id=job.job_id,
+        session_id=job.client_id,
+        batch_scan_id=job.scan_id
+    )
+
+
+def on_job_progress(job: ScanJob):
+    """Relay throttled scan progress to subscribers of the scan"""
+    coordinator.publish_job(job.to_dict())
+    websocket_handler.broadcast_scan_progress(
+        job.scan_id,
+        job.progress,
+        job.status,
+        scanner_id=job.scanner_id,
+        job_id=job.job_id,
+        session_id=job.client_id
+    )
+
+
+scan_queue = ScanJobQueue(
+    scanner_manager,
+    max_queue_size=queue_config.get('max_queue_size', 20),
+    max_finished_jobs=queue_config.get('max_finished_jobs', 500),
+    listener=on_job_update,
+    progress_listener=on_job_progress,
+    page_listener=on_job_page,
+    progress_updates_per_second=queue_config.get('progress_updates_per_second', 4)
+)
+
+
+def forward_scan(
+    owner: str,
+    scanner_id: str,
+    params: Dict[str, Any],
+    client_id: str,
+    priority: str
+) -> Dict[str, Any]:
+    """Accept a scan for a scanner driven by another worker process"""
+    job = ScanJob(
+        job_id=scan_queue.new_job_id(),
+        scan_id=scanner_manager.new_scan_id(),
+        scanner_id=scanner_id,
+        params=dict(params),
+        client_id=client_id,
+        priority=priority
+    )
+    job_info = job.to_dict()
+    coordinator.publish_job(job_info, owner=owner)
+    coordinator.forward(owner, {'type': 'scan', 'job': job_info})
+    return job_info
+
+
+def handle_forwarded_command(command: Dict[str, Any]):
+    """Run a scan or cancellation handed over by another worker process"""
+    if command['type'] == 'scan':
+        job_info = command['job']
+        try:
+            scan_queue.submit(
+                job_info['scanner_id'],
+                job_info['params'],
+                client_id=job_info['client_id'],
+                priority=job_info['priority'],
+                job_id=job_info['job_id'],
+                scan_id=job_info['scan_id']
+            )
+        except (QueueFullError, QueueClosedError, ValueError) as e:
+            # The client already got a 202, so report the rejection as a failed job
+            logger.warning(f"Rejected forwarded job {job_info['job_id']}: {str(e)}")
+            job_info.update(status=ScanStatus.ERROR.value, error=str(e), finished_at=datetime.now().isoformat())
+            coordinator.publish_job(job_info)
+            websocket_handler.broadcast_job_update(job_info)
+            websocket_handler.broadcast_scan_error(job_info['scan_id'], str(e))
+    elif command['type'] == 'cancel':
+        scan_queue.cancel(command['job_id'])
+    else:
+        logger.warning(f"Unknown forwarded command: {command['type']}")
+
+
+coordinator.command_handler = handle_forwarded_command
 
 # Create necessary directories
 Path("./temp").mkdir(exist_ok=True)
 Path("./cache").mkdir(exist_ok=True)
 Path("./scans").mkdir(exist_ok=True)
 
-# Store active connections
-active_connections: Dict[str, Any] = {}
+# Finished scans never change, so clients may cache them for a year
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def send_immutable_file(path: str):
+    """Send a finished file with validators, range support and long-lived caching
+    
+    send_file answers If-None-Match / If-Modified-Since with 304 and Range
+    with 206, using a strong ETag built from mtime, size and path. The
+    content type is derived from the file extension.
+    """
+    response = send_file(path, conditional=True, etag=True, max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    response.accept_ranges = 'bytes'
+    return response
+
+
+def image_engine_busy(error: EngineBusyError):
+    """503 telling the client to retry once the image engine has drained"""
+    response = jsonify({"error": "Image processing is busy", "details": str(error)})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(max(1, int(image_engine.queue_timeout)))
+    return response
+
+
+@app.before_request
+def start_request_timer():
+    """Note when request handling started"""
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    """Observe request latency per endpoint and count image bytes sent"""
+    started = g.get('request_started')
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    if started is not None:
+        HTTP_REQUEST_DURATION.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            endpoint=endpoint,
+            status=response.status_code
+        )
+    if response.mimetype and response.mimetype.startswith('image/') and response.content_length:
+        IMAGE_BYTES_SERVED.inc(response.content_length, endpoint=endpoint)
+    return response
 
 
 def handle_errors(f):
@@ -85,13 +384,34 @@ def api_status():
     """Get API status and configuration"""
     return jsonify({
         "api": "running",
-        "scanners_detected": len(scanner_manager.list_scanners()),
+        "scanners_detected": coordinator.count_scanners(),
+        "worker": coordinator.owner_id,
         "temp_dir": "./temp",
         "cache_dir": "./cache",
+        "cache": image_processor.derivatives.get_stats(),
+        "image_engine": image_engine.get_stats() if image_engine else None,
+        "events": event_bus.get_stats(),
+        "connections": websocket_handler.get_stats(),
+        "sync": sync_log.get_stats(),
+        "discovery": discovery.get_status(),
         "timestamp": datetime.now().isoformat()
     }), 200
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Metrics of all workers in the Prometheus text format"""
+    snapshot = merge_snapshots(coordinator.collect_metrics())
+    add_ratio(
+        snapshot,
+        "scanner_cache_hit_ratio",
+        "Derivative cache hits over all lookups",
+        "scanner_cache_hits_total",
+        ["scanner_cache_hits_total", "scanner_cache_misses_total"]
+    )
+    return Response(render_metrics(snapshot), content_type=METRICS_CONTENT_TYPE)
+
+
 # ============================================================================
 # SCANNER MANAGEMENT ENDPOINTS
 # ============================================================================
@@ -101,7 +421,7 @@ def api_status():
 def list_scanners():
     """List all available scanners"""
     try:
-        scanners = scanner_manager.list_scanners()
+        scanners = coordinator.list_scanners()
         logger.info(f"Listed {len(scanners)} scanners")
         return jsonify({
             "scanners": scanners,
@@ -120,23 +440,22 @@ def list_scanners():
 @app.route('/api/scanners/refresh', methods=['POST'])
 @handle_errors
 def refresh_scanners():
-    """Refresh scanner list"""
+    """Request a discovery pass (?wait=<seconds> waits for it, up to 30s)
+    
+    Changes are pushed to clients as scanners_updated deltas; the response
+    carries the registry as known when it is sent.
+    """
     try:
-        scanner_manager.refresh_scanner_list()
-        scanners = scanner_manager.list_scanners()
+        generation = discovery.trigger()
+        refreshed = discovery.wait_idle(min(max(request.args.get('wait', 0, type=float), 0), 30), generation)
+        scanners = coordinator.list_scanners()
         
-        # Notify connected clients
-        socketio.emit('scanners_updated', {
-            'scanners': scanners,
-            'timestamp': datetime.now().isoformat()
-        })
-        
-        logger.info("Scanner list refreshed")
+        logger.info("Scanner list refreshed" if refreshed else "Scanner discovery requested")
         return jsonify({
-            "status": "refreshed",
+            "status": "refreshed" if refreshed else "refreshing",
             "scanners": scanners,
             "count": len(scanners)
-        }), 200
+        }), 200 if refreshed else 202
     except Exception as e:
         logger.error(f"Error refreshing scanners: {str(e)}")
         return jsonify({"error": "Failed to refresh scanners", "details": str(e)}), 500
@@ -147,7 +466,7 @@ def refresh_scanners():
 def get_scanner_info(scanner_id: str):
     """Get detailed information about a specific scanner"""
     try:
-        info = scanner_manager.get_scanner_info(scanner_id)
+        info = coordinator.get_scanner(scanner_id)
         if not info:
             return jsonify({"error": "Scanner not found"}), 404
         
@@ -171,15 +490,13 @@ def select_scanner():
         return jsonify({"error": "scanner_id is required"}), 400
     
     try:
-        success = scanner_manager.select_scanner(scanner_id)
-        if not success:
+        if not coordinator.get_scanner(scanner_id):
+            logger.error(f"Scanner not found: {scanner_id}")
             return jsonify({"error": "Scanner not found"}), 404
+        coordinator.select_scanner(scanner_id)
         
         logger.info(f"Selected scanner: {scanner_id}")
-        socketio.emit('scanner_selected', {
-            'scanner_id': scanner_id,
-            'timestamp': datetime.now().isoformat()
-        })
+        websocket_handler.broadcast_scanner_selected(scanner_id)
         
         return jsonify({
             "status": "selected",
@@ -195,7 +512,8 @@ def select_scanner():
 @handle_errors
 def get_current_scanner():
     """Get currently selected scanner"""
-    current = scanner_manager.get_current_scanner()
+    scanner_id = coordinator.get_current_scanner_id()
+    current = coordinator.get_scanner(scanner_id) if scanner_id else None
     if not current:
         return jsonify({"error": "No scanner selected"}), 404
     
@@ -212,48 +530,129 @@ def get_current_scanner():
 @app.route('/api/scan', methods=['POST'])
 @handle_errors
 def start_scan():
-    """Start a new scan operation"""
+    """Queue a new scan operation"""
     data = request.get_json()
-    scanner_id = data.get('scanner_id') or scanner_manager.get_current_scanner_id()
+    scanner_id = data.get('scanner_id') or coordinator.get_current_scanner_id()
     
     if not scanner_id:
         return jsonify({"error": "No scanner selected"}), 400
     
+    # Each device is driven by exactly one worker process
+    owner = coordinator.resolve_owner(scanner_id, available_locally=scanner_manager.has_scanner(scanner_id))
+    if not owner:
+        return jsonify({"error": "Scanner not found"}), 404
+    
+    batch = bool(data.get('batch', False))
+    # Feeder batches default to the bulk lane so single pages jump ahead
+    default_priority = JobPriority.BULK.value if batch else JobPriority.INTERACTIVE.value
+    priority = data.get('priority', default_priority)
+    if priority not in [p.value for p in JobPriority]:
+        return jsonify({"error": f"Invalid priority: {priority}"}), 400
+    
     scan_params = {
         'format': data.get('format', 'jpeg'),
         'resolution': data.get('resolution', 300),
         'color_mode': data.get('color_mode', 'color'),
-        'compression_quality': data.get('compression_quality', 85)
+        'compression_quality': data.get('compression_quality', 85),
+        'source': data.get('source'),
+        'batch': batch
     }
     
+    # Reject what the device cannot do now rather than after a failed scan
+    scanner_info = coordinator.get_scanner(scanner_id) or scanner_manager.get_scanner_info(scanner_id)
+    if scanner_info:
+        errors = validate_scan_params(scanner_info.get('capabilities', {}), scan_params)
+        if errors:
+            return jsonify({"error": "Unsupported scan parameters", "details": errors}), 400
+    
+    client_id = data.get('client_id') or request.remote_addr or "anonymous"
     try:
-        scan_id = scanner_manager.start_scan(scanner_id, scan_params)
-        
-        logger.info(f"Scan started: {scan_id} on scanner {scanner_id}")
-        socketio.emit('scan_started', {
-            'scan_id': scan_id,
-            'scanner_id': scanner_id,
-            'timestamp': datetime.now().isoformat()
-        })
+        if coordinator.is_local(owner):
+            job_info = scan_queue.submit(scanner_id, scan_params, client_id=client_id, priority=priority).to_dict()
+            queue_depth = scan_queue.queue_depth(scanner_id)
+        else:
+            job_info = forward_scan(owner, scanner_id, scan_params, client_id, priority)
+            queue_depth = None
         
+        logger.info(f"Scan queued: {job_info['scan_id']} (job {job_info['job_id']}) on scanner {scanner_id}")
         return jsonify({
-            "scan_id": scan_id,
-            "status": "scanning",
+            "job_id": job_info['job_id'],
+            "scan_id": job_info['scan_id'],
+            "status": job_info['status'],
             "scanner_id": scanner_id,
+            "queue_depth": queue_depth,
             "timestamp": datetime.now().isoformat()
-        }), 200
+        }), 202
+    except QueueFullError as e:
+        logger.warning(str(e))
+        return jsonify({"error": "Scan queue is full", "details": str(e)}), 429
+    except QueueClosedError as e:
+        return jsonify({"error": "Server is shutting down", "details": str(e)}), 503
     except Exception as e:
         logger.error(f"Error starting scan: {str(e)}")
         return jsonify({"error": "Failed to start scan", "details": str(e)}), 500
 
 
+@app.route('/api/scan/jobs', methods=['GET'])
+@handle_errors
+def list_scan_jobs():
+    """List queued, running and recently finished scan jobs on every worker"""
+    jobs = coordinator.list_jobs(
+        scanner_id=request.args.get('scanner_id'),
+        status=request.args.get('status')
+    )
+    return jsonify({
+        "jobs": jobs,
+        "count": len(jobs),
+        "timestamp": datetime.now().isoformat()
+    }), 200
+
+
+@app.route('/api/scan/jobs/<job_id>', methods=['GET'])
+@handle_errors
+def get_scan_job(job_id: str):
+    """Get the state of a scan job"""
+    job = scan_queue.get_job(job_id)
+    job_info = job.to_dict() if job else coordinator.get_job(job_id)
+    if not job_info:
+        return jsonify({"error": "Job not found"}), 404
+    
+    return jsonify({
+        "job": job_info,
+        "timestamp": datetime.now().isoformat()
+    }), 200
+
+
+@app.route('/api/scan/jobs/<job_id>/cancel', methods=['POST'])
+@handle_errors
+def cancel_scan_job(job_id: str):
+    """Cancel a queued or running scan job"""
+    job = scan_queue.cancel(job_id)
+    if job:
+        job_info = job.to_dict()
+    else:
+        # Running in another worker; ask its owner to cancel it
+        job_info = coordinator.get_job(job_id)
+        if not job_info:
+            return jsonify({"error": "Job not found"}), 404
+        if job_info['status'] not in FINISHED_STATES and job_info.get('owner'):
+            coordinator.forward(job_info['owner'], {'type': 'cancel', 'job_id': job_id})
+    
+    return jsonify({
+        "job": job_info,
+        "timestamp": datetime.now().isoformat()
+    }), 200
+
+
 @app.route('/api/scan/status', methods=['GET'])
 @handle_errors
 def get_scan_status():
-    """Get current scan status"""
-    status = scanner_manager.get_scan_status()
+    """Get current scan status, optionally for one scanner"""
+    scanner_id = request.args.get('scanner_id')
+    status = scanner_manager.get_scan_status(scanner_id)
     return jsonify({
         "status": status,
+        "scanner_id": scanner_id,
         "timestamp": datetime.now().isoformat()
     }), 200
 
@@ -261,13 +660,21 @@ def get_scan_status():
 @app.route('/api/scan/<scan_id>', methods=['GET'])
 @handle_errors
 def get_scan_image(scan_id: str):
-    """Get a specific scanned image"""
+    """Get a specific scanned image (?size=thumb|preview|full)"""
+    size = request.args.get('size', 'full')
+    if size != 'full' and size not in RENDITION_SIZES:
+        return jsonify({"error": f"Invalid size: {size}"}), 400
+    
     try:
         image_path = scanner_manager.get_scan_image(scan_id)
         if not image_path or not os.path.exists(image_path):
             return jsonify({"error": "Scan not found"}), 404
         
-        return send_file(image_path, mimetype='image/jpeg')
+        image_path = image_processor.get_rendition(image_path, scan_id, size)
+        return send_immutable_file(image_path)
+    except EngineBusyError as e:
+        logger.warning(str(e))
+        return image_engine_busy(e)
     except Exception as e:
         logger.error(f"Error retrieving scan: {str(e)}")
         return jsonify({"error": "Failed to retrieve scan", "details": str(e)}), 500
@@ -291,18 +698,77 @@ def get_scan_info(scan_id: str):
         return jsonify({"error": "Failed to get scan info", "details": str(e)}), 500
 
 
+def sync_state(
+    since: Optional[int],
+    epoch: Optional[str],
+    history_limit: int = 50,
+    entities: tuple = SYNC_ENTITIES
+) -> Dict[str, Any]:
+    """Changes since a sequence number, or a snapshot when they are not available
+    
+    Clients apply "changes" in order, or replace their scanner list and
+    history with "scanners" and "history" when "snapshot" is true, then
+    keep "epoch" and "seq" for the next sync.
+    """
+    if since is None:
+        seq, changes = sync_log.seq, None
+    else:
+        seq, changes = sync_log.changes_since(since, epoch)
+    result: Dict[str, Any] = {
+        'epoch': sync_log.epoch,
+        'seq': seq,
+        'snapshot': changes is None,
+        'timestamp': datetime.now().isoformat()
+    }
+    if changes is not None:
+        SYNC_REQUESTS.inc(result='delta')
+        result['changes'] = [change for change in changes if change['entity'] in entities]
+        return result
+    
+    SYNC_REQUESTS.inc(result='snapshot')
+    if 'scanner' in entities:
+        result['scanners'] = coordinator.list_scanners()
+    if 'scan' in entities:
+        result['history'], result['next_cursor'] = scanner_manager.get_scan_history(history_limit)
+    return result
+
+
+@app.route('/api/sync', methods=['GET'])
+@handle_errors
+def get_sync():
+    """Get history and scanner list changes since ?since=<seq>&epoch=<epoch>"""
+    try:
+        return jsonify(sync_state(
+            request.args.get('since', type=int),
+            request.args.get('epoch'),
+            history_limit=min(request.args.get('limit', 50, type=int), 500)
+        )), 200
+    except Exception as e:
+        logger.error(f"Error syncing: {str(e)}")
+        return jsonify({"error": "Failed to sync", "details": str(e)}), 500
+
+
 @app.route('/api/scan/history', methods=['GET'])
 @handle_errors
 def get_scan_history():
-    """Get scan history"""
-    limit = request.args.get('limit', 50, type=int)
+    """Get a page of scan history (keyset pagination via ?before=<cursor>)"""
+    limit = min(request.args.get('limit', 50, type=int), 500)
     try:
-        history = scanner_manager.get_scan_history(limit)
+        history, next_cursor = scanner_manager.get_scan_history(
+            limit,
+            before=request.args.get('before'),
+            scanner_id=request.args.get('scanner_id'),
+            status=request.args.get('status'),
+            batch_id=request.args.get('batch_id')
+        )
         return jsonify({
             "history": history,
             "count": len(history),
+            "next_cursor": next_cursor,
             "timestamp": datetime.now().isoformat()
         }), 200
+    except InvalidCursorError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Error getting scan history: {str(e)}")
         return jsonify({"error": "Failed to get scan history", "details": str(e)}), 500
@@ -313,15 +779,13 @@ def get_scan_history():
 def delete_scan(scan_id: str):
     """Delete a scanned image"""
     try:
+        info = scanner_manager.get_scan_info(scan_id) or {}
         success = scanner_manager.delete_scan(scan_id)
         if not success:
             return jsonify({"error": "Scan not found"}), 404
         
         logger.info(f"Deleted scan: {scan_id}")
-        socketio.emit('scan_deleted', {
-            'scan_id': scan_id,
-            'timestamp': datetime.now().isoformat()
-        })
+        websocket_handler.broadcast_scan_deleted(scan_id, info.get('scanner_id'))
         
         return jsonify({
             "status": "deleted",
@@ -353,8 +817,11 @@ def convert_image():
         if not image_path:
             return jsonify({"error": "Scan not found"}), 404
         
-        converted_path = image_processor.convert_image(image_path, target_format)
-        return send_file(converted_path, mimetype=f'image/{target_format}')
+        converted = image_processor.convert_image(image_path, target_format)
+        return send_file(converted, download_name=os.path.basename(converted.name))
+    except EngineBusyError as e:
+        logger.warning(str(e))
+        return image_engine_busy(e)
     except Exception as e:
         logger.error(f"Error converting image: {str(e)}")
         return jsonify({"error": "Failed to convert image", "details": str(e)}), 500
@@ -377,58 +844,269 @@ def optimize_image():
         if not image_path:
             return jsonify({"error": "Scan not found"}), 404
         
-        optimized_path = image_processor.optimize_image(
+        optimized = image_processor.optimize_image(
             image_path,
             quality=quality,
             max_width=max_width
         )
-        return send_file(optimized_path, mimetype='image/jpeg')
+        return send_file(optimized, mimetype='image/jpeg')
+    except EngineBusyError as e:
+        logger.warning(str(e))
+        return image_engine_busy(e)
     except Exception as e:
         logger.error(f"Error optimizing image: {str(e)}")
         return jsonify({"error": "Failed to optimize image", "details": str(e)}), 500
 
 
+@app.route('/api/image/pipeline', methods=['POST'])
+@handle_errors
+def image_pipeline():
+    """Apply an ordered chain of operations to a scan with one decode and encode
+    
+    Body: {"scan_id": ..., "operations": [{"op": "rotate", "angle": 90},
+    {"op": "crop", "left": 0, "top": 0, "right": 1200, "bottom": 1600},
+    {"op": "resize", "max_width": 800}, {"op": "grayscale"},
+    {"op": "deskew", "max_angle": 5}, {"op": "format", "format": "png", "quality": 85}]}
+    """
+    data = request.get_json()
+    scan_id = data.get('scan_id')
+    
+    if not scan_id:
+        return jsonify({"error": "scan_id is required"}), 400
+    
+    try:
+        image_path = scanner_manager.get_scan_image(scan_id)
+        if not image_path:
+            return jsonify({"error": "Scan not found"}), 404
+        
+        result = image_processor.run_pipeline(image_path, data.get('operations'))
+        return send_file(result, download_name=os.path.basename(result.name))
+    except PipelineError as e:
+        return jsonify({"error": "Invalid pipeline", "details": str(e)}), 400
+    except EngineBusyError as e:
+        logger.warning(str(e))
+        return image_engine_busy(e)
+    except Exception as e:
+        logger.error(f"Error running image pipeline: {str(e)}")
+        return jsonify({"error": "Failed to run image pipeline", "details": str(e)}), 500
+
+
+@app.route('/api/document', methods=['GET', 'POST'])
+@handle_errors
+def build_document():
+    """Stream scans as one multi-page PDF or TIFF
+    
+    Body: {"scan_ids": [...]} in page order, {"batch_id": ...} or
+    {"job_id": ...} for the pages of a batch scan, plus "format": "pdf"
+    (default) or "tiff". GET takes the same parameters in the query
+    string, with scan_ids comma-separated. JPEG scans are embedded
+    without recompression.
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        scan_ids = data.get('scan_ids')
+    else:
+        data = request.args
+        scan_ids = [scan_id for scan_id in data.get('scan_ids', '').split(',') if scan_id]
+    target_format = str(data.get('format', 'pdf')).lower().replace('.', '')
+    if target_format == 'tif':
+        target_format = 'tiff'
+    
+    try:
+        if scan_ids:
+            if not isinstance(scan_ids, list):
+                return jsonify({"error": "scan_ids must be a list"}), 400
+            records = [scanner_manager.get_scan_info(str(scan_id)) for scan_id in scan_ids]
+            missing = [scan_id for scan_id, record in zip(scan_ids, records) if not record]
+            if missing:
+                return jsonify({"error": "Scan not found", "scan_ids": missing}), 404
+            name = 'scans' if len(records) > 1 else records[0]['scan_id']
+        elif data.get('batch_id') or data.get('job_id'):
+            batch_id = data.get('batch_id')
+            if not batch_id:
+                job = coordinator.get_job(data['job_id'])
+                if not job:
+                    return jsonify({"error": "Job not found"}), 404
+                batch_id = job['scan_id']
+            # A single-page scan is not a batch; its scan_id is the batch_id
+            records = scanner_manager.get_batch_pages(batch_id) or [scanner_manager.get_scan_info(batch_id)]
+            if not records[0]:
+                return jsonify({"error": "Batch not found"}), 404
+            name = batch_id
+        else:
+            return jsonify({"error": "scan_ids, batch_id or job_id is required"}), 400
+        
+        stream = image_processor.build_document(
+            [(record['file_path'], record.get('resolution')) for record in records], target_format
+        )
+    except DocumentError as e:
+        return jsonify({"error": "Invalid document", "details": str(e)}), 400
+    except FileNotFoundError as e:
+        return jsonify({"error": "Scan file not found", "details": str(e)}), 404
+    except EngineBusyError as e:
+        logger.warning(str(e))
+        return image_engine_busy(e)
+    except Exception as e:
+        logger.error(f"Error building document: {str(e)}")
+        return jsonify({"error": "Failed to build document", "details": str(e)}), 500
+    
+    logger.info(f"Streaming {target_format} document {name} of {len(records)} page(s)")
+    response = Response(stream_with_context(stream), mimetype=DOCUMENT_CONTENT_TYPES[target_format])
+    response.headers['Content-Disposition'] = (
+        f'attachment; filename="{name}.{"pdf" if target_format == "pdf" else "tif"}"'
+    )
+    return response
+
+
 # ============================================================================
 # WEBSOCKET EVENTS
 # ============================================================================
 
+# Clients send a heartbeat this often when otherwise silent
+HEARTBEAT_INTERVAL = connections_config.get('heartbeat_interval', 30)
+
+
+def client_event(f):
+    """Record client activity before handling a Socket.IO event"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        websocket_handler.touch(request.sid)
+        return f(*args, **kwargs)
+    return decorated
+
+
 @socketio.on('connect')
 def handle_connect():
-    """Handle client connection"""
+    """Handle client connection, refusing it when the server is full"""
     client_id = request.sid
-    active_connections[client_id] = {
-        'connected_at': datetime.now().isoformat(),
-        'ip': request.remote_addr
-    }
+    try:
+        websocket_handler.register_connection(client_id, {'ip': request.remote_addr})
+    except ConnectionLimitError as e:
+        logger.warning(f"Refused connection from {request.remote_addr}: {str(e)}")
+        raise ConnectionRefusedError(str(e))
     logger.info(f"Client connected: {client_id}")
-    emit('connected', {'client_id': client_id, 'timestamp': datetime.now().isoformat()})
+    emit('connected', {
+        'client_id': client_id,
+        'heartbeat_interval': HEARTBEAT_INTERVAL,
+        'timestamp': datetime.now().isoformat()
+    })
 
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """Handle client disconnection"""
     client_id = request.sid
-    if client_id in active_connections:
-        del active_connections[client_id]
+    websocket_handler.unregister_connection(client_id)
     logger.info(f"Client disconnected: {client_id}")
 
 
+@socketio.on('heartbeat')
+@client_event
+def handle_heartbeat(data=None):
+    """Keep an otherwise silent client from being reaped as idle"""
+    return {'timestamp': datetime.now().isoformat()}
+
+
+def _sync_since(data: Optional[Dict[str, Any]]) -> Optional[int]:
+    """Sequence number a Socket.IO sync request continues from"""
+    since = (data or {}).get('since')
+    return since if isinstance(since, int) and not isinstance(since, bool) else None
+
+
 @socketio.on('request_scanners')
-def handle_request_scanners():
-    """Handle scanner list request via WebSocket"""
+@client_event
+def handle_request_scanners(data=None):
+    """Handle scanner list request via WebSocket
+    
+    With {"since": <seq>, "epoch": ...} only the scanner changes since
+    then are sent, unless a full list is needed.
+    """
     try:
-        scanners = scanner_manager.list_scanners()
-        emit('scanners_list', {
-            'scanners': scanners,
-            'count': len(scanners),
-            'timestamp': datetime.now().isoformat()
-        })
+        result = sync_state(_sync_since(data), (data or {}).get('epoch'), entities=('scanner',))
+        if result['snapshot']:
+            result['count'] = len(result['scanners'])
+        emit('scanners_list', result)
     except Exception as e:
         logger.error(f"Error in request_scanners: {str(e)}")
         emit('error', {'message': 'Failed to get scanners', 'details': str(e)})
 
 
+@socketio.on('sync')
+@client_event
+def handle_sync(data=None):
+    """Catch up on history and scanner list changes after a (re)connect
+    
+    Data: {"since": <seq>, "epoch": ..., "limit": <history snapshot size>}.
+    Acknowledged with the changes, or a snapshot.
+    """
+    data = data or {}
+    limit = data.get('limit')
+    try:
+        return sync_state(
+            _sync_since(data),
+            data.get('epoch'),
+            history_limit=min(limit, 500) if isinstance(limit, int) and limit > 0 else 50
+        )
+    except Exception as e:
+        logger.error(f"Error in sync: {str(e)}")
+        return {'error': 'Failed to sync', 'details': str(e)}
+
+
+@socketio.on('subscribe')
+@client_event
+def handle_subscribe(data):
+    """Start receiving events for a scanner, job, scan, session, the scanner list or history
+    
+    Data: {"type": "scanner" | "job" | "scan" | "session", "id": ...} or
+    {"type": "scanners" | "history"}. Acknowledged with the connection's subscriptions.
+    """
+    data = data or {}
+    try:
+        room = websocket_handler.subscribe(request.sid, data.get('type'), data.get('id'))
+    except SubscriptionError as e:
+        emit('error', {'message': str(e)})
+        return {'error': str(e)}
+    return {'room': room, 'subscriptions': websocket_handler.get_subscriptions(request.sid)}
+
+
+@socketio.on('unsubscribe')
+@client_event
+def handle_unsubscribe(data):
+    """Stop receiving events for a subscription"""
+    data = data or {}
+    try:
+        room = websocket_handler.unsubscribe(request.sid, data.get('type'), data.get('id'))
+    except SubscriptionError as e:
+        emit('error', {'message': str(e)})
+        return {'error': str(e)}
+    return {'room': room, 'subscriptions': websocket_handler.get_subscriptions(request.sid)}
+
+
+@socketio.on('subscribe_scan')
+@client_event
+def handle_subscribe_scan(data):
+    """Start receiving progress updates for a scan"""
+    scan_id = (data or {}).get('scan_id')
+    if not scan_id:
+        emit('error', {'message': 'scan_id is required'})
+        return
+    try:
+        websocket_handler.subscribe(request.sid, 'scan', scan_id)
+    except SubscriptionError as e:
+        emit('error', {'message': str(e)})
+
+
+@socketio.on('unsubscribe_scan')
+@client_event
+def handle_unsubscribe_scan(data):
+    """Stop receiving progress updates for a scan"""
+    scan_id = (data or {}).get('scan_id')
+    if scan_id:
+        websocket_handler.unsubscribe(request.sid, 'scan', scan_id)
+
+
 @socketio.on('request_status')
+@client_event
 def handle_request_status():
     """Handle status request via WebSocket"""
     try:
@@ -463,35 +1141,64 @@ def internal_error(error):
 # INITIALIZATION
 # ============================================================================
 
-def init_app():
-    """Initialize the application"""
+def init_app(background_discovery: bool = False, request_threads: Optional[int] = None):
+    """Initialize the application
+
+    request_threads is the size of a thread-per-connection server's pool
+    (gunicorn gthread). Every WebSocket holds one of those threads for its
+    lifetime, so WebSocket connections are capped to leave
+    connections.http_reserve_threads free for HTTP requests.
+    """
     logger.info("Initializing Scanner Bridge Backend...")
     
-    # Initialize scanner manager
-    scanner_manager.initialize()
+    if request_threads:
+        reserve = connections_config.get('http_reserve_threads', 20)
+        limit = max(request_threads - reserve, 1)
+        if limit < websocket_handler.max_connections:
+            logger.info(
+                f"Limiting WebSocket connections to {limit}: {request_threads} threads, "
+                f"{reserve} reserved for HTTP"
+            )
+            websocket_handler.max_connections = limit
+    
+    # Start serving forwarded work before discovery claims any devices
+    coordinator.start()
+    
+    # Initialize scanner manager; with background discovery the first
+    # detection pass runs on the discovery thread instead of blocking here
+    scanner_manager.initialize(discover=not background_discovery)
+    discovery.start(immediate=background_discovery)
     logger.info("Scanner manager initialized")
     
-    # Load configuration
-    config_path = Path("../config/scanner.config.json")
-    if config_path.exists():
-        with open(config_path, 'r') as f:
-            config = json.load(f)
-            logger.info(f"Configuration loaded from {config_path}")
+    image_processor.derivatives.start_maintenance(storage_config.get('cache_cleanup_interval', 3600))
+    websocket_handler.start()
+    
+    # Configuration is loaded at import time so managers can use it
+    if config:
+        logger.info("Configuration loaded from ../config/scanner.config.json")
     else:
         logger.warning("Configuration file not found, using defaults")
     
     logger.info("Scanner Bridge Backend ready")
 
 
+def shutdown_app(timeout: float = 60):
+    """Drain in-flight scan jobs and stop background services"""
+    logger.info(f"Shutting down, draining scan jobs (up to {timeout}s)...")
+    discovery.stop(timeout=5)
+    drained = scan_queue.shutdown(timeout)
+    # Hand this worker's devices over once its scans are done
+    coordinator.stop()
+    scanner_manager.close()
+    websocket_handler.stop()
+    event_bus.stop()
+    # Close WebSockets so the request threads serving them can finish
+    socketio.server.eio.disconnect()
+    image_processor.derivatives.stop_maintenance()
+    if image_engine:
+        image_engine.shutdown()
+    logger.info("Shutdown complete" if drained else "Shutdown complete, some scans were cancelled")
+
+
 if __name__ == '__main__':
-    init_app()
-    
-    # Run the application
-    logger.info("Starting Flask application...")
-    socketio.run(
-        app,
-        host='127.0.0.1',
-        port=5000,
-        debug=True,
-        allow_unsafe_werkzeug=True
-    )
+    raise SystemExit("Start the development server with: python run_dev.py")
@@ -0,0 +1,5 @@
+"""
+Benchmarks - Timing harness for the scan, encode, serve and broadcast paths
+
+Run from the backend directory with `python -m benchmarks.run`.
+"""
@@ -0,0 +1,157 @@
+"""
+Harness - Timing, result files and baseline comparison
+"""
+
+import gc
+import os
+import sys
+import json
+import time
+import platform
+import statistics
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Any, Callable
+
+RESULT_FORMAT_VERSION = 1
+
+
+@dataclass
+class BenchmarkResult:
+    """Timing samples of one benchmark case, in seconds"""
+    name: str
+    samples: List[float]
+    params: Dict[str, Any] = field(default_factory=dict)
+    # Derived figures such as throughput, reported but not compared
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def median(self) -> float:
+        return statistics.median(self.samples)
+
+    @property
+    def p95(self) -> float:
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize with summary statistics"""
+        return {
+            "median": self.median,
+            "p95": self.p95,
+            "min": min(self.samples),
+            "mean": statistics.fmean(self.samples),
+            "iterations": len(self.samples),
+            "unit": "s",
+            "params": self.params,
+            "extra": self.extra,
+            "samples": self.samples
+        }
+
+
+def measure(
+    fn: Callable[[], Any],
+    repeat: int = 5,
+    warmup: int = 1,
+    setup: Optional[Callable[[], Any]] = None
+) -> List[float]:
+    """Time fn repeat times after warmup runs; setup runs untimed before each call"""
+    samples = []
+    for index in range(warmup + repeat):
+        if setup:
+            setup()
+        gc.collect()
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        if index >= warmup:
+            samples.append(elapsed)
+    return samples
+
+
+def environment() -> Dict[str, Any]:
+    """Describe the machine results were taken on"""
+    try:
+        import PIL
+        pillow = PIL.__version__
+    except ImportError:
+        pillow = None
+    return {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "pillow": pillow
+    }
+
+
+def write_results(path: Path, results: List[BenchmarkResult], quick: bool):
+    """Write results as JSON"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    document = {
+        "version": RESULT_FORMAT_VERSION,
+        "created": datetime.now().isoformat(),
+        "quick": quick,
+        "environment": environment(),
+        "results": {result.name: result.to_dict() for result in results}
+    }
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2)
+
+
+def load_results(path: Path) -> Optional[Dict[str, Any]]:
+    """Load a results file, or None if it does not exist"""
+    if not path.exists():
+        return None
+    with open(path, 'r') as f:
+        document = json.load(f)
+    if document.get("version") != RESULT_FORMAT_VERSION:
+        raise ValueError(f"Unsupported benchmark result version in {path}")
+    return document
+
+
+def compare(
+    results: List[BenchmarkResult],
+    baseline: Dict[str, Any],
+    tolerance: float = 0.25,
+    min_delta: float = 0.001
+) -> List[Dict[str, Any]]:
+    """Compare medians against a baseline
+
+    A case regresses when its median is more than tolerance slower than
+    the baseline and by more than min_delta seconds, so microsecond noise
+    on fast cases does not fail the run.
+    """
+    rows = []
+    previous = baseline.get("results", {})
+    for result in results:
+        row = {"name": result.name, "median": result.median, "baseline": None, "ratio": None, "status": "new"}
+        base = previous.get(result.name)
+        if base:
+            row["baseline"] = base["median"]
+            row["ratio"] = result.median / base["median"] if base["median"] else None
+            delta = result.median - base["median"]
+            if delta > base["median"] * tolerance and delta > min_delta:
+                row["status"] = "regression"
+            elif -delta > base["median"] * tolerance and -delta > min_delta:
+                row["status"] = "improved"
+            else:
+                row["status"] = "ok"
+        rows.append(row)
+    return rows
+
+
+def format_table(results: List[BenchmarkResult], comparison: Optional[List[Dict[str, Any]]] = None) -> str:
+    """Render results as a text table"""
+    by_name = {row["name"]: row for row in comparison or []}
+    lines = [f"{'benchmark':<44} {'median':>10} {'p95':>10} {'baseline':>10} {'ratio':>7}  status"]
+    for result in results:
+        row = by_name.get(result.name, {})
+        baseline = f"{row['baseline'] * 1000:9.2f}ms" if row.get("baseline") else f"{'-':>10}"
+        ratio = f"{row['ratio']:6.2f}x" if row.get("ratio") else f"{'-':>7}"
+        lines.append(
+            f"{result.name:<44} {result.median * 1000:8.2f}ms {result.p95 * 1000:8.2f}ms "
+            f"{baseline} {ratio}  {row.get('status', '')}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,88 @@
+"""
+Run benchmarks and compare them against a stored baseline
+
+    python -m benchmarks.run                        # all suites, compare to baseline.json
+    python -m benchmarks.run --quick -s pnm_encode  # smaller cases, one suite
+    python -m benchmarks.run --update-baseline      # store this run as the baseline
+
+Exits with status 1 when any case is slower than the baseline by more
+than --tolerance, so CI fails on performance regressions, and with status
+2 when there is no baseline to compare against, unless --allow-missing-baseline
+is given. Baselines depend on the machine, so none is committed.
+tests/test_benchmarks.py runs every suite once with --quick as a smoke test.
+"""
+
+import sys
+import logging
+import argparse
+import tempfile
+from pathlib import Path
+
+from .harness import write_results, load_results, compare, format_table
+from .suites import SUITES, BenchmarkContext, cleanup
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Scanner Bridge benchmarks")
+    parser.add_argument('-s', '--suite', action='append', choices=sorted(SUITES),
+                        help="suite to run (repeatable, default: all)")
+    parser.add_argument('--quick', action='store_true', help="smaller cases for CI smoke runs")
+    parser.add_argument('--repeat', type=int, default=5, help="timed iterations per case")
+    parser.add_argument('--output', type=Path, default=BENCHMARK_DIR / "results" / "latest.json",
+                        help="where to write results")
+    parser.add_argument('--baseline', type=Path, default=BENCHMARK_DIR / "baseline.json",
+                        help="results file to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed slowdown of a case's median, as a fraction")
+    parser.add_argument('--min-delta', type=float, default=0.001,
+                        help="ignore slowdowns smaller than this many seconds")
+    parser.add_argument('--update-baseline', action='store_true', help="store this run as the baseline")
+    parser.add_argument('--allow-missing-baseline', action='store_true',
+                        help="exit 0 instead of 2 when there is no baseline")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+
+    ctx = BenchmarkContext(
+        work_dir=Path(tempfile.mkdtemp(prefix="scanner-bench-")),
+        quick=args.quick,
+        repeat=args.repeat
+    )
+    results = []
+    try:
+        for name in args.suite or list(SUITES):
+            print(f"Running {name}...", file=sys.stderr)
+            results.extend(SUITES[name](ctx))
+    finally:
+        cleanup(ctx)
+
+    write_results(args.output, results, args.quick)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+    if args.update_baseline:
+        write_results(args.baseline, results, args.quick)
+        print(format_table(results))
+        print(f"Baseline updated: {args.baseline}", file=sys.stderr)
+        return 0
+
+    baseline = load_results(args.baseline)
+    if baseline is None:
+        print(format_table(results))
+        print(f"No baseline at {args.baseline}; run with --update-baseline to create one", file=sys.stderr)
+        return 0 if args.allow_missing_baseline else 2
+    if baseline.get("quick") != args.quick:
+        print("Warning: baseline and this run differ in --quick", file=sys.stderr)
+
+    comparison = compare(results, baseline, tolerance=args.tolerance, min_delta=args.min_delta)
+    print(format_table(results, comparison))
+    regressions = [row["name"] for row in comparison if row["status"] == "regression"]
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
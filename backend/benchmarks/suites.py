@@ -0,0 +1,362 @@
+"""
+Suites - Benchmark cases for the PNM encode, image, serve and broadcast paths
+
+Every suite takes a BenchmarkContext and returns BenchmarkResults. Pages
+are rendered by the simulated scanner so each run encodes the same
+document-like content.
+"""
+
+import io
+import os
+import sys
+import shutil
+import sqlite3
+import logging
+import threading
+import contextlib
+import urllib.request
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Callable, Iterator, TYPE_CHECKING
+
+from .harness import BenchmarkResult, measure
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+from pnm_stream import decode_pnm_stream  # noqa: E402
+from simulated_scanner import render_page, PAGE_SIZE_MM  # noqa: E402
+
+
+@dataclass
+class BenchmarkContext:
+    """Settings shared by all suites"""
+    work_dir: Path
+    quick: bool = False
+    repeat: int = 5
+
+    @property
+    def resolutions(self) -> List[int]:
+        return [150, 300] if self.quick else [150, 300, 600]
+
+
+def _page(dpi: int, color_mode: str = 'color') -> "Image.Image":
+    """Render a US Letter page at dpi"""
+    width = round(PAGE_SIZE_MM[0] / 25.4 * dpi)
+    height = round(PAGE_SIZE_MM[1] / 25.4 * dpi)
+    return render_page(width, height, dpi, color_mode, seed=1)
+
+
+def bench_pnm_encode(ctx: BenchmarkContext) -> List[BenchmarkResult]:
+    """Decode a PNM page from memory and save it with _save_image
+
+    Times only the decode and encode steps of a scanimage scan; spawning
+    scanimage and reading its pipe are not included.
+    """
+    from scanner_manager import ScannerManager
+
+    manager = ScannerManager(scan_dir=str(ctx.work_dir / "pnm_encode"))
+    results = []
+    for dpi in ctx.resolutions:
+        buffer = io.BytesIO()
+        _page(dpi).save(buffer, format='PPM')
+        pnm = buffer.getvalue()
+        for fmt in ('jpeg', 'png', 'tiff'):
+            target = manager.scan_dir / f"page.{fmt}"
+
+            def run():
+                image = decode_pnm_stream(io.BytesIO(pnm))
+                manager._save_image(image, target, fmt)
+
+            samples = measure(run, repeat=ctx.repeat)
+            results.append(BenchmarkResult(
+                name=f"pnm_encode.to_{fmt}[{dpi}dpi]",
+                samples=samples,
+                params={"dpi": dpi, "format": fmt, "pnm_bytes": len(pnm)},
+                extra={"output_bytes": target.stat().st_size}
+            ))
+    manager.history.close()
+    return results
+
+
+def bench_image_processor(ctx: BenchmarkContext) -> List[BenchmarkResult]:
+    """ImageProcessor.convert_image and optimize_image on scanned pages, with a cold cache"""
+    from image_processor import ImageProcessor
+
+    root = ctx.work_dir / "image"
+    root.mkdir(parents=True, exist_ok=True)
+    processor = ImageProcessor(cache_dir=str(root / "cache"), rendition_dir=str(root / "renditions"))
+    operations: Dict[str, Callable[[str], None]] = {
+        "convert_png": lambda path: processor.convert_image(path, 'png').close(),
+        "convert_tiff": lambda path: processor.convert_image(path, 'tiff').close(),
+        "optimize": lambda path: processor.optimize_image(path, quality=75, max_width=1600).close()
+    }
+
+    results = []
+    for dpi in ctx.resolutions:
+        source = root / f"page_{dpi}.jpeg"
+        _page(dpi).save(source, quality=90)
+        for operation, fn in operations.items():
+            samples = measure(
+                lambda: fn(str(source)),
+                repeat=ctx.repeat,
+                setup=lambda: processor.derivatives.evict_older_than(-1)
+            )
+            results.append(BenchmarkResult(
+                name=f"image.{operation}[{dpi}dpi]",
+                samples=samples,
+                params={"dpi": dpi, "source_bytes": source.stat().st_size}
+            ))
+    return results
+
+
+def bench_image_engine(ctx: BenchmarkContext) -> List[BenchmarkResult]:
+    """Concurrent optimize_image calls, in request threads and on the process pool"""
+    from image_processor import ImageProcessor
+    from image_engine import ImageEngine
+
+    root = ctx.work_dir / "engine"
+    root.mkdir(parents=True, exist_ok=True)
+    source = root / "page.jpeg"
+    _page(300).save(source, quality=90)
+    cores = os.cpu_count() or 1
+    requests = cores * (2 if ctx.quick else 4)
+
+    results = []
+    for mode in ('inline', 'pool'):
+        engine = ImageEngine(workers=cores, queue_timeout=600) if mode == 'pool' else None
+        processor = ImageProcessor(
+            cache_dir=str(root / f"cache_{mode}"), rendition_dir=str(root / "renditions"), engine=engine
+        )
+
+        def run():
+            # Distinct qualities so every request misses the cache
+            threads = [
+                threading.Thread(
+                    target=lambda quality: processor.optimize_image(str(source), quality, 1600).close(),
+                    args=(50 + index,)
+                )
+                for index in range(requests)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        try:
+            samples = measure(run, repeat=ctx.repeat, setup=lambda: processor.derivatives.evict_older_than(-1))
+        finally:
+            if engine:
+                engine.shutdown()
+        results.append(BenchmarkResult(
+            name=f"engine.optimize_{mode}[{requests}requests]",
+            samples=samples,
+            params={"requests": requests, "cores": cores},
+            extra={"operations_per_second": round(requests / min(samples), 1)}
+        ))
+    return results
+
+
+def _fill_history(db_path: Path, count: int):
+    """Insert count synthetic scan records in one transaction"""
+    from history_store import SCHEMA, COLUMNS
+
+    started = datetime(2024, 1, 1)
+    conn = sqlite3.connect(str(db_path))
+    conn.executescript(SCHEMA)
+    rows = (
+        (
+            f"scan_{index:08d}", f"scanner_{index % 4}", (started + timedelta(seconds=index)).isoformat(),
+            'jpeg', 300, 'color', f"./scans/scan_{index:08d}.jpeg", 250000,
+            'completed' if index % 10 else 'error', None, None
+        )
+        for index in range(count)
+    )
+    conn.executemany(
+        f"INSERT INTO scans ({', '.join(COLUMNS)}) VALUES ({', '.join('?' for _ in COLUMNS)})",
+        rows
+    )
+    conn.commit()
+    conn.close()
+
+
+def bench_history(ctx: BenchmarkContext) -> List[BenchmarkResult]:
+    """ScannerManager.get_scan_history on large histories"""
+    from scanner_manager import ScannerManager
+
+    results = []
+    for count in ([10_000] if ctx.quick else [10_000, 100_000]):
+        scan_dir = ctx.work_dir / f"history_{count}"
+        scan_dir.mkdir(parents=True, exist_ok=True)
+        db_path = scan_dir / "history.sqlite3"
+        _fill_history(db_path, count)
+        manager = ScannerManager(scan_dir=str(scan_dir), history_db=str(db_path))
+
+        # A cursor halfway through the history
+        _, cursor = manager.get_scan_history(limit=count // 2)
+        cases = {
+            "first_page": lambda: manager.get_scan_history(limit=50),
+            "deep_page": lambda: manager.get_scan_history(limit=50, before=cursor),
+            "by_scanner": lambda: manager.get_scan_history(limit=50, scanner_id='scanner_1'),
+            "by_status": lambda: manager.get_scan_history(limit=50, status='error')
+        }
+        for case, fn in cases.items():
+            # Single queries are fast; time 100 per sample to rise above timer noise
+            samples = measure(lambda: [fn() for _ in range(100)], repeat=ctx.repeat)
+            results.append(BenchmarkResult(
+                name=f"history.{case}[{count}]",
+                samples=[sample / 100 for sample in samples],
+                params={"records": count, "limit": 50}
+            ))
+        manager.history.close()
+    return results
+
+
+@contextlib.contextmanager
+def _app_context(ctx: BenchmarkContext) -> Iterator[object]:
+    """Import the Flask app inside a scratch working directory
+
+    app.py resolves ../config and its storage paths against the working
+    directory, so running it from a directory without a config gives
+    default settings and keeps scans out of the source tree.
+    """
+    app_dir = ctx.work_dir / "app" / "backend"
+    app_dir.mkdir(parents=True, exist_ok=True)
+    previous = os.getcwd()
+    os.chdir(app_dir)
+    try:
+        import app as app_module
+        yield app_module
+    finally:
+        os.chdir(previous)
+
+
+def bench_downloads(ctx: BenchmarkContext) -> List[BenchmarkResult]:
+    """Concurrent GET /api/scan/<id> downloads over HTTP"""
+    from werkzeug.serving import make_server
+    from scanner_manager import ScanInfo, ScanStatus
+
+    results = []
+    with _app_context(ctx) as app_module:
+        manager = app_module.scanner_manager
+        scan_id = "scan_benchmark_download"
+        # send_file resolves relative paths against the app root, not the working directory
+        file_path = (manager.scan_dir / f"{scan_id}.jpeg").resolve()
+        _page(300).save(file_path, quality=90)
+        manager._record_scan(ScanInfo(
+            scan_id=scan_id,
+            scanner_id="benchmark",
+            timestamp=datetime.now().isoformat(),
+            format='jpeg',
+            resolution=300,
+            color_mode='color',
+            file_path=str(file_path),
+            file_size=file_path.stat().st_size,
+            status=ScanStatus.COMPLETED.value
+        ))
+
+        server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}/api/scan/{scan_id}"
+        requests_per_client = 5 if ctx.quick else 20
+        try:
+            for clients in ([4, 16] if ctx.quick else [4, 16, 64]):
+                errors = []
+
+                def client():
+                    try:
+                        for _ in range(requests_per_client):
+                            with urllib.request.urlopen(url) as response:
+                                response.read()
+                    except Exception as e:
+                        errors.append(e)
+
+                def run():
+                    threads = [threading.Thread(target=client) for _ in range(clients)]
+                    for thread in threads:
+                        thread.start()
+                    for thread in threads:
+                        thread.join()
+                    if errors:
+                        raise RuntimeError(f"Download failed: {errors[0]}")
+
+                samples = measure(run, repeat=ctx.repeat)
+                total = clients * requests_per_client
+                results.append(BenchmarkResult(
+                    name=f"serve.scan_download[{clients}clients]",
+                    samples=samples,
+                    params={"clients": clients, "requests": total, "file_bytes": file_path.stat().st_size},
+                    extra={"requests_per_second": round(total / min(samples), 1)}
+                ))
+        finally:
+            server.shutdown()
+    return results
+
+
+def bench_broadcast(ctx: BenchmarkContext) -> List[BenchmarkResult]:
+    """Socket.IO scan progress broadcast fan-out to connected clients"""
+    # One update per scan: updates to the same scan are coalesced by the event bus
+    scan_ids = [f"scan_benchmark_{index}" for index in range(10)]
+    results = []
+    with _app_context(ctx) as app_module:
+        handler = app_module.websocket_handler
+        clients = []
+        try:
+            for count in ([10, 100] if ctx.quick else [10, 100, 500]):
+                while len(clients) < count:
+                    client = app_module.socketio.test_client(app_module.app)
+                    for scan_id in scan_ids:
+                        client.emit('subscribe_scan', {'scan_id': scan_id})
+                    clients.append(client)
+
+                def drain():
+                    for client in clients:
+                        client.get_received()
+
+                def broadcast():
+                    for progress, scan_id in enumerate(scan_ids):
+                        handler.broadcast_scan_progress(scan_id, progress, "scanning")
+                    # Send what the event bus queued instead of waiting for its tick
+                    if handler.bus:
+                        handler.bus.flush()
+
+                drain()
+                broadcast()
+                delivered = sum(
+                    1 for client in clients for event in client.get_received() if event['name'] == 'scan_progress'
+                )
+                if delivered != count * len(scan_ids):
+                    raise RuntimeError(f"Broadcast delivered {delivered} of {count * len(scan_ids)} updates")
+
+                samples = measure(broadcast, repeat=ctx.repeat, setup=drain)
+                results.append(BenchmarkResult(
+                    name=f"broadcast.scan_progress[{count}clients]",
+                    samples=[sample / len(scan_ids) for sample in samples],
+                    params={"clients": count, "updates": len(scan_ids)}
+                ))
+        finally:
+            for client in clients:
+                client.disconnect()
+    return results
+
+
+SUITES: Dict[str, Callable[[BenchmarkContext], List[BenchmarkResult]]] = {
+    "pnm_encode": bench_pnm_encode,
+    "image": bench_image_processor,
+    "engine": bench_image_engine,
+    "history": bench_history,
+    "serve": bench_downloads,
+    "broadcast": bench_broadcast
+}
+
+
+def cleanup(ctx: BenchmarkContext):
+    """Remove scratch files"""
+    shutil.rmtree(ctx.work_dir, ignore_errors=True)
@@ -0,0 +1,335 @@
+"""
+Capabilities - Per-device SANE capabilities probed from scanimage -A
+
+Probing opens the device and can take seconds, so results are cached on
+disk per backend, vendor and model. A cache entry is reused until it ages
+out, the installed SANE version changes or a scan reports that the device
+rejected its options.
+"""
+
+import os
+import re
+import json
+import time
+import logging
+import threading
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Optional, Any, Callable
+
+from metrics import SCANIMAGE_FAILURES
+
+logger = logging.getLogger(__name__)
+
+# Bump when parsing changes so stale cache entries are re-probed
+CAPABILITY_SCHEMA_VERSION = 2
+
+OUTPUT_FORMATS = ["jpeg", "png", "tiff"]
+
+# Offered in the UI when a device accepts any resolution within a range
+STANDARD_RESOLUTIONS = [75, 100, 150, 200, 300, 400, 600, 1200, 2400, 4800]
+
+# Used when a device cannot be probed
+DEFAULT_CAPABILITIES = {
+    "formats": OUTPUT_FORMATS,
+    "resolutions": [75, 150, 300, 600],
+    "color_modes": ["bw", "gray", "color"],
+    "duplex": False
+}
+
+# scanimage -A option line: "    --mode Color|Gray|Lineart [Color]"
+OPTION_PATTERN = re.compile(r"^\s+(--?[\w-]+)\s+(.*?)(?:\s+\[(.*)\])?\s*$")
+RANGE_PATTERN = re.compile(r"^(-?[\d.]+)\.\.(-?[\d.]+)([a-z%]*)(?:\s+\(in steps of ([\d.]+)\))?")
+
+
+def _api_color_mode(sane_mode: str) -> Optional[str]:
+    """Map a SANE mode name to the API color mode"""
+    name = sane_mode.lower()
+    if 'color' in name or 'colour' in name:
+        return 'color'
+    if 'gray' in name or 'grey' in name:
+        return 'gray'
+    if name in ('lineart', 'binary', 'halftone', 'black & white', 'monochrome'):
+        return 'bw'
+    return None
+
+
+def _api_source(sane_source: str) -> str:
+    """Map a SANE source name to the API source, keeping unknown names"""
+    name = sane_source.lower()
+    if 'duplex' in name:
+        return 'adf_duplex'
+    if 'adf' in name or 'feeder' in name:
+        return 'adf'
+    if 'flatbed' in name:
+        return 'flatbed'
+    return sane_source
+
+
+def _parse_values(spec: str) -> Dict[str, Any]:
+    """Parse an option value spec: a|b|c<unit> or min..max<unit> (in steps of n)"""
+    match = RANGE_PATTERN.match(spec)
+    if match:
+        return {
+            "range": [float(match.group(1)), float(match.group(2))],
+            "step": float(match.group(4)) if match.group(4) else None,
+            "unit": match.group(3)
+        }
+    values = spec.split('|')
+    unit_match = re.match(r"^(-?[\d.]+)([a-z%]+)$", values[-1])
+    if unit_match:
+        values[-1] = unit_match.group(1)
+    return {"values": values, "unit": unit_match.group(2) if unit_match else ""}
+
+
+# scanimage -A prints the scan area as width/height under short flags
+SCANIMAGE_OPTION_NAMES = {'-x': 'br-x', '-y': 'br-y', '-l': 'tl-x', '-t': 'tl-y'}
+
+
+def parse_scanimage_options(output: str) -> Dict[str, Any]:
+    """Build a capabilities dict from scanimage -A output"""
+    options: Dict[str, Dict[str, Any]] = {}
+    for line in output.splitlines():
+        match = OPTION_PATTERN.match(line)
+        if not match or (match.group(3) or '').strip() == 'inactive':
+            continue
+        flag = match.group(1)
+        options[SCANIMAGE_OPTION_NAMES.get(flag, flag.lstrip('-'))] = _parse_values(match.group(2).strip())
+    return capabilities_from_options(options)
+
+
+def capabilities_from_options(options: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Build a capabilities dict from active SANE options
+
+    options maps SANE option names to {"values": [...]} or
+    {"range": [min, max], "step": n}, plus the option's "unit".
+    """
+    capabilities: Dict[str, Any] = {"formats": OUTPUT_FORMATS}
+    sane_names: Dict[str, Dict[str, str]] = {"modes": {}, "sources": {}}
+
+    resolution = options.get('resolution')
+    if resolution and 'values' in resolution:
+        capabilities["resolutions"] = sorted({int(float(v)) for v in resolution['values']})
+    elif resolution:
+        low, high = (int(v) for v in resolution['range'])
+        step = max(int(resolution['step'] or 1), 1)
+        capabilities["resolution_range"] = {"min": low, "max": high, "step": step}
+        capabilities["resolutions"] = [
+            r for r in STANDARD_RESOLUTIONS if low <= r <= high and (r - low) % step == 0
+        ] or [low, high - (high - low) % step]
+
+    mode = options.get('mode')
+    if mode and 'values' in mode:
+        for sane_mode in mode['values']:
+            api_mode = _api_color_mode(sane_mode)
+            if api_mode and api_mode not in sane_names["modes"]:
+                sane_names["modes"][api_mode] = sane_mode
+        capabilities["color_modes"] = [m for m in ("bw", "gray", "color") if m in sane_names["modes"]]
+
+    source = options.get('source')
+    if source and 'values' in source:
+        for sane_source in source['values']:
+            sane_names["sources"].setdefault(_api_source(sane_source), sane_source)
+        capabilities["sources"] = list(sane_names["sources"])
+    capabilities["duplex"] = "adf_duplex" in sane_names["sources"]
+
+    depth = options.get('depth')
+    if depth and 'values' in depth:
+        capabilities["bit_depths"] = [int(float(v)) for v in depth['values']]
+
+    width, height = options.get('br-x'), options.get('br-y')
+    if width and height and 'range' in width and 'range' in height:
+        capabilities["page_size"] = {
+            "width": width['range'][1],
+            "height": height['range'][1],
+            "unit": width['unit'] or "mm"
+        }
+
+    capabilities["sane_names"] = sane_names
+    return capabilities
+
+
+def validate_scan_params(capabilities: Dict[str, Any], params: Dict[str, Any]) -> List[str]:
+    """List the ways params fall outside a device's capabilities"""
+    errors = []
+
+    resolution = params.get('resolution')
+    resolution_range = capabilities.get('resolution_range')
+    try:
+        resolution = int(resolution)
+    except (TypeError, ValueError):
+        errors.append(f"Invalid resolution: {resolution}")
+        resolution = None
+    if resolution is not None:
+        if resolution_range:
+            step = resolution_range.get('step') or 1
+            if not resolution_range['min'] <= resolution <= resolution_range['max']:
+                errors.append(
+                    f"Resolution {resolution} outside supported range "
+                    f"{resolution_range['min']}-{resolution_range['max']}"
+                )
+            elif (resolution - resolution_range['min']) % step:
+                errors.append(
+                    f"Resolution {resolution} not supported, use {resolution_range['min']}-"
+                    f"{resolution_range['max']} in steps of {step}"
+                )
+        elif capabilities.get('resolutions') and resolution not in capabilities['resolutions']:
+            errors.append(
+                f"Resolution {resolution} not supported, use one of "
+                f"{', '.join(str(r) for r in capabilities['resolutions'])}"
+            )
+
+    color_mode = params.get('color_mode')
+    if color_mode and capabilities.get('color_modes') and color_mode not in capabilities['color_modes']:
+        errors.append(f"Color mode {color_mode} not supported, use one of {', '.join(capabilities['color_modes'])}")
+
+    fmt = (params.get('format') or '').lower()
+    if fmt and capabilities.get('formats') and fmt not in capabilities['formats']:
+        errors.append(f"Format {fmt} not supported, use one of {', '.join(capabilities['formats'])}")
+
+    sources = capabilities.get('sources')
+    source = params.get('source')
+    if sources:
+        if source and source.lower() not in sources and source not in sources:
+            errors.append(f"Source {source} not supported, use one of {', '.join(sources)}")
+        if params.get('batch') and not source and not any(s.startswith('adf') for s in sources):
+            errors.append("Batch scanning needs a document feeder, which this scanner does not have")
+
+    return errors
+
+
+class CapabilityCache:
+    """JSON file of probed capabilities keyed by backend, vendor and model"""
+
+    def __init__(self, cache_path: str, max_age_seconds: float = 30 * 24 * 3600):
+        """Load the capability cache"""
+        self.cache_path = Path(cache_path)
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        if self.cache_path.exists():
+            try:
+                with open(self.cache_path, 'r') as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable capability cache {self.cache_path}: {str(e)}")
+
+    def get(self, key: str, sane_version: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Get cached capabilities unless stale"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if not entry:
+            return None
+        if (entry.get('schema') != CAPABILITY_SCHEMA_VERSION
+                or entry.get('sane_version') != sane_version
+                or time.time() - entry.get('probed_at', 0) > self.max_age_seconds):
+            return None
+        return entry['capabilities']
+
+    def put(self, key: str, sane_version: Optional[str], capabilities: Dict[str, Any]):
+        """Store capabilities and persist the cache"""
+        with self._lock:
+            self._entries[key] = {
+                'schema': CAPABILITY_SCHEMA_VERSION,
+                'sane_version': sane_version,
+                'probed_at': time.time(),
+                'capabilities': capabilities
+            }
+            self._save()
+
+    def invalidate(self, key: str):
+        """Drop an entry so the device is probed again"""
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._save()
+                logger.info(f"Capability cache entry invalidated: {key}")
+
+    def _save(self):
+        """Write the cache atomically (lock held)"""
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.cache_path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(temp_path, 'w') as f:
+            json.dump(self._entries, f, indent=2)
+        temp_path.replace(self.cache_path)
+
+
+class SaneCapabilityProbe:
+    """Probes devices once per model and SANE version
+
+    Devices are probed with scanimage -A unless a prober (device_id ->
+    capabilities) is given, e.g. one reading option descriptors through
+    libsane; version_reader then supplies the matching SANE version.
+    """
+
+    def __init__(
+        self,
+        cache: CapabilityCache,
+        timeout: float = 20,
+        prober: Optional[Callable[[str], Dict[str, Any]]] = None,
+        version_reader: Optional[Callable[[], str]] = None
+    ):
+        """Initialize capability probe"""
+        self.cache = cache
+        self.timeout = timeout
+        self.prober = prober
+        self.version_reader = version_reader
+        self._sane_version: Optional[str] = None
+
+    @staticmethod
+    def cache_key(device_id: str, vendor: str, model: str) -> str:
+        """Devices of one model on one backend share capabilities"""
+        return f"{device_id.split(':', 1)[0]}|{vendor}|{model}"
+
+    @property
+    def sane_version(self) -> Optional[str]:
+        """Installed sane-backends version, read once"""
+        if self._sane_version is None:
+            try:
+                if self.version_reader:
+                    self._sane_version = self.version_reader() or "unknown"
+                else:
+                    result = subprocess.run(['scanimage', '-V'], capture_output=True, text=True, timeout=5)
+                    self._sane_version = result.stdout.strip() or "unknown"
+            except Exception as e:
+                logger.warning(f"Could not read SANE version: {str(e)}")
+                self._sane_version = "unknown"
+        return self._sane_version
+
+    def get(self, device_id: str, vendor: str, model: str, probe: bool = True) -> Optional[Dict[str, Any]]:
+        """Get capabilities from the cache, probing the device on a miss if allowed"""
+        key = self.cache_key(device_id, vendor, model)
+        capabilities = self.cache.get(key, self.sane_version)
+        if capabilities is not None or not probe:
+            return capabilities
+
+        try:
+            if self.prober:
+                capabilities = self.prober(device_id)
+            else:
+                result = subprocess.run(
+                    ['scanimage', '-A', '-d', device_id],
+                    capture_output=True,
+                    text=True,
+                    timeout=self.timeout
+                )
+                if result.returncode != 0:
+                    SCANIMAGE_FAILURES.inc(operation='probe')
+                    logger.warning(f"Capability probe failed for {device_id}: {result.stderr.strip()}")
+                    return None
+                capabilities = parse_scanimage_options(result.stdout)
+        except Exception as e:
+            if not self.prober:
+                SCANIMAGE_FAILURES.inc(operation='probe')
+            logger.warning(f"Capability probe failed for {device_id}: {str(e)}")
+            return None
+
+        self.cache.put(key, self.sane_version, capabilities)
+        logger.info(
+            f"Probed {device_id}: resolutions {capabilities.get('resolutions')}, "
+            f"modes {capabilities.get('color_modes')}, sources {capabilities.get('sources')}"
+        )
+        return capabilities
+
+    def invalidate(self, device_id: str, vendor: str, model: str):
+        """Forget a device model's capabilities"""
+        self.cache.invalidate(self.cache_key(device_id, vendor, model))
@@ -0,0 +1,759 @@
+"""
+Coordination - Shared state and event fan-out across worker processes
+
+When the API runs in several worker processes (or on several hosts), each
+process discovers scanners and runs its own job queue. The coordination
+store keeps the state clients must see consistently in one place:
+
+- device leases, so a single owner process drives each scanner
+- the scanner list, published by the owners
+- scan job status, whichever worker accepted the job
+- a command inbox, used to hand scans and cancellations to a device's owner
+- the sync log of history and scanner list changes, with one sequence
+
+Socket.IO events are fanned out to clients on every worker through a
+pub/sub client manager chosen by URL (see socketio_queue_options).
+"""
+
+import os
+import json
+import time
+import queue
+import socket
+import sqlite3
+import logging
+import uuid
+import threading
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Dict, List, Optional, Any, Callable, Tuple
+
+import socketio
+
+logger = logging.getLogger(__name__)
+
+FINISHED_JOB_STATES = ('completed', 'error', 'cancelled')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    device_id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    info TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    scanner_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    owner TEXT,
+    created_at TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created_at);
+CREATE TABLE IF NOT EXISTS commands (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner TEXT NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_commands_owner ON commands (owner, id);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS sync_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+def _sqlite_path(url: str) -> str:
+    """Extract the database path from a sqlite:///path URL"""
+    return url[len("sqlite:///"):]
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    """Open a connection that tolerates other processes writing the same file"""
+    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class LocalCoordinationStore:
+    """Coordination state held in this process; for a single worker and tests"""
+
+    def __init__(self, max_finished_jobs: int = 500):
+        """Initialize local coordination store"""
+        self.max_finished_jobs = max_finished_jobs
+        # device_id -> {'owner', 'info', 'expires_at'}
+        self._devices: Dict[str, Dict[str, Any]] = {}
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._commands: Dict[str, List[Dict[str, Any]]] = {}
+        self._settings: Dict[str, Any] = {}
+        self._sync_epoch = uuid.uuid4().hex[:12]
+        self._sync_seq = 0
+        self._sync_changes: deque = deque()
+        self._lock = threading.Lock()
+
+    def claim_device(self, device_id: str, owner: str, info: Dict[str, Any], ttl: float) -> bool:
+        """Take or renew the lease on a device, returning whether owner holds it"""
+        now = time.time()
+        with self._lock:
+            lease = self._devices.get(device_id)
+            if lease and lease['owner'] != owner and lease['expires_at'] > now:
+                return False
+            self._devices[device_id] = {'owner': owner, 'info': info, 'expires_at': now + ttl}
+            return True
+
+    def renew_leases(self, owner: str, ttl: float):
+        """Extend every lease held by owner"""
+        expires_at = time.time() + ttl
+        with self._lock:
+            for lease in self._devices.values():
+                if lease['owner'] == owner:
+                    lease['expires_at'] = expires_at
+
+    def release_devices(self, owner: str, keep: Optional[List[str]] = None):
+        """Drop leases held by owner, except those listed in keep"""
+        keep = set(keep or [])
+        with self._lock:
+            for device_id in [d for d, lease in self._devices.items()
+                              if lease['owner'] == owner and d not in keep]:
+                del self._devices[device_id]
+
+    def device_owner(self, device_id: str) -> Optional[str]:
+        """Get the owner of a live lease"""
+        with self._lock:
+            lease = self._devices.get(device_id)
+            if lease and lease['expires_at'] > time.time():
+                return lease['owner']
+        return None
+
+    def list_devices(self) -> List[Dict[str, Any]]:
+        """Get info of all devices with a live lease"""
+        now = time.time()
+        with self._lock:
+            return [
+                dict(lease['info'], owner=lease['owner'])
+                for lease in self._devices.values() if lease['expires_at'] > now
+            ]
+
+    def count_devices(self) -> int:
+        """Count devices with a live lease"""
+        now = time.time()
+        with self._lock:
+            return sum(1 for lease in self._devices.values() if lease['expires_at'] > now)
+
+    def put_job(self, job: Dict[str, Any], owner: Optional[str] = None):
+        """Insert or update a job snapshot"""
+        with self._lock:
+            self._jobs[job['job_id']] = dict(job, owner=owner)
+            if job['status'] in FINISHED_JOB_STATES:
+                finished = [job_id for job_id, j in self._jobs.items() if j['status'] in FINISHED_JOB_STATES]
+                for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+                    del self._jobs[job_id]
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get a job snapshot"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return dict(job) if job else None
+
+    def list_jobs(
+        self,
+        scanner_id: Optional[str] = None,
+        status: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """List job snapshots, newest first"""
+        with self._lock:
+            jobs = sorted(self._jobs.values(), key=lambda j: j['created_at'], reverse=True)
+        return [
+            dict(job) for job in jobs
+            if (scanner_id is None or job['scanner_id'] == scanner_id)
+            and (status is None or job['status'] == status)
+        ]
+
+    def send_command(self, owner: str, command: Dict[str, Any]):
+        """Queue a command for the owner process"""
+        with self._lock:
+            self._commands.setdefault(owner, []).append(dict(command))
+
+    def take_commands(self, owner: str) -> List[Dict[str, Any]]:
+        """Remove and return the commands queued for owner, oldest first"""
+        with self._lock:
+            return self._commands.pop(owner, [])
+
+    def set_value(self, key: str, value: Any):
+        """Store a shared setting"""
+        with self._lock:
+            self._settings[key] = value
+
+    def get_value(self, key: str) -> Any:
+        """Read a shared setting"""
+        with self._lock:
+            return self._settings.get(key)
+
+    def list_values(self, prefix: str) -> Dict[str, Any]:
+        """Read all shared settings whose key starts with prefix"""
+        with self._lock:
+            return {key: value for key, value in self._settings.items() if key.startswith(prefix)}
+
+    def delete_value(self, key: str):
+        """Remove a shared setting"""
+        with self._lock:
+            self._settings.pop(key, None)
+
+    def sync_epoch(self) -> str:
+        """Identify this store's sync log; it changes whenever the log starts over"""
+        return self._sync_epoch
+
+    def append_change(self, change: Dict[str, Any], keep: int) -> int:
+        """Add a change to the sync log under the next sequence number, keeping the newest keep"""
+        with self._lock:
+            self._sync_seq += 1
+            self._sync_changes.append(dict(change, seq=self._sync_seq))
+            while len(self._sync_changes) > keep:
+                self._sync_changes.popleft()
+            return self._sync_seq
+
+    def changes_after(self, since: Optional[int]) -> Tuple[int, int, List[Dict[str, Any]]]:
+        """Get (oldest kept seq, latest seq, changes after since), oldest first
+
+        With since None, only the bounds are read.
+        """
+        with self._lock:
+            oldest = self._sync_changes[0]['seq'] if self._sync_changes else self._sync_seq + 1
+            if since is None:
+                return oldest, self._sync_seq, []
+            return oldest, self._sync_seq, [dict(c) for c in self._sync_changes if c['seq'] > since]
+
+    def close(self):
+        """Nothing to release for the local store"""
+        pass
+
+
+class SQLiteCoordinationStore:
+    """Coordination state in a SQLite file shared by all workers on a host"""
+
+    def __init__(self, db_path: str, max_finished_jobs: int = 500):
+        """Open (or create) the coordination database"""
+        self.db_path = str(db_path)
+        self.max_finished_jobs = max_finished_jobs
+        self._lock = threading.Lock()
+        self._conn = _connect(self.db_path)
+        with self._lock:
+            self._conn.executescript(SCHEMA)
+
+    def claim_device(self, device_id: str, owner: str, info: Dict[str, Any], ttl: float) -> bool:
+        """Take or renew the lease on a device, returning whether owner holds it"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO devices (device_id, owner, info, expires_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(device_id) DO UPDATE SET owner = excluded.owner, info = excluded.info, "
+                    "expires_at = excluded.expires_at "
+                    "WHERE devices.owner = excluded.owner OR devices.expires_at <= ?",
+                    (device_id, owner, json.dumps(info), now + ttl, now)
+                )
+                row = self._conn.execute(
+                    "SELECT owner FROM devices WHERE device_id = ?", (device_id,)
+                ).fetchone()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return row is not None and row['owner'] == owner
+
+    def renew_leases(self, owner: str, ttl: float):
+        """Extend every lease held by owner"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE devices SET expires_at = ? WHERE owner = ?", (time.time() + ttl, owner)
+            )
+
+    def release_devices(self, owner: str, keep: Optional[List[str]] = None):
+        """Drop leases held by owner, except those listed in keep"""
+        keep = list(keep or [])
+        with self._lock:
+            self._conn.execute(
+                f"DELETE FROM devices WHERE owner = ? "
+                f"AND device_id NOT IN ({', '.join('?' for _ in keep)})",
+                [owner] + keep
+            )
+
+    def device_owner(self, device_id: str) -> Optional[str]:
+        """Get the owner of a live lease"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT owner FROM devices WHERE device_id = ? AND expires_at > ?",
+                (device_id, time.time())
+            ).fetchone()
+        return row['owner'] if row else None
+
+    def list_devices(self) -> List[Dict[str, Any]]:
+        """Get info of all devices with a live lease"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT owner, info FROM devices WHERE expires_at > ? ORDER BY device_id",
+                (time.time(),)
+            ).fetchall()
+        return [dict(json.loads(row['info']), owner=row['owner']) for row in rows]
+
+    def count_devices(self) -> int:
+        """Count devices with a live lease"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM devices WHERE expires_at > ?", (time.time(),)
+            ).fetchone()[0]
+
+    def put_job(self, job: Dict[str, Any], owner: Optional[str] = None):
+        """Insert or update a job snapshot"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, scanner_id, status, owner, created_at, data) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job['job_id'], job['scanner_id'], job['status'], owner, job['created_at'], json.dumps(job))
+            )
+            if job['status'] in FINISHED_JOB_STATES:
+                self._conn.execute(
+                    f"DELETE FROM jobs WHERE job_id IN ("
+                    f"SELECT job_id FROM jobs WHERE status IN ({', '.join('?' for _ in FINISHED_JOB_STATES)}) "
+                    f"ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                    list(FINISHED_JOB_STATES) + [self.max_finished_jobs]
+                )
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get a job snapshot"""
+        with self._lock:
+            row = self._conn.execute("SELECT owner, data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return dict(json.loads(row['data']), owner=row['owner']) if row else None
+
+    def list_jobs(
+        self,
+        scanner_id: Optional[str] = None,
+        status: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """List job snapshots, newest first"""
+        clauses = []
+        args: List[Any] = []
+        if scanner_id:
+            clauses.append("scanner_id = ?")
+            args.append(scanner_id)
+        if status:
+            clauses.append("status = ?")
+            args.append(status)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT owner, data FROM jobs {where} ORDER BY created_at DESC", args
+            ).fetchall()
+        return [dict(json.loads(row['data']), owner=row['owner']) for row in rows]
+
+    def send_command(self, owner: str, command: Dict[str, Any]):
+        """Queue a command for the owner process"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO commands (owner, payload) VALUES (?, ?)", (owner, json.dumps(command))
+            )
+
+    def take_commands(self, owner: str) -> List[Dict[str, Any]]:
+        """Remove and return the commands queued for owner, oldest first"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, payload FROM commands WHERE owner = ? ORDER BY id", (owner,)
+                ).fetchall()
+                if rows:
+                    self._conn.execute(
+                        "DELETE FROM commands WHERE owner = ? AND id <= ?", (owner, rows[-1]['id'])
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [json.loads(row['payload']) for row in rows]
+
+    def set_value(self, key: str, value: Any):
+        """Store a shared setting"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, json.dumps(value))
+            )
+
+    def get_value(self, key: str) -> Any:
+        """Read a shared setting"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return json.loads(row['value']) if row else None
+
+    def list_values(self, prefix: str) -> Dict[str, Any]:
+        """Read all shared settings whose key starts with prefix"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value FROM settings WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)
+            ).fetchall()
+        return {row['key']: json.loads(row['value']) for row in rows}
+
+    def delete_value(self, key: str):
+        """Remove a shared setting"""
+        with self._lock:
+            self._conn.execute("DELETE FROM settings WHERE key = ?", (key,))
+
+    def sync_epoch(self) -> str:
+        """Identify this store's sync log; it changes whenever the log starts over"""
+        with self._lock:
+            # The first worker to ask picks the epoch; it stays with the database file
+            self._conn.execute(
+                "INSERT OR IGNORE INTO settings (key, value) VALUES ('sync:epoch', ?)",
+                (json.dumps(uuid.uuid4().hex[:12]),)
+            )
+            row = self._conn.execute("SELECT value FROM settings WHERE key = 'sync:epoch'").fetchone()
+        return json.loads(row['value'])
+
+    def append_change(self, change: Dict[str, Any], keep: int) -> int:
+        """Add a change to the sync log under the next sequence number, keeping the newest keep"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                seq = self._conn.execute(
+                    "INSERT INTO sync_changes (payload) VALUES (?)", (json.dumps(change),)
+                ).lastrowid
+                self._conn.execute("DELETE FROM sync_changes WHERE seq <= ?", (seq - keep,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return seq
+
+    def changes_after(self, since: Optional[int]) -> Tuple[int, int, List[Dict[str, Any]]]:
+        """Get (oldest kept seq, latest seq, changes after since), oldest first
+
+        With since None, only the bounds are read.
+        """
+        with self._lock:
+            # One read transaction, so trimming by another worker cannot split the answer
+            self._conn.execute("BEGIN")
+            try:
+                bounds = self._conn.execute("SELECT MIN(seq), MAX(seq) FROM sync_changes").fetchone()
+                latest = self._conn.execute(
+                    "SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'sync_changes'"
+                ).fetchone()[0]
+                rows = [] if since is None else self._conn.execute(
+                    "SELECT seq, payload FROM sync_changes WHERE seq > ? ORDER BY seq", (since,)
+                ).fetchall()
+            finally:
+                self._conn.execute("COMMIT")
+        oldest = bounds[0] if bounds[0] is not None else latest + 1
+        return oldest, latest, [dict(json.loads(row['payload']), seq=row['seq']) for row in rows]
+
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            self._conn.close()
+
+
+def create_coordination_store(url: str = "local://", max_finished_jobs: int = 500):
+    """Create a coordination store from a URL (local:// or sqlite:///path)"""
+    if url.startswith("sqlite:///"):
+        return SQLiteCoordinationStore(_sqlite_path(url), max_finished_jobs=max_finished_jobs)
+    if url.startswith("local://"):
+        return LocalCoordinationStore(max_finished_jobs=max_finished_jobs)
+    raise ValueError(f"Unsupported coordination store: {url}")
+
+
+class Coordinator:
+    """Owns this process's device leases and relays work between processes"""
+
+    def __init__(
+        self,
+        store,
+        lease_seconds: float = 15,
+        poll_interval: float = 0.5,
+        metrics_interval: float = 10
+    ):
+        """Initialize coordinator"""
+        self.store = store
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.metrics_interval = metrics_interval
+        # Called with each command sent to this process by another one
+        self.command_handler: Optional[Callable[[Dict[str, Any]], None]] = None
+        # Returns this process's metrics snapshot for other workers to aggregate
+        self.metrics_provider: Optional[Callable[[], Dict[str, Any]]] = None
+        self._local_scanners: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def owner_id(self) -> str:
+        """Identity of this process; read per call so it stays right after a fork"""
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def publish_scanners(self, scanners: List[Dict[str, Any]]):
+        """Claim the scanners this process discovered and drop vanished ones"""
+        with self._lock:
+            self._local_scanners = {scanner['id']: scanner for scanner in scanners}
+        owned = self._claim_local_scanners()
+        self.store.release_devices(self.owner_id, keep=owned)
+        logger.info(f"Coordinator {self.owner_id}: owns {len(owned)} of {len(scanners)} scanner(s)")
+
+    def _claim_local_scanners(self) -> List[str]:
+        """Take or renew leases on every locally available scanner that is free"""
+        with self._lock:
+            scanners = list(self._local_scanners.values())
+        return [
+            scanner['id'] for scanner in scanners
+            if self.store.claim_device(scanner['id'], self.owner_id, scanner, self.lease_seconds)
+        ]
+
+    def resolve_owner(self, device_id: str, available_locally: bool = False) -> Optional[str]:
+        """Find the process driving a device, claiming it if it is free and local"""
+        owner = self.store.device_owner(device_id)
+        if owner is None and available_locally:
+            with self._lock:
+                info = self._local_scanners.get(device_id, {'id': device_id})
+            if self.store.claim_device(device_id, self.owner_id, info, self.lease_seconds):
+                return self.owner_id
+            owner = self.store.device_owner(device_id)
+        return owner
+
+    def is_local(self, owner: Optional[str]) -> bool:
+        """Whether an owner ID refers to this process"""
+        return owner == self.owner_id
+
+    def list_scanners(self) -> List[Dict[str, Any]]:
+        """Get every scanner driven by a live owner"""
+        return self.store.list_devices()
+
+    def count_scanners(self) -> int:
+        """Count scanners driven by a live owner"""
+        return self.store.count_devices()
+
+    def get_scanner(self, scanner_id: str) -> Optional[Dict[str, Any]]:
+        """Get one scanner driven by a live owner"""
+        for scanner in self.store.list_devices():
+            if scanner['id'] == scanner_id:
+                return scanner
+        return None
+
+    def select_scanner(self, scanner_id: str):
+        """Record the selected scanner for every worker"""
+        self.store.set_value('current_scanner_id', scanner_id)
+
+    def get_current_scanner_id(self) -> Optional[str]:
+        """Get the selected scanner"""
+        return self.store.get_value('current_scanner_id')
+
+    def publish_job(self, job: Dict[str, Any], owner: Optional[str] = None):
+        """Record a job snapshot, owned by this process unless told otherwise"""
+        self.store.put_job(job, owner=owner or self.owner_id)
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get the latest snapshot of a job from any process"""
+        return self.store.get_job(job_id)
+
+    def list_jobs(self, scanner_id: Optional[str] = None, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        """List job snapshots from every process, newest first"""
+        return self.store.list_jobs(scanner_id=scanner_id, status=status)
+
+    def forward(self, owner: str, command: Dict[str, Any]):
+        """Hand a command to the process that owns a device"""
+        self.store.send_command(owner, command)
+        logger.info(f"Forwarded {command.get('type')} command to {owner}")
+
+    def publish_metrics(self):
+        """Share this process's metrics snapshot with the other workers"""
+        if self.metrics_provider:
+            self.store.set_value(f"metrics:{self.owner_id}", self.metrics_provider())
+
+    def collect_metrics(self) -> List[Dict[str, Any]]:
+        """Get a fresh snapshot of this process plus the latest one of every other live worker
+
+        Snapshots older than three publish intervals belong to workers that
+        have exited and are left out.
+        """
+        own_key = f"metrics:{self.owner_id}"
+        snapshots = [self.metrics_provider()] if self.metrics_provider else []
+        cutoff = time.time() - 3 * self.metrics_interval
+        for key, snapshot in self.store.list_values("metrics:").items():
+            if key != own_key and snapshot.get('created', 0) >= cutoff:
+                snapshots.append(snapshot)
+        return snapshots
+
+    def start(self):
+        """Start renewing leases and serving forwarded commands"""
+        if self._thread:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="coordinator", daemon=True)
+        self._thread.start()
+        logger.info(f"Coordinator started as {self.owner_id}")
+
+    def _run(self):
+        """Poll the command inbox; renew leases a few times per lease period"""
+        renew_every = max(self.lease_seconds / 3, self.poll_interval)
+        next_renewal = 0.0
+        next_metrics = 0.0
+        while not self._stop_event.is_set():
+            try:
+                if time.monotonic() >= next_renewal:
+                    self.store.renew_leases(self.owner_id, self.lease_seconds)
+                    # Take over devices whose previous owner stopped renewing
+                    self._claim_local_scanners()
+                    next_renewal = time.monotonic() + renew_every
+                if time.monotonic() >= next_metrics:
+                    self.publish_metrics()
+                    next_metrics = time.monotonic() + self.metrics_interval
+                for command in self.store.take_commands(self.owner_id):
+                    self._dispatch(command)
+            except Exception as e:
+                logger.error(f"Coordinator error: {str(e)}")
+            self._stop_event.wait(self.poll_interval)
+
+    def _dispatch(self, command: Dict[str, Any]):
+        """Pass a forwarded command to the handler"""
+        if not self.command_handler:
+            logger.warning(f"No handler for forwarded command: {command.get('type')}")
+            return
+        try:
+            self.command_handler(command)
+        except Exception as e:
+            logger.error(f"Error handling forwarded {command.get('type')} command: {str(e)}")
+
+    def stop(self):
+        """Stop the coordinator and give up this process's device leases"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        # Serve anything forwarded while we were stopping, then hand devices over
+        for command in self.store.take_commands(self.owner_id):
+            self._dispatch(command)
+        self.store.release_devices(self.owner_id)
+        self.store.delete_value(f"metrics:{self.owner_id}")
+        logger.info(f"Coordinator {self.owner_id} released its devices")
+
+
+# In-process channels for LocalPubSubManager: channel -> subscriber queues
+_local_channels: Dict[str, List[queue.Queue]] = {}
+_local_channels_lock = threading.Lock()
+
+
+class LocalPubSubManager(socketio.PubSubManager):
+    """Socket.IO pub/sub over in-process queues
+
+    Stands in for a real message queue in tests and single-process setups:
+    several Socket.IO servers in one process share events the same way
+    workers would through Redis.
+    """
+    name = 'local'
+
+    def __init__(self, channel: str = 'socketio', write_only: bool = False, logger=None):
+        """Subscribe to the in-process channel"""
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self._queue: queue.Queue = queue.Queue()
+        with _local_channels_lock:
+            _local_channels.setdefault(channel, []).append(self._queue)
+
+    def _publish(self, data):
+        """Deliver a message to every subscriber, serialized as a broker would"""
+        message = json.dumps(data)
+        with _local_channels_lock:
+            subscribers = list(_local_channels.get(self.channel, []))
+        for subscriber in subscribers:
+            subscriber.put(message)
+
+    def _listen(self):
+        """Yield messages published on the channel"""
+        while True:
+            yield self._queue.get()
+
+
+class SQLitePubSubManager(socketio.PubSubManager):
+    """Socket.IO pub/sub through a SQLite table shared by workers on one host
+
+    Messages are polled, so delivery to other workers lags by up to
+    poll_interval. Use a Redis or AMQP message queue across hosts.
+    """
+    name = 'sqlite'
+
+    # Messages older than this are removed; every listener has seen them by then
+    RETENTION_SECONDS = 60
+
+    def __init__(
+        self,
+        url: str,
+        channel: str = 'socketio',
+        write_only: bool = False,
+        logger=None,
+        poll_interval: float = 0.05
+    ):
+        """Open the shared message table"""
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.db_path = _sqlite_path(url)
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._conn = _connect(self.db_path)
+        with self._lock:
+            self._conn.executescript(SCHEMA)
+            # Only deliver messages published from now on
+            self._last_id = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+        self._last_cleanup = time.monotonic()
+
+    def _publish(self, data):
+        """Append a message to the shared table"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO messages (channel, payload, created_at) VALUES (?, ?, ?)",
+                (self.channel, json.dumps(data), now)
+            )
+            if time.monotonic() - self._last_cleanup > self.RETENTION_SECONDS:
+                self._conn.execute(
+                    "DELETE FROM messages WHERE created_at < ?", (now - self.RETENTION_SECONDS,)
+                )
+                self._last_cleanup = time.monotonic()
+
+    def _listen(self):
+        """Yield messages appended after the last one seen"""
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, payload FROM messages WHERE channel = ? AND id > ? ORDER BY id",
+                    (self.channel, self._last_id)
+                ).fetchall()
+            if not rows:
+                time.sleep(self.poll_interval)
+                continue
+            self._last_id = rows[-1]['id']
+            for row in rows:
+                yield row['payload']
+
+
+def socketio_queue_options(url: Optional[str], channel: str = 'scanner-bridge') -> Dict[str, Any]:
+    """SocketIO keyword arguments for a message queue URL
+
+    local:// and sqlite:///path use the managers above; any other URL
+    (redis://, amqp://, kafka://) is handed to Flask-SocketIO, which needs
+    the matching client library installed.
+    """
+    if not url:
+        return {}
+    if url.startswith("local://"):
+        return {'client_manager': LocalPubSubManager(channel=channel)}
+    if url.startswith("sqlite:///"):
+        return {'client_manager': SQLitePubSubManager(url, channel=channel)}
+    return {'message_queue': url, 'channel': channel}
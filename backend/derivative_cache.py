@@ -0,0 +1,286 @@
+"""
+Derivative Cache - Content-addressed cache for converted/optimized images
+
+Derived files are named after a hash of the source identity (path, mtime,
+size), the operation and its parameters, so different parameters never
+collide and repeated requests are served straight from disk. Concurrent
+requests for the same derivative share a single encode.
+
+Size and access recency of every cached file are tracked in memory, so the
+directory can be held under a byte budget with LRU eviction without
+re-listing it. The index is per process: each gunicorn worker enforces
+max_bytes over the files it has built or served, so with N workers the
+directory can grow to N times the budget. Derivatives are handed out as
+open file handles, so a file evicted by another worker stays readable
+for the request already serving it.
+"""
+
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Any, Callable, BinaryIO
+
+logger = logging.getLogger(__name__)
+
+# Temp files older than this are from builds that will never finish
+STALE_TEMP_SECONDS = 3600
+
+# Builds per request before giving up on a derivative that keeps being evicted
+BUILD_ATTEMPTS = 3
+
+
+class _Flight:
+    """An in-progress derivative build that other requests can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error: Optional[Exception] = None
+
+
+class DerivativeCache:
+    """Content-addressed derivative store with single-flight builds and LRU eviction"""
+
+    def __init__(self, cache_dir: str = "./cache", max_bytes: Optional[int] = None):
+        """Initialize derivative cache"""
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = 0
+        # file name -> [size, last access time], least recently used first
+        self._entries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._maintenance_thread: Optional[threading.Thread] = None
+        self._load_index()
+
+    def _load_index(self):
+        """Seed the index from the cache directory once at startup"""
+        found = []
+        now = time.time()
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # Renamed or removed by another worker meanwhile
+                    continue
+                if entry.name.endswith('.tmp'):
+                    # Left behind by an interrupted build; younger ones may be
+                    # another worker's build still in progress
+                    if now - stat.st_mtime > STALE_TEMP_SECONDS:
+                        try:
+                            os.unlink(entry.path)
+                        except FileNotFoundError:
+                            pass
+                    continue
+                found.append((max(stat.st_atime, stat.st_mtime), entry.name, stat.st_size))
+
+        with self._lock:
+            for accessed, name, size in sorted(found):
+                self._entries[name] = [size, accessed]
+                self.total_bytes += size
+            self._evict_over_budget()
+        logger.info(f"Cache index loaded: {len(found)} file(s), {self.total_bytes} bytes")
+
+    def make_key(self, source_path: str, operation: str, params: Dict[str, Any]) -> str:
+        """Hash the source identity, operation and parameters into a cache key"""
+        stat = os.stat(source_path)
+        material = json.dumps(
+            [os.path.abspath(source_path), stat.st_mtime_ns, stat.st_size, operation, params],
+            sort_keys=True
+        )
+        return hashlib.sha256(material.encode()).hexdigest()[:32]
+
+    def get_or_create(
+        self,
+        source_path: str,
+        operation: str,
+        params: Dict[str, Any],
+        extension: str,
+        producer: Callable[[str], None]
+    ) -> BinaryIO:
+        """Open the cached derivative, building it with producer(output_path) on a miss
+
+        The producer writes to a temporary path that is atomically renamed
+        into place, so readers never see a partial file. The caller owns
+        the returned handle.
+        """
+        key = self.make_key(source_path, operation, params)
+        path = self.cache_dir / f"{key}.{extension}"
+
+        # Fast path: no Pillow, just an index touch
+        handle = self._open(path)
+        if handle:
+            self._record_hit(path.name)
+            return handle
+
+        for _ in range(BUILD_ATTEMPTS):
+            built = self._build(key, path, producer)
+            handle = self._open(path)
+            if handle:
+                if built:
+                    logger.debug(f"Derivative cached: {operation} {params} -> {path.name}")
+                else:
+                    self._record_hit(path.name)
+                return handle
+            # Evicted between the build and the open; build it again
+            logger.debug(f"Derivative evicted before it was served: {path.name}")
+
+        raise FileNotFoundError(f"Derivative evicted {BUILD_ATTEMPTS} times while building: {path.name}")
+
+    def _open(self, path: Path) -> Optional[BinaryIO]:
+        """Open a cached file, or None if it does not exist"""
+        try:
+            return open(path, 'rb')
+        except FileNotFoundError:
+            return None
+
+    def _build(self, key: str, path: Path, producer: Callable[[str], None]) -> bool:
+        """Build the derivative once across concurrent requests; True if this call built it"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+
+        if not leader:
+            flight.done.wait()
+            if flight.error:
+                raise flight.error
+            return False
+
+        temp_path = self.cache_dir / f".{key}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            # Another leader may have finished between our check and registering
+            if path.exists():
+                return False
+            producer(str(temp_path))
+            size = temp_path.stat().st_size
+            os.replace(temp_path, path)
+            self._record_miss(path.name, size)
+            return True
+        except Exception as e:
+            flight.error = e
+            if temp_path.exists():
+                temp_path.unlink()
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _record_hit(self, name: str):
+        """Count a cache hit and mark the file most recently used"""
+        with self._lock:
+            self.hits += 1
+            entry = self._entries.get(name)
+            if entry is None:
+                # Written by someone else; start tracking it
+                try:
+                    entry = [(self.cache_dir / name).stat().st_size, 0.0]
+                except FileNotFoundError:
+                    return
+                self._entries[name] = entry
+                self.total_bytes += entry[0]
+            entry[1] = time.time()
+            self._entries.move_to_end(name)
+
+    def _record_miss(self, name: str, size: int):
+        """Count a cache miss, track the new file and evict to stay in budget"""
+        with self._lock:
+            self.misses += 1
+            previous = self._entries.pop(name, None)
+            if previous:
+                self.total_bytes -= previous[0]
+            self._entries[name] = [size, time.time()]
+            self.total_bytes += size
+            self._evict_over_budget()
+
+    def _remove_entry(self, name: str):
+        """Delete a cached file and drop it from the index (lock held)"""
+        size, _ = self._entries.pop(name)
+        self.total_bytes -= size
+        self.evictions += 1
+        try:
+            (self.cache_dir / name).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _evict_over_budget(self):
+        """Evict least recently used files until under max_bytes (lock held)"""
+        if not self.max_bytes:
+            return
+        # Never evict the newest entry, even if it alone exceeds the budget
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            self._remove_entry(next(iter(self._entries)))
+
+    def evict_older_than(self, max_age_seconds: float) -> int:
+        """Evict files not accessed within max_age_seconds"""
+        cutoff = time.time() - max_age_seconds
+        with self._lock:
+            stale = [name for name, (_, accessed) in self._entries.items() if accessed < cutoff]
+            for name in stale:
+                self._remove_entry(name)
+        if stale:
+            logger.info(f"Cache: evicted {len(stale)} file(s) idle for over {max_age_seconds}s")
+        return len(stale)
+
+    def enforce_limits(self) -> int:
+        """Evict until the cache fits its byte budget"""
+        with self._lock:
+            before = self.evictions
+            self._evict_over_budget()
+            evicted = self.evictions - before
+        if evicted:
+            logger.info(f"Cache: evicted {evicted} file(s), {self.total_bytes} bytes in use")
+        return evicted
+
+    def start_maintenance(self, interval: float):
+        """Periodically enforce the byte budget on a background thread"""
+        if self._maintenance_thread or interval <= 0:
+            return
+
+        def run():
+            while not self._stop_event.wait(interval):
+                try:
+                    self.enforce_limits()
+                except Exception as e:
+                    logger.error(f"Cache maintenance error: {str(e)}")
+
+        self._maintenance_thread = threading.Thread(target=run, name="cache-maintenance", daemon=True)
+        self._maintenance_thread.start()
+        logger.info(f"Cache maintenance every {interval}s, budget {self.max_bytes} bytes")
+
+    def stop_maintenance(self):
+        """Stop the background maintenance thread"""
+        self._stop_event.set()
+        if self._maintenance_thread:
+            self._maintenance_thread.join()
+            self._maintenance_thread = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache counters and usage"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "total_bytes": self.total_bytes,
+                "max_bytes": self.max_bytes
+            }
@@ -0,0 +1,151 @@
+"""
+Discovery Service - Periodic, incremental scanner discovery
+
+Discovery passes run on a background thread every scanner.detection_interval
+seconds. The scanner registry stays readable throughout (each pass swaps in
+a complete list), only the differences from the previous pass are reported,
+and the interval backs off while passes are slow or failing.
+"""
+
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Any, Callable
+
+from scanner_manager import ScannerManager
+
+logger = logging.getLogger(__name__)
+
+
+class DiscoveryService:
+    """Runs scanner discovery on a schedule with backoff"""
+
+    def __init__(
+        self,
+        scanner_manager: ScannerManager,
+        interval: float = 5,
+        max_interval: float = 300,
+        slow_pass_seconds: Optional[float] = None,
+        on_change: Optional[Callable[[Dict[str, List[Any]]], None]] = None
+    ):
+        """Initialize discovery service
+
+        interval <= 0 disables periodic passes; discovery then only runs on
+        start and when triggered. A pass taking longer than
+        slow_pass_seconds (default: interval) doubles the wait before the
+        next one, up to max_interval.
+        """
+        self.scanner_manager = scanner_manager
+        self.interval = interval
+        self.max_interval = max(max_interval, interval)
+        self.slow_pass_seconds = slow_pass_seconds or (interval if interval > 0 else 30)
+        self.on_change = on_change
+        self.current_interval = interval
+        self.passes = 0
+        self.failures = 0
+        self.last_started: Optional[str] = None
+        self.last_duration: Optional[float] = None
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        # Triggers requested so far and the latest one a finished pass covered
+        self._requested = 0
+        self._completed = 0
+        self._generation_changed = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, immediate: bool = True):
+        """Start the discovery thread, running the first pass right away if immediate"""
+        if self._thread:
+            return
+        self._stop_event.clear()
+        if immediate:
+            self._wake_event.set()
+        self._thread = threading.Thread(target=self._run, name="scanner-discovery", daemon=True)
+        self._thread.start()
+        logger.info(f"Scanner discovery every {self.interval}s (backing off to {self.max_interval}s)")
+
+    def trigger(self) -> int:
+        """Run a discovery pass as soon as possible, returning its generation for wait_idle"""
+        with self._generation_changed:
+            self._requested += 1
+            generation = self._requested
+        self._wake_event.set()
+        return generation
+
+    def wait_idle(self, timeout: Optional[float] = None, generation: Optional[int] = None) -> bool:
+        """Wait for a pass started after trigger() returned generation, returning whether one finished
+
+        A pass already running when trigger() was called does not count.
+        generation defaults to the latest trigger.
+        """
+        with self._generation_changed:
+            if generation is None:
+                generation = self._requested
+            return self._generation_changed.wait_for(lambda: self._completed >= generation, timeout)
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop the discovery thread, waiting up to timeout for a running pass"""
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        """Run passes until stopped"""
+        while not self._stop_event.is_set():
+            timeout = self.current_interval if self.interval > 0 else None
+            self._wake_event.wait(timeout)
+            self._wake_event.clear()
+            if self._stop_event.is_set():
+                break
+            self.run_once()
+
+    def run_once(self) -> Optional[Dict[str, List[Any]]]:
+        """Run one discovery pass, report changes and adjust the interval"""
+        with self._generation_changed:
+            # Triggers up to here are answered by this pass
+            generation = self._requested
+        started = time.monotonic()
+        self.last_started = datetime.now().isoformat()
+        delta = self.scanner_manager.refresh_scanner_list()
+        self.last_duration = round(time.monotonic() - started, 3)
+        self.passes += 1
+
+        if delta is None or self.last_duration > self.slow_pass_seconds:
+            if delta is None:
+                self.failures += 1
+            backoff = min(max(self.current_interval, 1) * 2, self.max_interval)
+            if backoff != self.current_interval:
+                logger.warning(
+                    f"Scanner discovery {'failed' if delta is None else 'slow'} "
+                    f"({self.last_duration}s), next pass in {backoff}s"
+                )
+            self.current_interval = backoff
+        elif self.current_interval != self.interval:
+            logger.info(f"Scanner discovery recovered, interval back to {self.interval}s")
+            self.current_interval = self.interval
+
+        if delta and any(delta.values()) and self.on_change:
+            try:
+                self.on_change(delta)
+            except Exception as e:
+                logger.error(f"Error in discovery change callback: {str(e)}")
+
+        with self._generation_changed:
+            self._completed = max(self._completed, generation)
+            self._generation_changed.notify_all()
+        return delta
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get discovery timing and backoff state"""
+        return {
+            "interval": self.interval,
+            "current_interval": self.current_interval,
+            "passes": self.passes,
+            "failures": self.failures,
+            "last_started": self.last_started,
+            "last_duration": self.last_duration,
+            "running": self._thread is not None
+        }
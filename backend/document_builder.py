@@ -0,0 +1,328 @@
+"""
+Document Builder - Multi-page PDF and TIFF documents streamed page by page
+
+Pages are encoded one at a time and written out as soon as they are
+ready, so a document of any length holds about one page in memory.
+JPEG scans are copied into the document as they are: PDF embeds them
+with DCTDecode and TIFF stores them as JPEG-compressed strips, with no
+decode or recompression. Other pages are decoded once and stored
+losslessly with Deflate.
+
+Both writers know every object's offset in advance or as they go, so
+neither needs to seek back: the PDF cross-reference table and the TIFF
+next-IFD links are computed from the byte counts already written.
+"""
+
+import zlib
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Any, Iterator, Iterable, Tuple
+
+try:
+    from PIL import Image
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+
+from pnm_stream import scale_to_8bit
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_FORMATS = ('pdf', 'tiff')
+DOCUMENT_CONTENT_TYPES = {'pdf': 'application/pdf', 'tiff': 'image/tiff'}
+MAX_DOCUMENT_PAGES = 500
+
+# Size of the pieces JPEG files are copied in
+CHUNK_SIZE = 256 * 1024
+DEFAULT_DPI = 300.0
+# Rows of decoded pixels compressed at a time
+BAND_ROWS = 256
+# Integer grayscale modes holding 16-bit samples, scaled down to 8 bits
+SIXTEEN_BIT_MODES = ('I', 'I;16', 'I;16B', 'I;16L')
+
+
+class DocumentError(ValueError):
+    """Raised for a document that cannot be built"""
+    pass
+
+
+@dataclass
+class EncodedPage:
+    """One page ready to be written, either a JPEG file to copy or Deflate data"""
+    width: int
+    height: int
+    mode: str
+    dpi: Tuple[float, float]
+    compression: str
+    length: int
+    path: Optional[str] = None
+    data: Optional[bytes] = None
+    subsampling: Tuple[int, int] = (1, 1)
+    inverted: bool = False
+
+    def chunks(self) -> Iterator[bytes]:
+        """Compressed page data in pieces"""
+        if self.data is not None:
+            yield self.data
+            return
+        with open(self.path, 'rb') as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+
+def _dpi(image: "Image.Image", fallback: Optional[float]) -> Tuple[float, float]:
+    """Resolution stored in the file, else the scan's resolution"""
+    dpi = image.info.get('dpi')
+    if dpi and dpi[0] and dpi[1]:
+        return float(dpi[0]), float(dpi[1])
+    return (float(fallback or DEFAULT_DPI),) * 2
+
+
+def probe_jpeg(path: str, target_format: str, dpi: Optional[float] = None) -> Optional[EncodedPage]:
+    """Describe a JPEG that can be copied into the document without decoding
+
+    Reads only the file header. Returns None when the page must be
+    decoded: not a JPEG, or a kind of JPEG the target cannot carry
+    (TIFF strips take baseline grayscale or YCbCr JPEG only).
+    """
+    with Image.open(path) as image:
+        if image.format != 'JPEG' or image.mode not in ('L', 'RGB', 'CMYK'):
+            return None
+        if target_format == 'tiff':
+            if image.mode == 'CMYK' or image.info.get('progressive') or image.info.get('progression'):
+                return None
+            if image.mode == 'RGB' and image.info.get('adobe_transform') == 0:
+                # Stored as RGB rather than YCbCr
+                return None
+        size = image.size
+        layers = image.layer
+        page = EncodedPage(
+            width=size[0],
+            height=size[1],
+            mode=image.mode,
+            dpi=_dpi(image, dpi),
+            compression='jpeg',
+            length=0,
+            path=str(path),
+            # Chroma subsampling: luma sampling factors over chroma's
+            subsampling=(
+                layers[0][1] // max(1, layers[1][1]), layers[0][2] // max(1, layers[1][2])
+            ) if image.mode == 'RGB' else (1, 1),
+            # Adobe CMYK JPEGs store inverted ink values
+            inverted=image.mode == 'CMYK' and 'adobe' in image.info
+        )
+    with open(path, 'rb') as f:
+        f.seek(0, 2)
+        page.length = f.tell()
+    return page
+
+
+def encode_page(path: str, target_format: str, dpi: Optional[float] = None) -> EncodedPage:
+    """Prepare a page: JPEG passthrough when possible, else decode and Deflate"""
+    page = probe_jpeg(path, target_format, dpi)
+    if page:
+        return page
+    with Image.open(path) as image:
+        resolution = _dpi(image, dpi)
+        if image.mode in SIXTEEN_BIT_MODES:
+            image = scale_to_8bit(image)
+        elif image.mode not in ('1', 'L', 'RGB'):
+            image = image.convert('L' if image.mode in ('LA', 'F') else 'RGB')
+        else:
+            image.load()
+        # Compressed in bands of rows, so no second full copy of the pixels is made
+        compressor = zlib.compressobj(6)
+        parts = []
+        for top in range(0, image.height, BAND_ROWS):
+            band = image.crop((0, top, image.width, min(image.height, top + BAND_ROWS)))
+            parts.append(compressor.compress(band.tobytes()))
+        parts.append(compressor.flush())
+        data = b''.join(parts)
+        return EncodedPage(
+            width=image.width,
+            height=image.height,
+            mode=image.mode,
+            dpi=resolution,
+            compression='deflate',
+            length=len(data),
+            data=data
+        )
+
+
+def stream_pdf(pages: Iterable[EncodedPage], page_count: int) -> Iterator[bytes]:
+    """Write a PDF, one image per page sized to the scan's resolution
+
+    Object numbers are fixed up front: 1 is the catalog, 2 the page tree,
+    and page i uses 3i+3 (page), 3i+4 (image) and 3i+5 (content stream).
+    """
+    offsets: Dict[int, int] = {}
+    position = 0
+
+    def obj(number: int, body: bytes) -> bytes:
+        nonlocal position
+        offsets[number] = position
+        data = f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+        position += len(data)
+        return data
+
+    header = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+    position += len(header)
+    yield header
+    yield obj(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+    kids = ' '.join(f"{3 * i + 3} 0 R" for i in range(page_count))
+    yield obj(2, f"<< /Type /Pages /Kids [{kids}] /Count {page_count} >>".encode())
+
+    written = 0
+    for index, page in enumerate(pages):
+        if index >= page_count:
+            raise DocumentError(f"More than the {page_count} announced pages")
+        number = 3 * index + 3
+        width = page.width * 72.0 / page.dpi[0]
+        height = page.height * 72.0 / page.dpi[1]
+        yield obj(number, (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width:.2f} {height:.2f}] "
+            f"/Resources << /XObject << /Im0 {number + 1} 0 R >> >> /Contents {number + 2} 0 R >>"
+        ).encode())
+
+        colorspace = {'1': '/DeviceGray', 'L': '/DeviceGray', 'RGB': '/DeviceRGB', 'CMYK': '/DeviceCMYK'}[page.mode]
+        image_dict = (
+            f"<< /Type /XObject /Subtype /Image /Width {page.width} /Height {page.height} "
+            f"/ColorSpace {colorspace} /BitsPerComponent {1 if page.mode == '1' else 8} "
+            f"/Filter {'/DCTDecode' if page.compression == 'jpeg' else '/FlateDecode'} /Length {page.length}"
+            f"{' /Decode [1 0 1 0 1 0 1 0]' if page.inverted else ''} >>\nstream\n"
+        ).encode()
+        offsets[number + 1] = position
+        head = f"{number + 1} 0 obj\n".encode() + image_dict
+        position += len(head)
+        yield head
+        copied = 0
+        for chunk in page.chunks():
+            copied += len(chunk)
+            yield chunk
+        if copied != page.length:
+            raise DocumentError(f"Page {index + 1} changed while being written")
+        tail = b"\nendstream\nendobj\n"
+        position += copied + len(tail)
+        yield tail
+
+        content = f"q {width:.2f} 0 0 {height:.2f} 0 0 cm /Im0 Do Q".encode()
+        yield obj(number + 2, f"<< /Length {len(content)} >>\nstream\n".encode() + content + b"\nendstream")
+        written += 1
+
+    if written != page_count:
+        raise DocumentError(f"Only {written} of {page_count} pages were written")
+
+    count = 3 * page_count + 3
+    xref = [f"xref\n0 {count}\n0000000000 65535 f \n"]
+    xref.extend(f"{offsets[number]:010d} 00000 n \n" for number in range(1, count))
+    xref.append(f"trailer\n<< /Size {count} /Root 1 0 R >>\nstartxref\n{position}\n%%EOF\n")
+    yield ''.join(xref).encode()
+
+
+# TIFF field types
+_SHORT, _LONG, _RATIONAL = 3, 4, 5
+_TYPE_SIZES = {_SHORT: 2, _LONG: 4, _RATIONAL: 8}
+
+
+def _tiff_ifd(offset: int, entries: List[Tuple[int, int, List[Any]]]) -> Tuple[bytes, int]:
+    """Encode an IFD at offset with out-of-line values right after it
+
+    Returns the IFD bytes, with the next-IFD link left as zero, and the
+    position of that link within them.
+    """
+    entries = sorted(entries)
+    size = 2 + 12 * len(entries) + 4
+    ifd = bytearray(len(entries).to_bytes(2, 'little'))
+    extra = bytearray()
+    for tag, kind, values in entries:
+        if kind == _RATIONAL:
+            encoded = b''.join(n.to_bytes(4, 'little') + d.to_bytes(4, 'little') for n, d in values)
+        else:
+            encoded = b''.join(v.to_bytes(_TYPE_SIZES[kind], 'little') for v in values)
+        ifd += tag.to_bytes(2, 'little') + kind.to_bytes(2, 'little') + len(values).to_bytes(4, 'little')
+        if len(encoded) <= 4:
+            ifd += encoded.ljust(4, b'\0')
+        else:
+            ifd += (offset + size + len(extra)).to_bytes(4, 'little')
+            extra += encoded
+    link = len(ifd)
+    ifd += b'\0\0\0\0'
+    return bytes(ifd + extra), link
+
+
+def stream_tiff(pages: Iterable[EncodedPage], page_count: int) -> Iterator[bytes]:
+    """Write a little-endian multi-page TIFF, each page an IFD followed by one strip
+
+    Pages are encoded before being written, so each IFD already knows its
+    strip's length and where the next page's IFD will start.
+    """
+    position = 8
+    yield b"II*\0" + position.to_bytes(4, 'little')
+
+    written = 0
+    for index, page in enumerate(pages):
+        if index >= page_count:
+            raise DocumentError(f"More than the {page_count} announced pages")
+        samples = 3 if page.mode == 'RGB' else 1
+        if page.compression == 'jpeg':
+            # JPEG-compressed color is stored as YCbCr
+            photometric = 6 if page.mode == 'RGB' else 1
+        else:
+            photometric = 2 if page.mode == 'RGB' else 1
+        entries: List[Tuple[int, int, List[Any]]] = [
+            (254, _LONG, [2]),
+            (256, _LONG, [page.width]),
+            (257, _LONG, [page.height]),
+            (258, _SHORT, [1 if page.mode == '1' else 8] * samples),
+            (259, _SHORT, [7 if page.compression == 'jpeg' else 8]),
+            (262, _SHORT, [photometric]),
+            (277, _SHORT, [samples]),
+            (278, _LONG, [page.height]),
+            (279, _LONG, [page.length]),
+            (282, _RATIONAL, [(round(page.dpi[0] * 100), 100)]),
+            (283, _RATIONAL, [(round(page.dpi[1] * 100), 100)]),
+            (284, _SHORT, [1]),
+            (296, _SHORT, [2]),
+            (297, _SHORT, [index, page_count]),
+        ]
+        if photometric == 6:
+            entries.append((530, _SHORT, list(page.subsampling)))
+
+        # The strip follows the IFD, whose size does not depend on the strip offset
+        ifd, _ = _tiff_ifd(position, entries + [(273, _LONG, [0])])
+        strip_offset = position + len(ifd)
+        ifd, link = _tiff_ifd(position, entries + [(273, _LONG, [strip_offset])])
+        end = strip_offset + page.length
+        # IFDs start on a word boundary
+        padding = end % 2
+        if end + padding > 0xFFFFFFFF:
+            raise DocumentError("TIFF documents are limited to 4 GB")
+        next_ifd = end + padding if index < page_count - 1 else 0
+        ifd = ifd[:link] + next_ifd.to_bytes(4, 'little') + ifd[link + 4:]
+        yield ifd
+
+        copied = 0
+        for chunk in page.chunks():
+            copied += len(chunk)
+            yield chunk
+        if copied != page.length:
+            raise DocumentError(f"Page {index + 1} changed while being written")
+        if padding:
+            yield b'\0'
+        position = end + padding
+        written += 1
+
+    if written != page_count:
+        raise DocumentError(f"Only {written} of {page_count} pages were written")
+
+
+def stream_document(pages: Iterable[EncodedPage], page_count: int, target_format: str) -> Iterator[bytes]:
+    """Write encoded pages as a PDF or TIFF document"""
+    if target_format == 'pdf':
+        return stream_pdf(pages, page_count)
+    if target_format == 'tiff':
+        return stream_tiff(pages, page_count)
+    raise DocumentError(f"Unsupported document format: {target_format}")
@@ -0,0 +1,73 @@
+"""
+Drivers - Pluggable scanner driver interface
+
+A driver discovers devices, reports their capabilities and streams scanned
+pages. ScannerManager dispatches scans to the driver registered for a
+scanner's driver_type; platform scanners without a native driver keep
+their built-in scan paths.
+"""
+
+from typing import Dict, List, Optional, Any, Callable, Iterator, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+
+class DriverError(Exception):
+    """Raised by a driver when a scan fails"""
+    pass
+
+
+class PaperJamError(DriverError):
+    """Raised when the document feeder jams mid-page"""
+    pass
+
+
+class DriverTimeoutError(DriverError):
+    """Raised when the device stops delivering data"""
+    pass
+
+
+class DriverCancelledError(DriverError):
+    """Raised when a scan is stopped through cancel()"""
+    pass
+
+
+class ScanDriver:
+    """Interface implemented by scanner drivers"""
+
+    # Scanner.platform and Scanner.driver_type of the devices this driver serves
+    platform = "unknown"
+    driver_type = "unknown"
+
+    def discover(self) -> List[Dict[str, Any]]:
+        """List devices as dicts with id, name, manufacturer, model and capabilities"""
+        raise NotImplementedError
+
+    def capabilities(self, device_id: str) -> Dict[str, Any]:
+        """Get the capabilities of a device"""
+        raise NotImplementedError
+
+    def scan_stream(
+        self,
+        device_id: str,
+        params: Dict[str, Any],
+        on_data: Optional[Callable[[int, int], None]] = None
+    ) -> Iterator["Image.Image"]:
+        """Scan with API params, yielding each page once it has been fully received
+
+        Yields a single page unless params['batch'] is set, in which case
+        pages are yielded until the feeder runs out. on_data, when given,
+        is called with (bytes_received, bytes_expected) for the current page.
+        cancel() must stop the scan from the moment this returns, before the
+        first page is requested.
+        """
+        raise NotImplementedError
+
+    def cancel(self, device_id: str):
+        """Stop the scan running on a device, making scan_stream raise DriverCancelledError"""
+        raise NotImplementedError
+
+    def close(self):
+        """Release driver resources"""
+        pass
@@ -0,0 +1,150 @@
+"""
+Event Bus - Coalescing and batching of outbound Socket.IO events
+
+Events are queued in publish order, with the target (the list of rooms
+they go to) of each, and flushed on a short tick. An event published with
+a key replaces a still-queued event with the same key and target and
+moves to the back of the queue, so a burst of progress updates for a scan
+sends only the latest, after everything published before it. Consecutive
+events for the same target go out as one "event_batch" frame:
+
+    {"events": [{"event": "scan_completed", "data": {...}}, ...]}
+
+Clients unpack a batch and dispatch each event as if it had arrived on
+its own. A run of a single event sends it unwrapped. Frames are emitted in
+queue order, so a client in several rooms still sees events in the order
+they were published.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any, Callable, Hashable, Tuple
+
+from metrics import SOCKETIO_EVENTS, SOCKETIO_FRAMES
+
+logger = logging.getLogger(__name__)
+
+BATCH_EVENT = 'event_batch'
+
+
+class EventBus:
+    """Outbound event queue that coalesces superseded events and batches the rest"""
+
+    def __init__(self, socketio, flush_interval: float = 0.05, max_batch_size: int = 100):
+        """Initialize event bus; a flush_interval of 0 emits every event immediately"""
+        self.socketio = socketio
+        self.flush_interval = flush_interval
+        self.max_batch_size = max(1, max_batch_size)
+        # (target rooms, key) -> (event, data), in publish order
+        self._pending: "OrderedDict[Tuple[Tuple[str, ...], Hashable], Tuple[str, Dict[str, Any]]]" = OrderedDict()
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def publish(
+        self,
+        event: str,
+        data: Dict[str, Any],
+        rooms: List[str],
+        key: Optional[Hashable] = None,
+        merge: Optional[Callable[[Dict[str, Any], Dict[str, Any]], Dict[str, Any]]] = None
+    ):
+        """Queue an event for rooms
+
+        A queued event with the same key and rooms is superseded: it is
+        removed, or combined with this one by merge(old, new), and the
+        result is queued last, after events published since the old one.
+        """
+        if not rooms:
+            return
+        if self.flush_interval <= 0 or self._stop_event.is_set():
+            self._send(tuple(rooms), [(event, data)])
+            return
+
+        target = tuple(rooms)
+        with self._lock:
+            if key is None:
+                self._sequence += 1
+                key = ('_', self._sequence)
+            else:
+                key = (event, key)
+            previous = self._pending.pop((target, key), None)
+            if previous is not None:
+                SOCKETIO_EVENTS.inc(outcome='coalesced')
+                if merge:
+                    data = merge(previous[1], data)
+            self._pending[(target, key)] = (event, data)
+            full = len(self._pending) >= self.max_batch_size
+
+        self._ensure_started()
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """Send everything queued now, one frame per run of events for the same target"""
+        with self._lock:
+            pending, self._pending = self._pending, OrderedDict()
+        run_target: Optional[Tuple[str, ...]] = None
+        run: List[Tuple[str, Dict[str, Any]]] = []
+        for (target, _), event in pending.items():
+            if run and (target != run_target or len(run) >= self.max_batch_size):
+                self._send(run_target, run)
+                run = []
+            run_target = target
+            run.append(event)
+        if run:
+            self._send(run_target, run)
+
+    def _send(self, target: Tuple[str, ...], events: List[Tuple[str, Dict[str, Any]]]):
+        """Emit one frame to the union of the target rooms"""
+        try:
+            if len(events) == 1:
+                event, data = events[0]
+                self.socketio.emit(event, data, to=list(target))
+            else:
+                self.socketio.emit(BATCH_EVENT, {
+                    'events': [{'event': event, 'data': data} for event, data in events]
+                }, to=list(target))
+            SOCKETIO_EVENTS.inc(len(events), outcome='sent')
+            SOCKETIO_FRAMES.inc()
+        except Exception as e:
+            logger.error(f"Error emitting {len(events)} event(s) to {', '.join(target)}: {str(e)}")
+
+    def _ensure_started(self):
+        """Start the flush thread on first use"""
+        if self._thread or self._stop_event.is_set():
+            return
+        with self._lock:
+            if self._thread:
+                return
+            self._thread = threading.Thread(target=self._run, name="event-bus", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        """Flush every flush_interval, or early when a batch fills up"""
+        while not self._stop_event.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def stop(self):
+        """Stop the flush thread and send what is still queued"""
+        self._stop_event.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get queue settings and size"""
+        with self._lock:
+            return {
+                "flush_interval": self.flush_interval,
+                "max_batch_size": self.max_batch_size,
+                "pending": len(self._pending),
+                "targets": len({target for target, _ in self._pending})
+            }
@@ -0,0 +1,111 @@
+"""
+Gunicorn configuration - production server for Scanner Bridge
+
+Run from the backend directory:
+    gunicorn -c gunicorn.conf.py app:app
+
+Uses the gthread worker, which Flask-SocketIO supports in threading mode
+(WebSockets via simple-websocket). Scan workers are plain threads, so no
+monkey patching is involved. Settings come from the "server" section of
+config/scanner.config.json and can be overridden with environment variables.
+
+More than one worker needs a shared "coordination" store and message queue
+(e.g. sqlite:///./scans/coordination.sqlite3 for both on one host, or a
+redis:// message queue) so device ownership, job status and Socket.IO events
+are shared. Socket.IO long-polling also needs sticky sessions across workers,
+so clients should connect with the websocket transport.
+"""
+
+import os
+import json
+import signal
+import threading
+from pathlib import Path
+from typing import Optional
+
+
+def _load_config() -> dict:
+    """Read the shared config file without importing the app in the master"""
+    config_path = Path(__file__).resolve().parent.parent / "config" / "scanner.config.json"
+    if config_path.exists():
+        with open(config_path, 'r') as f:
+            return json.load(f)
+    return {}
+
+
+_config = _load_config()
+_api = _config.get('api', {})
+_server = _config.get('server', {})
+_coordination = _config.get('coordination', {})
+
+bind = os.environ.get(
+    'SCANNER_BRIDGE_BIND',
+    f"{_api.get('host', '127.0.0.1')}:{_api.get('port', 5000)}"
+)
+workers = int(os.environ.get('SCANNER_BRIDGE_WORKERS', _server.get('workers', 1)))
+worker_class = 'gthread'
+# Each thread serves one connection, including long-lived WebSockets, so
+# init_app caps WebSocket connections below this to keep threads for HTTP
+threads = int(os.environ.get('SCANNER_BRIDGE_THREADS', _server.get('threads', 100)))
+timeout = int(_server.get('timeout', 120))
+graceful_timeout = int(os.environ.get('SCANNER_BRIDGE_GRACEFUL_TIMEOUT', _server.get('graceful_timeout', 60)))
+keepalive = 5
+accesslog = '-'
+errorlog = '-'
+
+# The worker's app shutdown, started by the first signal that asks it to stop
+_shutdown_thread: Optional[threading.Thread] = None
+
+
+def on_starting(server):
+    """Warn when workers would not share scanners, jobs and events"""
+    if workers > 1 and (_coordination.get('store', 'local://').startswith('local://')
+                        or not _coordination.get('message_queue')):
+        server.log.warning(
+            f"{workers} workers configured without a shared coordination store and "
+            "message queue; each worker will see only its own scanners, jobs and events"
+        )
+
+
+def _start_shutdown(timeout: float) -> threading.Thread:
+    """Drain scans and close WebSockets on a background thread, once per worker"""
+    global _shutdown_thread
+    if _shutdown_thread is None:
+        from app import shutdown_app
+        _shutdown_thread = threading.Thread(target=shutdown_app, args=(timeout,), name="shutdown", daemon=True)
+        _shutdown_thread.start()
+    return _shutdown_thread
+
+
+def post_worker_init(worker):
+    """Initialize the app once per worker, without blocking on scanner discovery"""
+    from app import init_app
+    init_app(background_discovery=True, request_threads=threads)
+
+    # On SIGTERM gthread stops accepting, then waits graceful_timeout for open
+    # requests, WebSockets included, before worker_exit runs; by then the
+    # master has killed the worker. Start the drain as soon as the signal
+    # arrives so scans finish and WebSockets close within that wait.
+    handle_exit = worker.handle_exit
+
+    def handle_sigterm(sig, frame):
+        handle_exit(sig, frame)
+        # Leave headroom before the master's graceful timeout kills the worker
+        _start_shutdown(max(graceful_timeout - 5, 1))
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    signal.siginterrupt(signal.SIGTERM, False)
+
+
+def worker_int(worker):
+    """Quick shutdown on SIGINT/SIGQUIT: cancel scans so their devices are released"""
+    _start_shutdown(0)
+
+
+def worker_exit(server, worker):
+    """Wait for the app to shut down before the worker process exits"""
+    if os.getpid() != worker.pid:
+        # The master calls this for workers that are already gone
+        return
+    # Not started yet when the worker stopped on its own, e.g. after max_requests
+    _start_shutdown(max(graceful_timeout - 5, 1)).join()
@@ -0,0 +1,256 @@
+"""
+History Store - Persistent, indexed scan history backed by SQLite
+"""
+
+import os
+import base64
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Files in the scan directory that are treated as finished scans
+SCAN_SUFFIXES = {'.jpeg', '.jpg', '.png', '.tiff', '.tif', '.bmp', '.gif'}
+
+COLUMNS = [
+    'scan_id', 'scanner_id', 'timestamp', 'format', 'resolution',
+    'color_mode', 'file_path', 'file_size', 'status', 'batch_id', 'page'
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    scan_id TEXT PRIMARY KEY,
+    scanner_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    format TEXT NOT NULL,
+    resolution INTEGER NOT NULL,
+    color_mode TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    file_size INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    batch_id TEXT,
+    page INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_scans_timestamp ON scans (timestamp, scan_id);
+CREATE INDEX IF NOT EXISTS idx_scans_scanner ON scans (scanner_id, timestamp, scan_id);
+CREATE INDEX IF NOT EXISTS idx_scans_status ON scans (status, timestamp, scan_id);
+CREATE INDEX IF NOT EXISTS idx_scans_batch ON scans (batch_id, page);
+"""
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+    pass
+
+
+def encode_cursor(timestamp: str, scan_id: str) -> str:
+    """Build an opaque keyset cursor from a row's sort key"""
+    return base64.urlsafe_b64encode(f"{timestamp}|{scan_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """Split an opaque cursor back into (timestamp, scan_id)"""
+    try:
+        timestamp, scan_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|', 1)
+        return timestamp, scan_id
+    except Exception:
+        raise InvalidCursorError(f"Invalid cursor: {cursor}")
+
+
+class ScanHistoryStore:
+    """Scan records persisted in SQLite, newest first by (timestamp, scan_id)"""
+
+    def __init__(self, db_path: str, max_items: Optional[int] = None):
+        """Open (or create) the history database"""
+        self.db_path = str(db_path)
+        self.max_items = max_items
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            self._conn.commit()
+            # Cached so retention checks don't COUNT(*) on every insert
+            self._count = self._conn.execute("SELECT COUNT(*) FROM scans").fetchone()[0]
+
+    def add(self, record: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Insert or replace a record, returning any records pruned by the retention limit"""
+        values = [record.get(column) for column in COLUMNS]
+        with self._lock:
+            exists = self._conn.execute(
+                "SELECT 1 FROM scans WHERE scan_id = ?", (record.get('scan_id'),)
+            ).fetchone()
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO scans ({', '.join(COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in COLUMNS)})",
+                values
+            )
+            if not exists:
+                self._count += 1
+            pruned = self._prune()
+            self._conn.commit()
+        return pruned
+
+    def get(self, scan_id: str) -> Optional[Dict[str, Any]]:
+        """Get a record by scan ID"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM scans WHERE scan_id = ?", (scan_id,)).fetchone()
+        return dict(row) if row else None
+
+    def delete(self, scan_id: str) -> bool:
+        """Delete a record, returning whether it existed"""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM scans WHERE scan_id = ?", (scan_id,))
+            self._conn.commit()
+            self._count -= cursor.rowcount
+        return cursor.rowcount > 0
+
+    def batch_pages(self, batch_id: str) -> List[Dict[str, Any]]:
+        """Get the records of a batch in page order"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM scans WHERE batch_id = ? ORDER BY page, scan_id", (batch_id,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def count(self) -> int:
+        """Get total number of records"""
+        with self._lock:
+            return self._count
+
+    def query(
+        self,
+        limit: int = 50,
+        before: Optional[str] = None,
+        scanner_id: Optional[str] = None,
+        status: Optional[str] = None,
+        batch_id: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Get one page of records, newest first
+
+        Returns the records and a cursor for the next page, or None when
+        there are no more records.
+        """
+        clauses = []
+        args: List[Any] = []
+        if scanner_id:
+            clauses.append("scanner_id = ?")
+            args.append(scanner_id)
+        if status:
+            clauses.append("status = ?")
+            args.append(status)
+        if batch_id:
+            clauses.append("batch_id = ?")
+            args.append(batch_id)
+        if before:
+            timestamp, scan_id = decode_cursor(before)
+            clauses.append("(timestamp, scan_id) < (?, ?)")
+            args.extend([timestamp, scan_id])
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        limit = max(1, limit)
+        # Fetch one extra row to know whether another page exists
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM scans {where} ORDER BY timestamp DESC, scan_id DESC LIMIT ?",
+                args + [limit + 1]
+            ).fetchall()
+
+        items = [dict(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = items[-1]
+            next_cursor = encode_cursor(last['timestamp'], last['scan_id'])
+        return items, next_cursor
+
+    def rebuild_from_directory(self, scan_dir: Path) -> Tuple[int, int]:
+        """Reconcile the index with the files on disk
+
+        Scan files without a record are indexed with what can be recovered
+        from the file name and stat; records whose file is gone are dropped.
+        Returns (added, removed).
+        """
+        on_disk: Dict[str, os.DirEntry] = {}
+        with os.scandir(scan_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and Path(entry.name).suffix.lower() in SCAN_SUFFIXES:
+                    on_disk[Path(entry.name).stem] = entry
+
+        with self._lock:
+            known = {
+                row['scan_id']: row['file_path']
+                for row in self._conn.execute("SELECT scan_id, file_path FROM scans")
+            }
+
+            removed = [
+                scan_id for scan_id, file_path in known.items()
+                if scan_id not in on_disk and not os.path.exists(file_path)
+            ]
+            self._conn.executemany("DELETE FROM scans WHERE scan_id = ?", [(s,) for s in removed])
+
+            added = []
+            for scan_id, entry in on_disk.items():
+                if scan_id in known:
+                    continue
+                stat = entry.stat()
+                added.append([
+                    scan_id,
+                    "unknown",
+                    self._timestamp_from_scan_id(scan_id) or datetime.fromtimestamp(stat.st_mtime).isoformat(),
+                    Path(entry.name).suffix.lower().lstrip('.'),
+                    0,
+                    "unknown",
+                    str(Path(scan_dir) / entry.name),
+                    stat.st_size,
+                    "completed",
+                    None,
+                    None
+                ])
+            self._conn.executemany(
+                f"INSERT INTO scans ({', '.join(COLUMNS)}) VALUES ({', '.join('?' for _ in COLUMNS)})",
+                added
+            )
+            self._conn.commit()
+            self._count += len(added) - len(removed)
+
+        if added or removed:
+            logger.info(f"History index rebuilt: {len(added)} added, {len(removed)} removed")
+        return len(added), len(removed)
+
+    def _timestamp_from_scan_id(self, scan_id: str) -> Optional[str]:
+        """Recover the timestamp embedded in scan_YYYYmmdd_HHMMSS_<hex> IDs"""
+        parts = scan_id.split('_')
+        if len(parts) < 3 or parts[0] != 'scan':
+            return None
+        try:
+            return datetime.strptime(f"{parts[1]}_{parts[2]}", '%Y%m%d_%H%M%S').isoformat()
+        except ValueError:
+            return None
+
+    def _prune(self) -> List[Dict[str, Any]]:
+        """Delete the oldest records beyond max_items (lock held)"""
+        if not self.max_items:
+            return []
+        excess = self._count - self.max_items
+        if excess <= 0:
+            return []
+
+        rows = self._conn.execute(
+            "SELECT * FROM scans ORDER BY timestamp ASC, scan_id ASC LIMIT ?",
+            (excess,)
+        ).fetchall()
+        self._conn.executemany("DELETE FROM scans WHERE scan_id = ?", [(row['scan_id'],) for row in rows])
+        self._count -= len(rows)
+        return [dict(row) for row in rows]
+
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,228 @@
+"""
+Image Engine - Process pool for CPU-heavy Pillow work
+
+Pillow holds the GIL for much of decoding and encoding, so image requests
+served from threads share one core. The engine runs those operations in a
+bounded pool of worker processes instead. Operations on stored files
+receive only paths; in-memory images (freshly scanned pages) are handed
+over through shared memory rather than pickled through the pool's pipe.
+
+The number of submitted-but-unfinished operations is capped. When every
+slot stays taken for queue_timeout seconds, callers get EngineBusyError
+instead of piling up behind a saturated pool.
+"""
+
+import os
+import signal
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import Dict, Optional, Any, Callable, TYPE_CHECKING
+
+from metrics import IMAGE_ENGINE_REJECTIONS
+from pnm_stream import BAND_ROWS
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+class EngineBusyError(Exception):
+    """Raised when no pool slot frees up within the queue timeout"""
+    pass
+
+
+def _init_worker():
+    """Leave interrupt handling to the parent process"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _encode_shared(
+    name: str,
+    mode: str,
+    size: tuple,
+    length: int,
+    file_path: str,
+    save_kwargs: Dict[str, Any]
+):
+    """Encode raw pixels from a shared memory block to file_path (runs in a worker)"""
+    from PIL import Image
+
+    shm = SharedMemory(name=name)
+    view = shm.buf[:length]
+    try:
+        image = Image.frombuffer(mode, size, view, 'raw', mode, 0, 1)
+        image.save(file_path, **save_kwargs)
+        del image
+    finally:
+        view.release()
+        shm.close()
+
+
+class ImageEngine:
+    """Bounded process pool running image operations off the request threads"""
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        max_pending: Optional[int] = None,
+        queue_timeout: float = 10.0,
+        start_method: Optional[str] = None
+    ):
+        """Initialize image engine
+
+        max_pending defaults to two operations per worker: one running and
+        one queued, so a worker never idles between tasks.
+        """
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.max_pending = max(1, max_pending or self.workers * 2)
+        self.queue_timeout = queue_timeout
+        if start_method is None:
+            # Forking a threaded server is unsafe; the fork server forks from a clean process
+            available = multiprocessing.get_all_start_methods()
+            start_method = 'forkserver' if 'forkserver' in available else 'spawn'
+        self._context = multiprocessing.get_context(start_method)
+        if start_method == 'forkserver':
+            # Workers fork with Pillow and the operations already imported
+            self._context.set_forkserver_preload(['PIL.Image', 'image_processor'])
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.restarts = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Create the pool on first use (lock held)"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=self._context,
+                initializer=_init_worker
+            )
+            logger.info(f"Image engine started: {self.workers} worker(s), {self.max_pending} slot(s)")
+        return self._executor
+
+    def _reset(self, executor: ProcessPoolExecutor):
+        """Replace a pool whose worker died, unless already replaced"""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+            self.restarts += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+        logger.error("Image engine worker died; pool will be restarted")
+
+    def _release(self, future: Future):
+        """Free a slot and count the outcome"""
+        with self._lock:
+            self.pending -= 1
+            if future.cancelled() or future.exception() is not None:
+                self.failed += 1
+            else:
+                self.completed += 1
+        self._slots.release()
+
+    def submit(self, fn: Callable, *args, block: bool = False) -> Future:
+        """Queue fn(*args) on the pool
+
+        Waits up to queue_timeout for a free slot, or indefinitely with
+        block=True for work that must not be dropped, such as encoding a
+        page that has already been scanned.
+        """
+        if self._closed:
+            raise RuntimeError("Image engine is shut down")
+        if not self._slots.acquire(timeout=None if block else self.queue_timeout):
+            with self._lock:
+                self.rejected += 1
+            IMAGE_ENGINE_REJECTIONS.inc()
+            raise EngineBusyError(
+                f"Image engine busy: {self.max_pending} operation(s) pending for over {self.queue_timeout}s"
+            )
+
+        try:
+            with self._lock:
+                executor = self._get_executor()
+                future = executor.submit(fn, *args)
+                self.pending += 1
+        except BrokenProcessPool:
+            self._slots.release()
+            self._reset(executor)
+            raise
+        except Exception:
+            self._slots.release()
+            raise
+        future.executor = executor
+        future.add_done_callback(self._release)
+        return future
+
+    def run(self, fn: Callable, *args, block: bool = False) -> Any:
+        """Run fn(*args) on the pool and wait for its result"""
+        return self.wait(self.submit(fn, *args, block=block))
+    
+    def wait(self, future: Future) -> Any:
+        """Wait for a submitted operation's result, restarting the pool if a worker died"""
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            self._reset(future.executor)
+            raise
+
+    def encode(
+        self,
+        image: "Image.Image",
+        file_path: Path,
+        save_kwargs: Optional[Dict[str, Any]] = None,
+        block: bool = True
+    ):
+        """Encode an in-memory image to file_path on the pool via shared memory
+
+        Pixels are copied into the shared block a band of rows at a time, so
+        only the image and the block are held in full.
+        """
+        width, height = image.size
+        row_bytes = len(image.crop((0, 0, width, 1)).tobytes()) if height else 0
+        length = row_bytes * height
+        shm = SharedMemory(create=True, size=max(length, 1))
+        try:
+            for top in range(0, height, BAND_ROWS):
+                band = image.crop((0, top, width, min(top + BAND_ROWS, height))).tobytes()
+                shm.buf[top * row_bytes:top * row_bytes + len(band)] = band
+            self.run(
+                _encode_shared, shm.name, image.mode, image.size, length, str(file_path),
+                save_kwargs or {}, block=block
+            )
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get pool size and operation counters"""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self.pending,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "restarts": self.restarts,
+                "running": self._executor is not None
+            }
+
+    def shutdown(self, wait: bool = True):
+        """Stop the worker processes"""
+        with self._lock:
+            self._closed = True
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=wait, cancel_futures=True)
+            logger.info("Image engine stopped")
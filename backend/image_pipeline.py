@@ -0,0 +1,249 @@
+"""
+Image Pipeline - Ordered image operations applied with one decode and encode
+
+A pipeline is a list of operations such as
+    [{"op": "rotate", "angle": 90}, {"op": "crop", "left": 0, "top": 0,
+     "right": 1200, "bottom": 1600}, {"op": "format", "format": "png"}]
+Operations run in memory on a single decoded image. JPEG-to-JPEG chains of
+quarter-turn rotations and MCU-aligned crops are applied losslessly to the
+compressed data by jpegtran, when it is installed.
+"""
+
+import shutil
+import logging
+import subprocess
+from typing import Dict, List, Optional, Any, Tuple
+
+try:
+    from PIL import Image
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_OPERATIONS = ('rotate', 'crop', 'resize', 'grayscale', 'deskew', 'format')
+MAX_OPERATIONS = 20
+DEFAULT_QUALITY = 85
+MAX_DESKEW_ANGLE = 15.0
+
+# Skew is estimated on a downscaled copy; longest edge in px
+SKEW_SAMPLE_EDGE = 1000
+
+_REQUIRED = object()
+
+
+class PipelineError(ValueError):
+    """Raised for an invalid operation chain"""
+    pass
+
+
+def _param(
+    spec: Dict[str, Any],
+    key: str,
+    kind: type,
+    default: Any = _REQUIRED,
+    minimum: Optional[float] = None,
+    maximum: Optional[float] = None
+) -> Any:
+    """Read a numeric operation parameter"""
+    value = spec.get(key)
+    if value is None:
+        if default is _REQUIRED:
+            raise PipelineError(f"{spec['op']}: {key} is required")
+        return default
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or (kind is int and value != int(value)):
+        raise PipelineError(f"{spec['op']}: {key} must be {'an integer' if kind is int else 'a number'}")
+    value = kind(value)
+    if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+        raise PipelineError(f"{spec['op']}: {key} must be between {minimum} and {maximum}")
+    return value
+
+
+def parse_pipeline(
+    operations: Any,
+    supported_formats: List[str]
+) -> Tuple[List[Dict[str, Any]], str, Optional[int]]:
+    """Validate a pipeline into (operations, output format, quality)
+
+    Operations are normalized so equivalent chains share a cache entry:
+    angles are reduced modulo 360, no-op rotations are dropped and
+    consecutive quarter turns are merged. A format operation sets the
+    output encoding and must come last; the default is JPEG. Quality is
+    None unless the format operation gives one, in which case the output
+    is always re-encoded at it; otherwise encoding uses DEFAULT_QUALITY.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise PipelineError("operations must be a non-empty list")
+    if len(operations) > MAX_OPERATIONS:
+        raise PipelineError(f"At most {MAX_OPERATIONS} operations are allowed")
+
+    target_format, quality = 'jpeg', None
+    normalized: List[Dict[str, Any]] = []
+    for index, spec in enumerate(operations):
+        if not isinstance(spec, dict) or spec.get('op') not in PIPELINE_OPERATIONS:
+            op = spec.get('op') if isinstance(spec, dict) else spec
+            raise PipelineError(f"Operation {index}: unknown op {op!r}, expected one of {', '.join(PIPELINE_OPERATIONS)}")
+        op = spec['op']
+
+        if op == 'format':
+            if index != len(operations) - 1:
+                raise PipelineError("format must be the last operation")
+            target_format = str(spec.get('format', 'jpeg')).lower().replace('.', '')
+            if target_format not in supported_formats:
+                raise PipelineError(f"Unsupported format: {target_format}")
+            if target_format == 'jpg':
+                target_format = 'jpeg'
+            quality = _param(spec, 'quality', int, None, 1, 100)
+
+        elif op == 'rotate':
+            angle = round(_param(spec, 'angle', float) % 360, 2)
+            previous = normalized[-1] if normalized else None
+            if previous and previous['op'] == 'rotate' and angle % 90 == 0 and previous['angle'] % 90 == 0:
+                angle = (previous['angle'] + angle) % 360
+                normalized.pop()
+            if angle:
+                normalized.append({'op': 'rotate', 'angle': int(angle) if angle.is_integer() else angle})
+
+        elif op == 'crop':
+            box = {key: _param(spec, key, int, minimum=0) for key in ('left', 'top', 'right', 'bottom')}
+            if box['right'] <= box['left'] or box['bottom'] <= box['top']:
+                raise PipelineError("crop: right and bottom must be greater than left and top")
+            normalized.append({'op': 'crop', **box})
+
+        elif op == 'resize':
+            max_width = _param(spec, 'max_width', int, None, minimum=1)
+            max_height = _param(spec, 'max_height', int, None, minimum=1)
+            if not max_width and not max_height:
+                raise PipelineError("resize: max_width or max_height is required")
+            normalized.append({'op': 'resize', 'max_width': max_width, 'max_height': max_height})
+
+        elif op == 'grayscale':
+            normalized.append({'op': 'grayscale'})
+
+        elif op == 'deskew':
+            max_angle = _param(spec, 'max_angle', float, 5.0, minimum=0.5, maximum=MAX_DESKEW_ANGLE)
+            normalized.append({'op': 'deskew', 'max_angle': max_angle})
+
+    return normalized, target_format, quality
+
+
+def _check_box(size: Tuple[int, int], operation: Dict[str, Any]):
+    """Reject crops reaching outside the image"""
+    if operation['right'] > size[0] or operation['bottom'] > size[1]:
+        raise PipelineError(
+            f"crop: box ({operation['left']}, {operation['top']}, {operation['right']}, {operation['bottom']}) "
+            f"is outside the {size[0]}x{size[1]} image"
+        )
+
+
+def _rotate(image: "Image.Image", angle: float) -> "Image.Image":
+    """Rotate counter-clockwise; quarter turns are exact, other angles fill with white"""
+    if angle % 90 == 0:
+        return image.transpose({
+            90: Image.Transpose.ROTATE_90,
+            180: Image.Transpose.ROTATE_180,
+            270: Image.Transpose.ROTATE_270
+        }[int(angle) % 360])
+    if image.mode not in ('L', 'RGB', 'RGBA'):
+        image = image.convert('L' if image.mode in ('1', 'I;16') else 'RGB')
+    fill = {'L': 255, 'RGB': (255, 255, 255), 'RGBA': (255, 255, 255, 0)}[image.mode]
+    return image.rotate(angle, resample=Image.Resampling.BICUBIC, expand=True, fillcolor=fill)
+
+
+def estimate_skew(image: "Image.Image", max_angle: float = 5.0) -> float:
+    """Angle in degrees that straightens the text lines of a page
+
+    Ink is projected onto the vertical axis for candidate angles; text
+    lines give the sharpest row profile (highest variance) when level.
+    A coarse 0.5 degree search is refined in 0.1 degree steps.
+    """
+    sample = image.convert('L')
+    sample.thumbnail((SKEW_SAMPLE_EDGE, SKEW_SAMPLE_EDGE))
+    # Ink as high values, so the zero fill of rotated corners adds none
+    ink = sample.point(lambda value: 255 if value < 128 else 0).convert('F')
+
+    def sharpness(angle: float) -> float:
+        rotated = ink.rotate(angle, resample=Image.Resampling.NEAREST)
+        profile = list(rotated.resize((1, rotated.height), Image.Resampling.BOX).getdata())
+        mean = sum(profile) / len(profile)
+        return sum((value - mean) ** 2 for value in profile)
+
+    steps = int(max_angle / 0.5)
+    best = max((step * 0.5 for step in range(-steps, steps + 1)), key=sharpness)
+    best = max((best + step * 0.1 for step in range(-4, 5)), key=sharpness)
+    return round(max(-max_angle, min(max_angle, best)), 1)
+
+
+def apply_operations(image: "Image.Image", operations: List[Dict[str, Any]]) -> "Image.Image":
+    """Run normalized operations on a decoded image"""
+    for operation in operations:
+        op = operation['op']
+        if op == 'rotate':
+            image = _rotate(image, operation['angle'])
+        elif op == 'crop':
+            _check_box(image.size, operation)
+            image = image.crop((operation['left'], operation['top'], operation['right'], operation['bottom']))
+        elif op == 'resize':
+            # In place; on a freshly opened JPEG this also decodes at reduced scale
+            image.thumbnail(
+                (operation['max_width'] or image.width, operation['max_height'] or image.height),
+                Image.Resampling.LANCZOS
+            )
+        elif op == 'grayscale':
+            image = image.convert('L')
+        elif op == 'deskew':
+            angle = estimate_skew(image, operation['max_angle'])
+            if angle:
+                image = _rotate(image, angle)
+    return image
+
+
+def lossless_jpeg_transform(source_path: str, operations: List[Dict[str, Any]]) -> Optional[bytes]:
+    """Apply quarter-turn rotations and MCU-aligned crops to JPEG data without re-encoding
+
+    Returns the transformed JPEG, or None when the chain needs decoding:
+    other operations, a non-JPEG source, crops off the MCU grid, edges
+    that cannot be rotated perfectly, or no jpegtran installed.
+    """
+    for operation in operations:
+        if operation['op'] == 'crop':
+            continue
+        if operation['op'] != 'rotate' or operation['angle'] % 90:
+            return None
+    jpegtran = shutil.which('jpegtran')
+    if operations and not jpegtran:
+        return None
+
+    with Image.open(source_path) as image:
+        if image.format != 'JPEG':
+            return None
+        width, height = image.size
+        # Minimum coded unit: 8px times the largest sampling factor
+        mcu_width = 8 * max(component[1] for component in image.layer)
+        mcu_height = 8 * max(component[2] for component in image.layer)
+
+    with open(source_path, 'rb') as f:
+        data = f.read()
+
+    for operation in operations:
+        if operation['op'] == 'rotate':
+            # jpegtran rotates clockwise
+            args = ['-perfect', '-rotate', str(360 - operation['angle'])]
+            if operation['angle'] in (90, 270):
+                width, height = height, width
+                mcu_width, mcu_height = mcu_height, mcu_width
+        else:
+            _check_box((width, height), operation)
+            if operation['left'] % mcu_width or operation['top'] % mcu_height:
+                return None
+            width = operation['right'] - operation['left']
+            height = operation['bottom'] - operation['top']
+            args = ['-crop', f"{width}x{height}+{operation['left']}+{operation['top']}"]
+
+        result = subprocess.run([jpegtran, '-copy', 'all', *args], input=data, capture_output=True, timeout=60)
+        if result.returncode != 0 or not result.stdout:
+            logger.debug(f"jpegtran {' '.join(args)} failed, decoding instead: {result.stderr.decode(errors='replace')}")
+            return None
+        data = result.stdout
+    return data
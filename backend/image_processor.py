@@ -3,9 +3,11 @@ Image Processor - Handles image conversion and optimization
 """
 
 import os
+import uuid
 import logging
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional, Any, Callable, Iterator, Tuple, Union, BinaryIO, TYPE_CHECKING
 from datetime import datetime
 
 try:
@@ -14,23 +16,189 @@ try:
 except ImportError:
     HAS_PIL = False
 
+from derivative_cache import DerivativeCache
+from image_pipeline import parse_pipeline, apply_operations, lossless_jpeg_transform, DEFAULT_QUALITY
+from document_builder import (
+    DocumentError, EncodedPage, DOCUMENT_FORMATS, MAX_DOCUMENT_PAGES, probe_jpeg, encode_page, stream_document
+)
+from metrics import IMAGE_OPERATION_DURATION, DOCUMENT_PAGES
+
+if TYPE_CHECKING:
+    from image_engine import ImageEngine
+
 logger = logging.getLogger(__name__)
 
+# File extensions whose Pillow format name differs from the upper-cased extension
+PIL_FORMATS = {'jpg': 'JPEG'}
+
+# Fixed-size renditions built for every finished scan (longest edge in px)
+RENDITION_SIZES = {'thumb': 256, 'preview': 1024}
+
+
+# Pillow work is kept in module-level functions so the image engine's
+# worker processes can run it; each reads and writes files by path.
+
+def _pil_format(image_format: str) -> str:
+    """Map a file extension to the Pillow format name"""
+    return PIL_FORMATS.get(image_format, image_format.upper())
+
+
+def _flatten(image: "Image.Image") -> "Image.Image":
+    """Composite alpha onto white and normalize to RGB, L or 1"""
+    if image.mode == 'RGBA':
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[3])
+        return background
+    elif image.mode not in ['RGB', 'L', '1']:
+        return image.convert('RGB')
+    return image
+
+
+def _convert_file(source_path: str, output_path: str, target_format: str):
+    """Re-encode source_path as target_format"""
+    with Image.open(source_path) as image:
+        image = _flatten(image)
+        
+        save_kwargs = {}
+        if target_format in ['jpeg', 'jpg']:
+            save_kwargs['quality'] = 85
+            save_kwargs['optimize'] = True
+        
+        image.save(output_path, format=_pil_format(target_format), **save_kwargs)
+
+
+def _optimize_file(
+    source_path: str,
+    output_path: str,
+    quality: int,
+    max_width: Optional[int],
+    max_height: Optional[int]
+):
+    """Shrink source_path to fit the bounds and save as JPEG"""
+    with Image.open(source_path) as image:
+        image = _flatten(image)
+        
+        # Resize if needed
+        if max_width or max_height:
+            image.thumbnail(
+                (max_width or image.width, max_height or image.height),
+                Image.Resampling.LANCZOS
+            )
+        
+        image.save(output_path, format='JPEG', quality=quality, optimize=True)
+
+
+def _rotate_file(source_path: str, output_path: str, angle: int):
+    """Rotate source_path and save as JPEG"""
+    with Image.open(source_path) as image:
+        rotated = image.rotate(angle, expand=True)
+        rotated.save(output_path, format='JPEG', quality=85)
+
+
+def _crop_file(source_path: str, output_path: str, box: Tuple[int, int, int, int]):
+    """Crop source_path to box and save as JPEG"""
+    with Image.open(source_path) as image:
+        cropped = image.crop(box)
+        cropped.save(output_path, format='JPEG', quality=85)
+
+
+def _run_pipeline(
+    source_path: str,
+    output_path: str,
+    operations: List[Dict[str, Any]],
+    target_format: str,
+    quality: Optional[int]
+) -> str:
+    """Apply an operation chain with at most one decode and one encode
+
+    Returns "lossless" when the JPEG data was transformed directly, which
+    is only tried when no quality was requested, and "decoded" otherwise.
+    """
+    if target_format == 'jpeg' and quality is None:
+        data = lossless_jpeg_transform(source_path, operations)
+        if data is not None:
+            with open(output_path, 'wb') as f:
+                f.write(data)
+            return 'lossless'
+    
+    with Image.open(source_path) as image:
+        image = _flatten(apply_operations(image, operations))
+        
+        save_kwargs = {}
+        if target_format == 'jpeg':
+            # JPEG cannot store 1-bit images
+            if image.mode == '1':
+                image = image.convert('L')
+            save_kwargs['quality'] = quality or DEFAULT_QUALITY
+            save_kwargs['optimize'] = True
+        
+        image.save(output_path, format=_pil_format(target_format), **save_kwargs)
+    return 'decoded'
+
+
+def _build_renditions(source_path: str, targets: List[Tuple[int, str]]):
+    """Write JPEG renditions of source_path, largest edge first
+
+    JPEG sources are decoded at reduced scale via draft(); other formats
+    are shrunk with reduce() before the final LANCZOS resize. Each
+    smaller rendition is derived from the previous one.
+    """
+    largest = targets[0][0]
+    with Image.open(source_path) as image:
+        if image.format == 'JPEG':
+            # Let libjpeg decode at 1/2, 1/4 or 1/8 scale
+            image.draft('L' if image.mode == 'L' else 'RGB', (largest, largest))
+        else:
+            factor = max(image.width, image.height) // largest
+            if factor >= 2:
+                image = image.reduce(factor)
+        
+        current = _flatten(image)
+        if current.mode == '1':
+            current = current.convert('L')
+        
+        for edge, output_path in targets:
+            current = current.copy()
+            current.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+            
+            output = Path(output_path)
+            temp_path = output.with_name(f".{output.name}.{uuid.uuid4().hex[:8]}.tmp")
+            current.save(str(temp_path), format='JPEG', quality=80, optimize=True)
+            os.replace(temp_path, output)
+
 
 class ImageProcessor:
     """Handles image processing operations"""
     
-    def __init__(self):
-        """Initialize image processor"""
-        self.cache_dir = Path("./cache")
+    def __init__(
+        self,
+        cache_dir: str = "./cache",
+        max_cache_size: Optional[int] = None,
+        rendition_dir: str = "./scans/renditions",
+        engine: Optional["ImageEngine"] = None
+    ):
+        """Initialize image processor; with an engine, Pillow work runs in its process pool"""
+        self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(exist_ok=True)
+        self.derivatives = DerivativeCache(str(self.cache_dir), max_bytes=max_cache_size)
+        self.rendition_dir = Path(rendition_dir)
+        self.rendition_dir.mkdir(parents=True, exist_ok=True)
+        self._rendition_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="renditions")
         self.supported_formats = ['jpeg', 'jpg', 'png', 'tiff', 'bmp', 'gif']
+        self.engine = engine
     
-    def convert_image(self, source_path: str, target_format: str) -> str:
+    def _run(self, fn: Callable, *args) -> Any:
+        """Run a Pillow operation on the engine's pool, or inline without one"""
+        if self.engine:
+            return self.engine.run(fn, *args)
+        return fn(*args)
+    
+    @IMAGE_OPERATION_DURATION.timed(operation='convert')
+    def convert_image(self, source_path: str, target_format: str) -> BinaryIO:
         """Convert image to target format"""
         if not HAS_PIL:
             logger.warning("PIL not available, returning original image")
-            return source_path
+            return open(source_path, 'rb')
         
         try:
             source_path = str(source_path)
@@ -42,111 +210,70 @@ class ImageProcessor:
             if target_format not in self.supported_formats:
                 raise ValueError(f"Unsupported format: {target_format}")
             
-            # Open image
-            image = Image.open(source_path)
-            
-            # Convert RGBA to RGB if needed
-            if image.mode == 'RGBA' and target_format in ['jpeg', 'jpg']:
-                background = Image.new('RGB', image.size, (255, 255, 255))
-                background.paste(image, mask=image.split()[3])
-                image = background
-            elif image.mode not in ['RGB', 'L', '1']:
-                image = image.convert('RGB')
-            
-            # Generate output path
-            output_path = self.cache_dir / f"{Path(source_path).stem}_converted.{target_format}"
+            def produce(output_path: str):
+                self._run(_convert_file, source_path, output_path, target_format)
+                logger.info(f"Image converted: {source_path} -> {target_format}")
             
-            # Save in target format
-            save_kwargs = {}
-            if target_format in ['jpeg', 'jpg']:
-                save_kwargs['quality'] = 85
-                save_kwargs['optimize'] = True
-            
-            image.save(str(output_path), format=target_format.upper(), **save_kwargs)
-            logger.info(f"Image converted: {source_path} -> {output_path}")
-            
-            return str(output_path)
+            return self.derivatives.get_or_create(
+                source_path, 'convert', {'format': target_format}, target_format, produce
+            )
             
         except Exception as e:
             logger.error(f"Error converting image: {str(e)}")
             raise
     
+    @IMAGE_OPERATION_DURATION.timed(operation='optimize')
     def optimize_image(
         self,
         source_path: str,
         quality: int = 85,
         max_width: Optional[int] = None,
         max_height: Optional[int] = None
-    ) -> str:
+    ) -> BinaryIO:
         """Optimize image (compress, resize, etc)"""
         if not HAS_PIL:
             logger.warning("PIL not available, returning original image")
-            return source_path
+            return open(source_path, 'rb')
         
         try:
             source_path = str(source_path)
             if not os.path.exists(source_path):
                 raise FileNotFoundError(f"Source file not found: {source_path}")
             
-            # Open image
-            image = Image.open(source_path)
-            
-            # Convert to RGB if needed
-            if image.mode == 'RGBA':
-                background = Image.new('RGB', image.size, (255, 255, 255))
-                background.paste(image, mask=image.split()[3])
-                image = background
-            elif image.mode not in ['RGB', 'L', '1']:
-                image = image.convert('RGB')
-            
-            # Resize if needed
-            if max_width or max_height:
-                max_width = max_width or image.width
-                max_height = max_height or image.height
-                image.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
-            
-            # Generate output path
-            output_path = self.cache_dir / f"{Path(source_path).stem}_optimized.jpg"
-            
-            # Save optimized image
-            image.save(
-                str(output_path),
-                format='JPEG',
-                quality=quality,
-                optimize=True
-            )
+            def produce(output_path: str):
+                self._run(_optimize_file, source_path, output_path, quality, max_width, max_height)
+                logger.info(f"Image optimized: {source_path} (quality={quality}, max={max_width}x{max_height})")
             
-            logger.info(f"Image optimized: {source_path} -> {output_path}")
-            return str(output_path)
+            params = {'quality': quality, 'max_width': max_width, 'max_height': max_height}
+            return self.derivatives.get_or_create(source_path, 'optimize', params, 'jpg', produce)
             
         except Exception as e:
             logger.error(f"Error optimizing image: {str(e)}")
             raise
     
-    def rotate_image(self, source_path: str, angle: int) -> str:
+    @IMAGE_OPERATION_DURATION.timed(operation='rotate')
+    def rotate_image(self, source_path: str, angle: int) -> BinaryIO:
         """Rotate image by specified angle"""
         if not HAS_PIL:
             logger.warning("PIL not available, returning original image")
-            return source_path
+            return open(source_path, 'rb')
         
         try:
             source_path = str(source_path)
             if not os.path.exists(source_path):
                 raise FileNotFoundError(f"Source file not found: {source_path}")
             
-            image = Image.open(source_path)
-            rotated = image.rotate(angle, expand=True)
-            
-            output_path = self.cache_dir / f"{Path(source_path).stem}_rotated.jpg"
-            rotated.save(str(output_path), format='JPEG', quality=85)
+            def produce(output_path: str):
+                self._run(_rotate_file, source_path, output_path, angle)
+                logger.info(f"Image rotated: {source_path} ({angle} degrees)")
             
-            logger.info(f"Image rotated: {source_path} -> {output_path}")
-            return str(output_path)
+            return self.derivatives.get_or_create(source_path, 'rotate', {'angle': angle}, 'jpg', produce)
             
         except Exception as e:
             logger.error(f"Error rotating image: {str(e)}")
             raise
     
+    @IMAGE_OPERATION_DURATION.timed(operation='crop')
     def crop_image(
         self,
         source_path: str,
@@ -154,30 +281,177 @@ class ImageProcessor:
         top: int,
         right: int,
         bottom: int
-    ) -> str:
+    ) -> BinaryIO:
         """Crop image to specified bounds"""
         if not HAS_PIL:
             logger.warning("PIL not available, returning original image")
-            return source_path
+            return open(source_path, 'rb')
         
         try:
             source_path = str(source_path)
             if not os.path.exists(source_path):
                 raise FileNotFoundError(f"Source file not found: {source_path}")
             
-            image = Image.open(source_path)
-            cropped = image.crop((left, top, right, bottom))
-            
-            output_path = self.cache_dir / f"{Path(source_path).stem}_cropped.jpg"
-            cropped.save(str(output_path), format='JPEG', quality=85)
+            def produce(output_path: str):
+                self._run(_crop_file, source_path, output_path, (left, top, right, bottom))
+                logger.info(f"Image cropped: {source_path} ({left}, {top}, {right}, {bottom})")
             
-            logger.info(f"Image cropped: {source_path} -> {output_path}")
-            return str(output_path)
+            params = {'left': left, 'top': top, 'right': right, 'bottom': bottom}
+            return self.derivatives.get_or_create(source_path, 'crop', params, 'jpg', produce)
             
         except Exception as e:
             logger.error(f"Error cropping image: {str(e)}")
             raise
     
+    @IMAGE_OPERATION_DURATION.timed(operation='pipeline')
+    def run_pipeline(self, source_path: str, operations: List[Dict[str, Any]]) -> BinaryIO:
+        """Apply an ordered chain of operations, cached by the chain's hash
+        
+        See image_pipeline.parse_pipeline for the operation format.
+        """
+        if not HAS_PIL:
+            logger.warning("PIL not available, returning original image")
+            return open(source_path, 'rb')
+        
+        try:
+            source_path = str(source_path)
+            if not os.path.exists(source_path):
+                raise FileNotFoundError(f"Source file not found: {source_path}")
+            
+            steps, target_format, quality = parse_pipeline(operations, self.supported_formats)
+            
+            def produce(output_path: str):
+                method = self._run(_run_pipeline, source_path, output_path, steps, target_format, quality)
+                chain = ', '.join(step['op'] for step in steps) or 'none'
+                logger.info(f"Pipeline applied ({method}): {source_path} [{chain}] -> {target_format}")
+            
+            params = {'operations': steps, 'format': target_format, 'quality': quality}
+            return self.derivatives.get_or_create(source_path, 'pipeline', params, target_format, produce)
+            
+        except Exception as e:
+            logger.error(f"Error running image pipeline: {str(e)}")
+            raise
+    
+    def _start_page(
+        self,
+        source_path: str,
+        dpi: Optional[float],
+        target_format: str,
+        block: bool
+    ) -> Union[EncodedPage, Future, None]:
+        """Start preparing a document page
+        
+        A JPEG to copy as-is is ready at once. Other pages are submitted to
+        the engine, or left as None to encode inline when there is none.
+        """
+        page = probe_jpeg(source_path, target_format, dpi)
+        if page or not self.engine:
+            return page
+        return self.engine.submit(encode_page, source_path, target_format, dpi, block=block)
+    
+    def build_document(self, pages: List[Tuple[str, Optional[float]]], target_format: str) -> Iterator[bytes]:
+        """Stream scan files, given as (path, dpi), as one multi-page PDF or TIFF
+        
+        Each page is encoded while the previous one is written, so about
+        one page is held at a time. The first page is started before this
+        returns: a busy engine raises EngineBusyError while an error
+        response is still possible. Later pages wait for a free slot.
+        """
+        if not HAS_PIL:
+            raise DocumentError("PIL is required to build documents")
+        if target_format not in DOCUMENT_FORMATS:
+            raise DocumentError(f"Unsupported document format: {target_format}")
+        if not pages:
+            raise DocumentError("At least one page is required")
+        if len(pages) > MAX_DOCUMENT_PAGES:
+            raise DocumentError(f"At most {MAX_DOCUMENT_PAGES} pages are allowed")
+        for source_path, _ in pages:
+            if not os.path.exists(source_path):
+                raise FileNotFoundError(f"Source file not found: {source_path}")
+        
+        first = self._start_page(pages[0][0], pages[0][1], target_format, block=False)
+        
+        def encoded_pages() -> Iterator[EncodedPage]:
+            pending = first
+            for index, (source_path, dpi) in enumerate(pages):
+                upcoming = None
+                if index + 1 < len(pages):
+                    upcoming = self._start_page(*pages[index + 1], target_format, block=True)
+                if isinstance(pending, Future):
+                    page = self.engine.wait(pending)
+                else:
+                    page = pending or encode_page(source_path, target_format, dpi)
+                DOCUMENT_PAGES.inc(format=target_format, compression=page.compression)
+                yield page
+                pending = upcoming
+        
+        def stream() -> Iterator[bytes]:
+            try:
+                yield from stream_document(encoded_pages(), len(pages), target_format)
+                logger.info(f"Built {target_format} document of {len(pages)} page(s)")
+            except Exception as e:
+                logger.error(f"Error building {target_format} document: {str(e)}")
+                raise
+        
+        return stream()
+    
+    def _rendition_path(self, scan_id: str, size: str) -> Path:
+        """Path of a scan rendition"""
+        return self.rendition_dir / f"{scan_id}_{size}.jpg"
+    
+    @IMAGE_OPERATION_DURATION.timed(operation='renditions')
+    def generate_renditions(self, source_path: str, scan_id: str) -> Dict[str, str]:
+        """Build the thumbnail/preview pyramid for a scan"""
+        if not HAS_PIL:
+            logger.warning("PIL not available, skipping renditions")
+            return {}
+        
+        try:
+            source_path = str(source_path)
+            if not os.path.exists(source_path):
+                raise FileNotFoundError(f"Source file not found: {source_path}")
+            
+            sizes = sorted(RENDITION_SIZES.items(), key=lambda item: item[1], reverse=True)
+            paths = {name: str(self._rendition_path(scan_id, name)) for name, _ in sizes}
+            self._run(_build_renditions, source_path, [(edge, paths[name]) for name, edge in sizes])
+            
+            logger.info(f"Renditions built for {scan_id}: {', '.join(paths)}")
+            return paths
+            
+        except Exception as e:
+            logger.error(f"Error generating renditions: {str(e)}")
+            raise
+    
+    def schedule_renditions(self, source_path: str, scan_id: str):
+        """Build renditions in the background, off the request and scan paths"""
+        def run():
+            try:
+                self.generate_renditions(source_path, scan_id)
+            except Exception:
+                pass  # Logged by generate_renditions; built on demand later
+        
+        self._rendition_executor.submit(run)
+    
+    @IMAGE_OPERATION_DURATION.timed(operation='get_rendition')
+    def get_rendition(self, source_path: str, scan_id: str, size: str) -> str:
+        """Get a rendition path, building it on demand if it is missing"""
+        if size == 'full':
+            return str(source_path)
+        if size not in RENDITION_SIZES:
+            raise ValueError(f"Unknown size: {size}")
+        
+        path = self._rendition_path(scan_id, size)
+        if not path.exists():
+            self.generate_renditions(source_path, scan_id)
+        return str(path)
+    
+    def delete_renditions(self, scan_id: str):
+        """Remove all renditions of a scan"""
+        for size in RENDITION_SIZES:
+            path = self._rendition_path(scan_id, size)
+            if path.exists():
+                path.unlink()
+    
     def get_image_info(self, image_path: str) -> dict:
         """Get image information"""
         if not HAS_PIL:
@@ -207,20 +481,9 @@ class ImageProcessor:
             return {"error": str(e)}
     
     def cleanup_cache(self, max_age_hours: int = 24):
-        """Clean up old cached images"""
+        """Clean up cached images not accessed recently"""
         try:
-            import time
-            current_time = time.time()
-            max_age_seconds = max_age_hours * 3600
-            
-            deleted_count = 0
-            for file_path in self.cache_dir.glob('*'):
-                if file_path.is_file():
-                    file_age = current_time - file_path.stat().st_mtime
-                    if file_age > max_age_seconds:
-                        file_path.unlink()
-                        deleted_count += 1
-            
+            deleted_count = self.derivatives.evict_older_than(max_age_hours * 3600)
             logger.info(f"Cache cleanup: deleted {deleted_count} files")
             return deleted_count
             
@@ -0,0 +1,767 @@
+"""
+LibSane - In-process SANE access through ctypes
+
+Talking to libsane directly avoids forking scanimage for every scan and
+discovery pass, and lets device handles stay open between scans so
+back-to-back scans skip device open, option setup and warm-up.
+
+LibSane wraps the C API; FakeLibSane implements the same interface in
+pure Python for development and tests without sane-backends installed.
+InProcessSaneBackend sits on top of either one.
+"""
+
+import io
+import sys
+import time
+import select
+import ctypes
+import ctypes.util
+import logging
+import threading
+from array import array
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Any, Callable, Iterator, TYPE_CHECKING
+
+from pnm_stream import PNMHeader, decode_raw_stream
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# SANE_Status
+STATUS_GOOD = 0
+STATUS_UNSUPPORTED = 1
+STATUS_CANCELLED = 2
+STATUS_DEVICE_BUSY = 3
+STATUS_INVAL = 4
+STATUS_EOF = 5
+STATUS_JAMMED = 6
+STATUS_NO_DOCS = 7
+STATUS_COVER_OPEN = 8
+STATUS_IO_ERROR = 9
+STATUS_NO_MEM = 10
+STATUS_ACCESS_DENIED = 11
+
+STATUS_MESSAGES = {
+    STATUS_GOOD: "Success",
+    STATUS_UNSUPPORTED: "Operation not supported",
+    STATUS_CANCELLED: "Operation was cancelled",
+    STATUS_DEVICE_BUSY: "Device busy",
+    STATUS_INVAL: "Invalid argument",
+    STATUS_EOF: "End of file reached",
+    STATUS_JAMMED: "Document feeder jammed",
+    STATUS_NO_DOCS: "Document feeder out of documents",
+    STATUS_COVER_OPEN: "Scanner cover is open",
+    STATUS_IO_ERROR: "Error during device I/O",
+    STATUS_NO_MEM: "Out of memory",
+    STATUS_ACCESS_DENIED: "Access to resource has been denied",
+}
+
+# SANE_Value_Type
+TYPE_BOOL = 0
+TYPE_INT = 1
+TYPE_FIXED = 2
+TYPE_STRING = 3
+TYPE_BUTTON = 4
+TYPE_GROUP = 5
+
+# SANE_Constraint_Type
+CONSTRAINT_NONE = 0
+CONSTRAINT_RANGE = 1
+CONSTRAINT_WORD_LIST = 2
+CONSTRAINT_STRING_LIST = 3
+
+# SANE_Action
+ACTION_GET_VALUE = 0
+ACTION_SET_VALUE = 1
+
+# Info flags returned by sane_control_option
+INFO_RELOAD_OPTIONS = 2
+
+# SANE_Frame
+FRAME_GRAY = 0
+FRAME_RGB = 1
+
+CAP_SOFT_SELECT = 1
+CAP_INACTIVE = 1 << 5
+
+UNITS = {0: "", 1: "px", 2: "bit", 3: "mm", 4: "dpi", 5: "%", 6: "us"}
+
+FIXED_SCALE = 1 << 16
+
+# Longest wait for data from a non-blocking device before cancellation is checked again
+READ_WAIT_SECONDS = 0.1
+# Poll interval for non-blocking devices that have no select fd
+READ_POLL_SECONDS = 0.01
+
+
+class SaneError(Exception):
+    """Raised when a SANE call returns a status other than success"""
+
+    def __init__(self, status: int, message: Optional[str] = None):
+        super().__init__(message or STATUS_MESSAGES.get(status, f"SANE status {status}"))
+        self.status = status
+
+
+class _Device(ctypes.Structure):
+    _fields_ = [
+        ('name', ctypes.c_char_p),
+        ('vendor', ctypes.c_char_p),
+        ('model', ctypes.c_char_p),
+        ('type', ctypes.c_char_p),
+    ]
+
+
+class _Range(ctypes.Structure):
+    _fields_ = [('min', ctypes.c_int), ('max', ctypes.c_int), ('quant', ctypes.c_int)]
+
+
+class _Constraint(ctypes.Union):
+    _fields_ = [
+        ('string_list', ctypes.POINTER(ctypes.c_char_p)),
+        ('word_list', ctypes.POINTER(ctypes.c_int)),
+        ('range', ctypes.POINTER(_Range)),
+    ]
+
+
+class _OptionDescriptor(ctypes.Structure):
+    _fields_ = [
+        ('name', ctypes.c_char_p),
+        ('title', ctypes.c_char_p),
+        ('desc', ctypes.c_char_p),
+        ('type', ctypes.c_int),
+        ('unit', ctypes.c_int),
+        ('size', ctypes.c_int),
+        ('cap', ctypes.c_int),
+        ('constraint_type', ctypes.c_int),
+        ('constraint', _Constraint),
+    ]
+
+
+class _Parameters(ctypes.Structure):
+    _fields_ = [
+        ('format', ctypes.c_int),
+        ('last_frame', ctypes.c_int),
+        ('bytes_per_line', ctypes.c_int),
+        ('pixels_per_line', ctypes.c_int),
+        ('lines', ctypes.c_int),
+        ('depth', ctypes.c_int),
+    ]
+
+
+class LibSane:
+    """Thin Python interface over libsane's C API"""
+
+    def __init__(self, path: Optional[str] = None):
+        """Load libsane, raising OSError when it is not installed"""
+        path = path or ctypes.util.find_library('sane') or 'libsane.so.1'
+        self._lib = ctypes.CDLL(path)
+        lib = self._lib
+        lib.sane_init.argtypes = [ctypes.POINTER(ctypes.c_int), ctypes.c_void_p]
+        lib.sane_get_devices.argtypes = [ctypes.POINTER(ctypes.POINTER(ctypes.POINTER(_Device))), ctypes.c_int]
+        lib.sane_open.argtypes = [ctypes.c_char_p, ctypes.POINTER(ctypes.c_void_p)]
+        lib.sane_close.argtypes = [ctypes.c_void_p]
+        lib.sane_close.restype = None
+        lib.sane_get_option_descriptor.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        lib.sane_get_option_descriptor.restype = ctypes.POINTER(_OptionDescriptor)
+        lib.sane_control_option.argtypes = [
+            ctypes.c_void_p, ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.POINTER(ctypes.c_int)
+        ]
+        lib.sane_get_parameters.argtypes = [ctypes.c_void_p, ctypes.POINTER(_Parameters)]
+        lib.sane_start.argtypes = [ctypes.c_void_p]
+        lib.sane_read.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int, ctypes.POINTER(ctypes.c_int)]
+        lib.sane_set_io_mode.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        lib.sane_get_select_fd.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_int)]
+        lib.sane_cancel.argtypes = [ctypes.c_void_p]
+        lib.sane_cancel.restype = None
+        lib.sane_exit.restype = None
+        lib.sane_strstatus.argtypes = [ctypes.c_int]
+        lib.sane_strstatus.restype = ctypes.c_char_p
+
+    def _check(self, status: int):
+        """Raise SaneError for a failed call"""
+        if status != STATUS_GOOD:
+            message = self._lib.sane_strstatus(status)
+            raise SaneError(status, message.decode() if message else None)
+
+    def init(self) -> str:
+        """Initialize libsane, returning its version"""
+        version = ctypes.c_int()
+        self._check(self._lib.sane_init(ctypes.byref(version), None))
+        code = version.value
+        return f"libsane {(code >> 24) & 0xff}.{(code >> 16) & 0xff}.{code & 0xffff}"
+
+    def exit(self):
+        """Release libsane"""
+        self._lib.sane_exit()
+
+    def get_devices(self) -> List[Dict[str, str]]:
+        """List attached devices"""
+        devices = ctypes.POINTER(ctypes.POINTER(_Device))()
+        self._check(self._lib.sane_get_devices(ctypes.byref(devices), 0))
+        found = []
+        i = 0
+        while devices[i]:
+            device = devices[i].contents
+            found.append({
+                field: (getattr(device, field) or b'').decode('utf-8', 'replace')
+                for field in ('name', 'vendor', 'model', 'type')
+            })
+            i += 1
+        return found
+
+    def open(self, name: str) -> Any:
+        """Open a device handle"""
+        handle = ctypes.c_void_p()
+        self._check(self._lib.sane_open(name.encode(), ctypes.byref(handle)))
+        return handle
+
+    def close(self, handle: Any):
+        """Close a device handle"""
+        self._lib.sane_close(handle)
+
+    def get_options(self, handle: Any) -> Dict[str, Dict[str, Any]]:
+        """Describe the device's named options"""
+        options = {}
+        index = 1  # option 0 is the option count
+        while True:
+            descriptor = self._lib.sane_get_option_descriptor(handle, index)
+            if not descriptor:
+                break
+            d = descriptor.contents
+            if d.name and d.type not in (TYPE_GROUP, TYPE_BUTTON):
+                option = {
+                    'index': index,
+                    'type': d.type,
+                    'unit': UNITS.get(d.unit, ""),
+                    'size': d.size,
+                    'active': not d.cap & CAP_INACTIVE,
+                    'settable': bool(d.cap & CAP_SOFT_SELECT),
+                }
+                scale = FIXED_SCALE if d.type == TYPE_FIXED else 1
+                if d.constraint_type == CONSTRAINT_RANGE:
+                    r = d.constraint.range.contents
+                    option['range'] = [r.min / scale, r.max / scale]
+                    option['step'] = r.quant / scale or None
+                elif d.constraint_type == CONSTRAINT_WORD_LIST:
+                    words = d.constraint.word_list
+                    option['values'] = [
+                        words[i] / scale if scale != 1 else words[i] for i in range(1, words[0] + 1)
+                    ]
+                elif d.constraint_type == CONSTRAINT_STRING_LIST:
+                    strings = d.constraint.string_list
+                    values = []
+                    i = 0
+                    while strings[i]:
+                        values.append(strings[i].decode('utf-8', 'replace'))
+                        i += 1
+                    option['values'] = values
+                options[d.name.decode()] = option
+            index += 1
+        return options
+
+    def set_option(self, handle: Any, option: Dict[str, Any], value: Any) -> int:
+        """Set an option value, returning the info flags"""
+        if option['type'] == TYPE_STRING:
+            buffer = ctypes.create_string_buffer(str(value).encode(), max(option['size'], len(str(value)) + 1))
+        elif option['type'] == TYPE_FIXED:
+            buffer = ctypes.c_int(int(round(float(value) * FIXED_SCALE)))
+        else:
+            buffer = ctypes.c_int(int(value))
+        info = ctypes.c_int()
+        self._check(self._lib.sane_control_option(
+            handle, option['index'], ACTION_SET_VALUE, ctypes.cast(ctypes.pointer(buffer), ctypes.c_void_p),
+            ctypes.byref(info)
+        ))
+        return info.value
+
+    def start(self, handle: Any):
+        """Start acquiring a frame"""
+        self._check(self._lib.sane_start(handle))
+
+    def get_parameters(self, handle: Any) -> Dict[str, int]:
+        """Get the current frame layout"""
+        params = _Parameters()
+        self._check(self._lib.sane_get_parameters(handle, ctypes.byref(params)))
+        return {field: getattr(params, field) for field, _ in _Parameters._fields_}
+
+    def set_io_mode(self, handle: Any, non_blocking: bool) -> bool:
+        """Switch reads of the started frame to non-blocking, returning whether the backend supports it"""
+        status = self._lib.sane_set_io_mode(handle, int(non_blocking))
+        if status == STATUS_UNSUPPORTED:
+            return False
+        self._check(status)
+        return True
+
+    def get_select_fd(self, handle: Any) -> Optional[int]:
+        """Get a file descriptor that becomes readable when frame data is ready, or None"""
+        fd = ctypes.c_int()
+        status = self._lib.sane_get_select_fd(handle, ctypes.byref(fd))
+        if status == STATUS_UNSUPPORTED:
+            return None
+        self._check(status)
+        return fd.value
+
+    def read(self, handle: Any, max_length: int) -> Optional[bytes]:
+        """Read frame data, returning b'' at the end of the frame and None when no data is ready yet"""
+        buffer = (ctypes.c_ubyte * max_length)()
+        length = ctypes.c_int()
+        status = self._lib.sane_read(handle, buffer, max_length, ctypes.byref(length))
+        if status == STATUS_EOF:
+            return b''
+        self._check(status)
+        if not length.value:
+            return None
+        return bytes(buffer[:length.value])
+
+    def cancel(self, handle: Any):
+        """Finish or abort the current scan"""
+        self._lib.sane_cancel(handle)
+
+
+class FakeLibSane:
+    """Pure-Python stand-in for LibSane
+
+    Serves one virtual flatbed with a document feeder. Call counters let
+    callers check that handles and options are reused between scans.
+    """
+
+    def __init__(self, devices: Optional[List[Dict[str, str]]] = None, feeder_pages: int = 3):
+        """Initialize fake library"""
+        self.devices = devices or [
+            {'name': 'fake:0', 'vendor': 'Fake', 'model': 'In-process Flatbed', 'type': 'flatbed scanner'}
+        ]
+        self.feeder_pages = feeder_pages
+        self.calls: Dict[str, int] = {}
+        self._handles: Dict[int, Dict[str, Any]] = {}
+        self._next_handle = 1
+
+    def _count(self, name: str):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def _options(self) -> Dict[str, Dict[str, Any]]:
+        """Option descriptors shared by every fake device"""
+        return {
+            'resolution': {'index': 1, 'type': TYPE_INT, 'unit': 'dpi', 'size': 4, 'active': True,
+                           'settable': True, 'values': [75, 150, 300, 600]},
+            'mode': {'index': 2, 'type': TYPE_STRING, 'unit': '', 'size': 16, 'active': True,
+                     'settable': True, 'values': ['Color', 'Gray', 'Lineart']},
+            'source': {'index': 3, 'type': TYPE_STRING, 'unit': '', 'size': 16, 'active': True,
+                       'settable': True, 'values': ['Flatbed', 'ADF', 'ADF Duplex']},
+            'depth': {'index': 4, 'type': TYPE_INT, 'unit': 'bit', 'size': 4, 'active': True,
+                      'settable': True, 'values': [8, 16]},
+            'br-x': {'index': 5, 'type': TYPE_FIXED, 'unit': 'mm', 'size': 4, 'active': True,
+                     'settable': True, 'range': [0.0, 215.9], 'step': None},
+            'br-y': {'index': 6, 'type': TYPE_FIXED, 'unit': 'mm', 'size': 4, 'active': True,
+                     'settable': True, 'range': [0.0, 297.18], 'step': None},
+        }
+
+    def init(self) -> str:
+        self._count('init')
+        return "libsane 1.0.0 (fake)"
+
+    def exit(self):
+        self._count('exit')
+
+    def get_devices(self) -> List[Dict[str, str]]:
+        self._count('get_devices')
+        return [dict(device) for device in self.devices]
+
+    def open(self, name: str) -> Any:
+        self._count('open')
+        if name not in [device['name'] for device in self.devices]:
+            raise SaneError(STATUS_INVAL)
+        handle = self._next_handle
+        self._next_handle += 1
+        self._handles[handle] = {
+            'values': {'resolution': 75, 'mode': 'Color', 'source': 'Flatbed', 'depth': 8,
+                       'br-x': 215.9, 'br-y': 297.18},
+            'remaining': None,
+            'frame': None,
+            'non_blocking': False,
+        }
+        return handle
+
+    def close(self, handle: Any):
+        self._count('close')
+        self._handles.pop(handle, None)
+
+    def get_options(self, handle: Any) -> Dict[str, Dict[str, Any]]:
+        self._count('get_options')
+        return self._options()
+
+    def set_option(self, handle: Any, option: Dict[str, Any], value: Any) -> int:
+        self._count('set_option')
+        name = next(n for n, o in self._options().items() if o['index'] == option['index'])
+        if 'values' in option and value not in option['values']:
+            raise SaneError(STATUS_INVAL)
+        self._handles[handle]['values'][name] = value
+        return 0
+
+    def start(self, handle: Any):
+        self._count('start')
+        state = self._handles[handle]
+        if state['values']['source'] != 'Flatbed':
+            if state['remaining'] is None:
+                state['remaining'] = self.feeder_pages
+            if state['remaining'] <= 0:
+                state['remaining'] = None
+                raise SaneError(STATUS_NO_DOCS)
+            state['remaining'] -= 1
+        params = self.get_parameters(handle)
+        state['frame'] = {'params': params, 'sent': 0}
+
+    def get_parameters(self, handle: Any) -> Dict[str, int]:
+        values = self._handles[handle]['values']
+        resolution = int(values['resolution'])
+        width = int(values['br-x'] / 25.4 * resolution)
+        lines = int(values['br-y'] / 25.4 * resolution)
+        if values['mode'] == 'Lineart':
+            return {'format': FRAME_GRAY, 'last_frame': 1, 'bytes_per_line': (width + 7) // 8,
+                    'pixels_per_line': width, 'lines': lines, 'depth': 1}
+        channels = 3 if values['mode'] == 'Color' else 1
+        depth = int(values['depth'])
+        return {'format': FRAME_RGB if channels == 3 else FRAME_GRAY, 'last_frame': 1,
+                'bytes_per_line': width * channels * depth // 8, 'pixels_per_line': width,
+                'lines': lines, 'depth': depth}
+
+    def set_io_mode(self, handle: Any, non_blocking: bool) -> bool:
+        self._count('set_io_mode')
+        self._handles[handle]['non_blocking'] = non_blocking
+        return True
+
+    def get_select_fd(self, handle: Any) -> Optional[int]:
+        return None
+
+    def read(self, handle: Any, max_length: int) -> Optional[bytes]:
+        frame = self._handles[handle]['frame']
+        if frame is None:
+            raise SaneError(STATUS_INVAL)
+        params = frame['params']
+        total = params['bytes_per_line'] * params['lines']
+        if frame['sent'] >= total:
+            return b''
+        # A horizontal gradient, repeated on every line
+        line = bytes(i * 255 // max(params['bytes_per_line'] - 1, 1) for i in range(params['bytes_per_line']))
+        offset = frame['sent'] % params['bytes_per_line']
+        length = min(max_length, total - frame['sent'])
+        data = (line[offset:] + line * (length // len(line) + 1))[:length]
+        frame['sent'] += length
+        return data
+
+    def cancel(self, handle: Any):
+        self._count('cancel')
+        state = self._handles.get(handle)
+        if state:
+            state['frame'] = None
+
+
+class _FrameReader:
+    """File-like view of a SANE frame in PNM row layout
+
+    Strips per-line padding, converts 16-bit samples from machine order to
+    the big-endian order PNM uses, and aborts the scan when cancelled.
+    Library calls are made with lock held; when the device has no data
+    ready, the wait for it happens without the lock.
+    """
+
+    def __init__(
+        self,
+        library,
+        handle: Any,
+        params: Dict[str, int],
+        row_bytes: int,
+        cancelled: Optional[Callable[[], bool]] = None,
+        chunk_size: int = 64 * 1024,
+        lock: Optional[Any] = None,
+        select_fd: Optional[int] = None
+    ):
+        self.library = library
+        self.handle = handle
+        self.lock = lock or threading.RLock()
+        self.select_fd = select_fd
+        self.bytes_per_line = params['bytes_per_line']
+        self.row_bytes = row_bytes
+        self.swap = params['depth'] == 16 and sys.byteorder == 'little'
+        self.cancelled = cancelled
+        self.chunk_size = max(chunk_size, self.bytes_per_line)
+        self._raw = bytearray()
+        self._rows = bytearray()
+        self._eof = False
+
+    def _pull(self):
+        """Read one chunk from the device and move complete lines to the output"""
+        if self.cancelled and self.cancelled():
+            with self.lock:
+                self.library.cancel(self.handle)
+            raise SaneError(STATUS_CANCELLED)
+        with self.lock:
+            chunk = self.library.read(self.handle, self.chunk_size)
+        if chunk is None:
+            self._wait()
+            return
+        if not chunk:
+            self._eof = True
+            return
+        self._raw += chunk
+        complete = len(self._raw) // self.bytes_per_line * self.bytes_per_line
+        for start in range(0, complete, self.bytes_per_line):
+            row = self._raw[start:start + self.row_bytes]
+            if self.swap:
+                samples = array('H', bytes(row))
+                samples.byteswap()
+                row = samples.tobytes()
+            self._rows += row
+        del self._raw[:complete]
+
+    def _wait(self):
+        """Wait for a non-blocking device to have data, briefly so cancellation stays responsive"""
+        if self.select_fd is not None:
+            select.select([self.select_fd], [], [], READ_WAIT_SECONDS)
+        else:
+            time.sleep(READ_POLL_SECONDS)
+
+    def read(self, size: int = -1) -> bytes:
+        """Read up to size bytes of rows; everything left when size < 0"""
+        while (size < 0 or len(self._rows) < size) and not self._eof:
+            self._pull()
+        if size < 0:
+            size = len(self._rows)
+        data = bytes(self._rows[:size])
+        del self._rows[:size]
+        return data
+
+
+class InProcessSaneBackend:
+    """Scans through libsane in this process, keeping device handles open
+
+    Handles are opened on first use and reused by later scans; options
+    are only sent to the device when their value changes. Handles idle
+    for longer than idle_timeout are closed so other programs can use the
+    device.
+
+    libsane is not thread-safe, so every library call is made with _lock
+    held. Frames are read in non-blocking mode where the backend supports
+    it, waiting for data on its select fd without the lock, so a slow
+    device does not stall scans on the others; backends without
+    non-blocking I/O block in sane_read with the lock held. A device is
+    also held for a whole acquisition: scans of the same device wait for
+    each other and close_idle leaves it open.
+    """
+
+    def __init__(self, library, idle_timeout: float = 300):
+        """Initialize in-process SANE backend"""
+        self.library = library
+        self.idle_timeout = idle_timeout
+        self.version: Optional[str] = None
+        # device_id -> {'handle', 'options', 'applied', 'last_used', 'busy'}
+        self._devices: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.RLock()
+
+    def _ensure_init(self):
+        """Initialize the library once (lock held)"""
+        if self.version is None:
+            self.version = self.library.init()
+            logger.info(f"SANE initialized in-process: {self.version}")
+
+    def get_version(self) -> str:
+        """Get the libsane version, initializing the library if needed"""
+        with self._lock:
+            self._ensure_init()
+            return self.version
+
+    def list_devices(self) -> List[Dict[str, str]]:
+        """List attached devices"""
+        with self._lock:
+            self._ensure_init()
+            self.close_idle()
+            return self.library.get_devices()
+
+    def _device(self, device_id: str) -> Dict[str, Any]:
+        """Get the open handle for a device, opening it if needed"""
+        with self._lock:
+            self._ensure_init()
+            device = self._devices.get(device_id)
+            if device is None:
+                handle = self.library.open(device_id)
+                device = {
+                    'handle': handle,
+                    'options': self.library.get_options(handle),
+                    'applied': {},
+                    'last_used': time.monotonic(),
+                    # Held for the whole of an acquisition
+                    'busy': threading.Lock()
+                }
+                self._devices[device_id] = device
+                logger.info(f"Opened SANE device {device_id}")
+            device['last_used'] = time.monotonic()
+            return device
+
+    def _call(self, name: str, *args) -> Any:
+        """Call the library with _lock held"""
+        with self._lock:
+            return getattr(self.library, name)(*args)
+
+    @contextmanager
+    def _acquire(self, device_id: str) -> Iterator[Dict[str, Any]]:
+        """Hold a device, opening it if needed, for one acquisition"""
+        while True:
+            device = self._device(device_id)
+            device['busy'].acquire()
+            with self._lock:
+                if self._devices.get(device_id) is device:
+                    break
+            # Released while we waited for it; open it again
+            device['busy'].release()
+        try:
+            yield device
+        finally:
+            device['last_used'] = time.monotonic()
+            device['busy'].release()
+
+    def describe_options(self, device_id: str) -> Dict[str, Dict[str, Any]]:
+        """Get the active options of a device"""
+        device = self._device(device_id)
+        return {name: option for name, option in device['options'].items() if option['active']}
+
+    def _apply_settings(self, device: Dict[str, Any], settings: Dict[str, Any]):
+        """Send options whose value differs from what the device already has"""
+        for name, value in settings.items():
+            if value is None or device['applied'].get(name) == value:
+                continue
+            option = device['options'].get(name)
+            if not option or not option['settable']:
+                raise SaneError(STATUS_UNSUPPORTED, f"Option not supported by device: {name}")
+            info = self._call('set_option', device['handle'], option, value)
+            device['applied'][name] = value
+            if info & INFO_RELOAD_OPTIONS:
+                # Constraints changed (e.g. resolutions per source); values already set stay
+                device['options'] = self._call('get_options', device['handle'])
+
+    def _read_frame(
+        self,
+        device: Dict[str, Any],
+        on_data: Optional[Callable[[int, int], None]],
+        cancelled: Optional[Callable[[], bool]]
+    ) -> "Image.Image":
+        """Read the started frame into an image"""
+        params = self._call('get_parameters', device['handle'])
+        if params['format'] not in (FRAME_GRAY, FRAME_RGB):
+            raise SaneError(STATUS_UNSUPPORTED, "Three-pass color frames are not supported")
+
+        if params['format'] == FRAME_RGB:
+            magic = 'P6'
+        else:
+            magic = 'P4' if params['depth'] == 1 else 'P5'
+        maxval = 65535 if params['depth'] == 16 else 255
+        width = params['pixels_per_line']
+        lines = params['lines']
+
+        # Row size without padding; PNMHeader computes it from the layout
+        probe = PNMHeader(magic=magic, width=width, height=max(lines, 1), maxval=maxval)
+        select_fd = None
+        if self._call('set_io_mode', device['handle'], True):
+            select_fd = self._call('get_select_fd', device['handle'])
+        reader = _FrameReader(
+            self.library, device['handle'], params, probe.row_bytes, cancelled,
+            lock=self._lock, select_fd=select_fd
+        )
+        if lines < 0:
+            # Height unknown until the frame ends (e.g. sheet-fed without a length)
+            data = reader.read()
+            lines = len(data) // probe.row_bytes
+            stream = io.BytesIO(data)
+        else:
+            stream = reader
+        header = PNMHeader(magic=magic, width=width, height=lines, maxval=maxval)
+        return decode_raw_stream(stream, header, on_data)
+
+    def scan(
+        self,
+        device_id: str,
+        settings: Dict[str, Any],
+        on_data: Optional[Callable[[int, int], None]] = None,
+        cancelled: Optional[Callable[[], bool]] = None
+    ) -> "Image.Image":
+        """Acquire one page"""
+        with self._acquire(device_id) as device:
+            handle = device['handle']
+            try:
+                self._apply_settings(device, settings)
+                self._call('start', handle)
+                return self._read_frame(device, on_data, cancelled)
+            except SaneError as e:
+                if e.status in (STATUS_IO_ERROR, STATUS_ACCESS_DENIED):
+                    self.release(device_id)
+                raise
+            finally:
+                if self._devices.get(device_id) is device:
+                    self._call('cancel', handle)
+
+    def scan_pages(
+        self,
+        device_id: str,
+        settings: Dict[str, Any],
+        cancelled: Optional[Callable[[], bool]] = None
+    ) -> Iterator["Image.Image"]:
+        """Acquire pages from the feeder until it runs out of documents"""
+        with self._acquire(device_id) as device:
+            handle = device['handle']
+            try:
+                self._apply_settings(device, settings)
+                while True:
+                    try:
+                        self._call('start', handle)
+                    except SaneError as e:
+                        if e.status == STATUS_NO_DOCS:
+                            return
+                        raise
+                    yield self._read_frame(device, None, cancelled)
+            except SaneError as e:
+                if e.status in (STATUS_IO_ERROR, STATUS_ACCESS_DENIED):
+                    self.release(device_id)
+                raise
+            finally:
+                if self._devices.get(device_id) is device:
+                    self._call('cancel', handle)
+
+    def release(self, device_id: str):
+        """Close a device handle"""
+        with self._lock:
+            device = self._devices.pop(device_id, None)
+            if device:
+                self.library.close(device['handle'])
+                logger.info(f"Closed SANE device {device_id}")
+
+    def close_idle(self):
+        """Close handles unused for longer than idle_timeout, skipping devices mid-scan"""
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._lock:
+            idle = [
+                device_id for device_id, device in self._devices.items()
+                if device['last_used'] < cutoff and not device['busy'].locked()
+            ]
+            for device_id in idle:
+                self.release(device_id)
+
+    def close(self):
+        """Close every handle and release libsane"""
+        with self._lock:
+            for device_id in list(self._devices):
+                self.release(device_id)
+            if self.version is not None:
+                self.library.exit()
+                self.version = None
+
+
+def load_sane_library(driver: str):
+    """Get the SANE library for a scanner.sane_driver setting, or None for scanimage"""
+    if driver == "fake":
+        return FakeLibSane()
+    if driver == "libsane":
+        try:
+            return LibSane()
+        except OSError as e:
+            logger.warning(f"libsane not available ({str(e)}), falling back to scanimage")
+    return None
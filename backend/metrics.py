@@ -0,0 +1,328 @@
+"""
+Metrics - Counters, gauges and histograms in the Prometheus text format
+
+Hot paths record into plain dicts under a per-metric lock, so a timer
+costs two perf_counter calls and a bisect. Each worker process keeps its
+own registry; with several workers, snapshots are shared through the
+coordination store and summed when /metrics is served.
+"""
+
+import time
+import bisect
+import threading
+import functools
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Any, Callable, Tuple, Sequence
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; covers fast API calls up to long high-resolution scans
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SCAN_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120, 300)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """Base for labelled metrics"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if len(labels) != len(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+
+class Counter(_Metric):
+    """Monotonically increasing value, optionally read from a callback"""
+
+    kind = "counter"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        function: Optional[Callable[[], float]] = None
+    ):
+        super().__init__(name, documentation, labels)
+        self.function = function
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        """Add amount to the labelled series"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> Dict[Tuple[str, ...], float]:
+        if self.function:
+            return {(): float(self.function())}
+        with self._lock:
+            return dict(self._values)
+
+
+class Gauge(Counter):
+    """Value that can go up and down, optionally read from a callback"""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        """Set the labelled series"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels):
+        """Subtract amount from the labelled series"""
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Bucketed distribution of observed values"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts (last is +Inf), sum, count]
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, **labels):
+        """Record one observation"""
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a with block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def timed(self, **labels):
+        """Decorator observing the duration of each call"""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - started, **labels)
+            return wrapper
+        return decorator
+
+    def collect(self) -> Dict[Tuple[str, ...], List[Any]]:
+        with self._lock:
+            return {key: [list(series[0]), series[1], series[2]] for key, series in self._series.items()}
+
+
+class MetricsRegistry:
+    """Named metrics of one process"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> Any:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                # Re-registering (e.g. a module reloaded) returns the original
+                return existing
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = (),
+                function: Optional[Callable[[], float]] = None) -> Counter:
+        return self._register(Counter(name, documentation, labels, function))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = (),
+              function: Optional[Callable[[], float]] = None) -> Gauge:
+        return self._register(Gauge(name, documentation, labels, function))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def set_function(self, name: str, function: Callable[[], float]):
+        """Read a counter or gauge from a callback, e.g. state owned by another object"""
+        self._metrics[name].function = function
+
+    def snapshot(self) -> Dict[str, Any]:
+        """JSON-serializable copy of every metric's current values"""
+        metrics = {}
+        for metric in list(self._metrics.values()):
+            try:
+                values = metric.collect()
+            except Exception:
+                # A callback whose owner is gone reports nothing
+                values = {}
+            entry = {
+                "type": metric.kind,
+                "help": metric.documentation,
+                "labels": list(metric.labels),
+                "series": [[list(key), value] for key, value in values.items()]
+            }
+            if isinstance(metric, Histogram):
+                entry["buckets"] = list(metric.buckets)
+            metrics[metric.name] = entry
+        return {"created": time.time(), "metrics": metrics}
+
+
+def merge_snapshots(snapshots: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Sum the snapshots of several workers series by series"""
+    merged: Dict[str, Any] = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot["metrics"].items():
+            target = merged.setdefault(name, dict(metric, series={}))
+            for key, value in metric["series"]:
+                key = tuple(key)
+                current = target["series"].get(key)
+                if current is None:
+                    target["series"][key] = value
+                elif metric["type"] == "histogram":
+                    target["series"][key] = [
+                        [a + b for a, b in zip(current[0], value[0])],
+                        current[1] + value[1],
+                        current[2] + value[2]
+                    ]
+                else:
+                    target["series"][key] = current + value
+    for metric in merged.values():
+        metric["series"] = [[list(key), value] for key, value in metric["series"].items()]
+    return {"created": time.time(), "metrics": merged}
+
+
+def add_ratio(snapshot: Dict[str, Any], name: str, documentation: str, numerator: str, denominator: List[str]):
+    """Add a gauge dividing one unlabelled series by the sum of others
+
+    Ratios are derived after merging, since summing per-worker ratios is
+    meaningless.
+    """
+    def total(metric_name: str) -> float:
+        metric = snapshot["metrics"].get(metric_name)
+        return sum(value for _, value in metric["series"]) if metric else 0
+
+    whole = sum(total(metric_name) for metric_name in denominator)
+    snapshot["metrics"][name] = {
+        "type": "gauge",
+        "help": documentation,
+        "labels": [],
+        "series": [[[], total(numerator) / whole if whole else 0]]
+    }
+
+
+def render(snapshot: Dict[str, Any]) -> str:
+    """Format a snapshot in the Prometheus text exposition format"""
+    lines = []
+    for name, metric in sorted(snapshot["metrics"].items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        labels = metric["labels"]
+        for key, value in sorted(metric["series"], key=lambda series: series[0]):
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{_format_labels(labels, key)} {_format_value(value)}")
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for bound, bucket_count in zip(list(metric["buckets"]) + [float('inf')], counts):
+                cumulative += bucket_count
+                le = ("le", _format_value(bound))
+                lines.append(f"{name}_bucket{_format_labels(labels, key, le)} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels, key)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(labels, key)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+SCAN_DURATION = REGISTRY.histogram(
+    "scanner_scan_duration_seconds", "Time from a scan starting on the device to its record being stored",
+    ["outcome"], buckets=SCAN_BUCKETS
+)
+SCAN_STAGE_DURATION = REGISTRY.histogram(
+    "scanner_scan_stage_seconds", "Time spent per scan stage: acquire (device to decoded image) and encode",
+    ["stage"], buckets=SCAN_BUCKETS
+)
+QUEUE_WAIT = REGISTRY.histogram(
+    "scanner_queue_wait_seconds", "Time scan jobs wait in the queue before starting",
+    buckets=SCAN_BUCKETS
+)
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    "scanner_http_request_duration_seconds", "HTTP request handling time until the response is returned",
+    ["method", "endpoint", "status"]
+)
+IMAGE_BYTES_SERVED = REGISTRY.counter(
+    "scanner_image_bytes_served_total", "Image bytes sent in HTTP responses", ["endpoint"]
+)
+IMAGE_OPERATION_DURATION = REGISTRY.histogram(
+    "scanner_image_operation_seconds", "ImageProcessor call time, including cache lookups", ["operation"]
+)
+DOCUMENT_PAGES = REGISTRY.counter(
+    "scanner_document_pages_total", "Pages written into PDF or TIFF documents, by how they were stored",
+    ["format", "compression"]
+)
+SCANIMAGE_FAILURES = REGISTRY.counter(
+    "scanner_scanimage_failures_total", "Failed scanimage invocations", ["operation"]
+)
+CACHE_HITS = REGISTRY.counter("scanner_cache_hits_total", "Derivative cache hits")
+CACHE_MISSES = REGISTRY.counter("scanner_cache_misses_total", "Derivative cache misses")
+SOCKETIO_CONNECTIONS = REGISTRY.gauge("scanner_socketio_connections", "Connected Socket.IO clients")
+SOCKETIO_DISCONNECTS = REGISTRY.counter(
+    "scanner_socketio_disconnects_total", "Socket.IO connections refused, dropped or reaped by the server", ["reason"]
+)
+IMAGE_ENGINE_PENDING = REGISTRY.gauge(
+    "scanner_image_engine_pending", "Image operations submitted to the process pool and not yet finished"
+)
+IMAGE_ENGINE_REJECTIONS = REGISTRY.counter(
+    "scanner_image_engine_rejections_total", "Image operations refused because the process pool stayed saturated"
+)
+SOCKETIO_EVENTS = REGISTRY.counter(
+    "scanner_socketio_events_total", "Outbound Socket.IO events, sent or dropped as superseded", ["outcome"]
+)
+SOCKETIO_FRAMES = REGISTRY.counter("scanner_socketio_frames_total", "Outbound Socket.IO frames, each one or more events")
+SYNC_REQUESTS = REGISTRY.counter(
+    "scanner_sync_requests_total", "Client catch-up requests, answered with changes or a full snapshot", ["result"]
+)
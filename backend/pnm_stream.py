@@ -0,0 +1,180 @@
+"""
+PNM Stream - Decodes scanimage PNM output incrementally from a pipe
+
+scanimage writes a PBM/PGM/PPM header followed by raw rows. Rows are read in
+bands and pasted straight into the destination image, so the scan never
+touches disk before it is encoded and only one band of raw bytes is held on
+top of the decoded bitmap. Raw frames read from libsane use the same row
+layout and are decoded with decode_raw_stream.
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import BinaryIO, Callable, Optional
+
+try:
+    from PIL import Image
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+
+logger = logging.getLogger(__name__)
+
+# Rows decoded per read; keeps each band around a few MB at 600 dpi color
+BAND_ROWS = 128
+
+
+class PNMStreamError(Exception):
+    """Raised when the PNM stream is malformed or ends early"""
+    pass
+
+
+@dataclass
+class PNMHeader:
+    """Parsed PNM header"""
+    magic: str
+    width: int
+    height: int
+    maxval: int
+
+    @property
+    def mode(self) -> str:
+        """Pillow image mode for this stream"""
+        if self.magic == 'P4':
+            return '1'
+        if self.magic == 'P5':
+            return 'I;16' if self.maxval > 255 else 'L'
+        return 'RGB'
+
+    @property
+    def rawmode(self) -> str:
+        """Pillow raw decoder mode for this stream"""
+        if self.magic == 'P4':
+            # PBM stores 1 as black, Pillow stores 1 as white
+            return '1;I'
+        if self.magic == 'P5':
+            return 'I;16B' if self.maxval > 255 else 'L'
+        return 'RGB;16B' if self.maxval > 255 else 'RGB'
+
+    @property
+    def row_bytes(self) -> int:
+        """Bytes per raw row"""
+        if self.magic == 'P4':
+            return (self.width + 7) // 8
+        channels = 3 if self.magic == 'P6' else 1
+        sample_bytes = 2 if self.maxval > 255 else 1
+        return self.width * channels * sample_bytes
+
+    @property
+    def data_bytes(self) -> int:
+        """Total raw bytes following the header"""
+        return self.row_bytes * self.height
+
+
+def scale_to_8bit(image: "Image.Image") -> "Image.Image":
+    """Reduce a 16-bit grayscale image to L, keeping the top 8 bits of each sample
+
+    A plain convert('L') clips every sample above 255 instead.
+    """
+    return image.convert('I').point(lambda value: value / 256).convert('L')
+
+
+def _read_token(stream: BinaryIO) -> bytes:
+    """Read one whitespace-delimited header token, skipping comments"""
+    token = b''
+    while True:
+        char = stream.read(1)
+        if not char:
+            if token:
+                return token
+            raise PNMStreamError("Unexpected end of stream in PNM header")
+        if char == b'#' and not token:
+            while char not in (b'\n', b''):
+                char = stream.read(1)
+            continue
+        if char.isspace():
+            if token:
+                return token
+            continue
+        token += char
+
+
+def read_pnm_header(stream: BinaryIO) -> PNMHeader:
+    """Parse a binary PNM header, leaving the stream at the first data byte"""
+    magic = _read_token(stream).decode('ascii', 'replace')
+    if magic not in ('P4', 'P5', 'P6'):
+        raise PNMStreamError(f"Unsupported PNM type: {magic}")
+
+    try:
+        width = int(_read_token(stream))
+        height = int(_read_token(stream))
+        # The single whitespace after the last token is consumed by _read_token
+        maxval = 1 if magic == 'P4' else int(_read_token(stream))
+    except ValueError:
+        raise PNMStreamError("Invalid PNM header")
+
+    if width <= 0 or height <= 0:
+        raise PNMStreamError(f"Invalid PNM dimensions: {width}x{height}")
+
+    return PNMHeader(magic=magic, width=width, height=height, maxval=maxval)
+
+
+def _read_exact(stream: BinaryIO, size: int) -> bytes:
+    """Read exactly size bytes from a pipe"""
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = stream.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+def decode_pnm_stream(
+    stream: BinaryIO,
+    on_data: Optional[Callable[[int, int], None]] = None
+) -> "Image.Image":
+    """Decode a PNM image from a stream band by band
+
+    on_data, when given, is called with (bytes_received, bytes_expected)
+    after every band.
+    """
+    if not HAS_PIL:
+        raise ImportError("PIL not available")
+
+    header = read_pnm_header(stream)
+    logger.debug(f"PNM stream: {header.magic} {header.width}x{header.height} maxval={header.maxval}")
+    return decode_raw_stream(stream, header, on_data)
+
+
+def decode_raw_stream(
+    stream: BinaryIO,
+    header: PNMHeader,
+    on_data: Optional[Callable[[int, int], None]] = None
+) -> "Image.Image":
+    """Decode raw PNM-layout rows described by header, band by band"""
+    if not HAS_PIL:
+        raise ImportError("PIL not available")
+
+    image = Image.new(header.mode, (header.width, header.height))
+    received = 0
+    row = 0
+    while row < header.height:
+        rows = min(BAND_ROWS, header.height - row)
+        data = _read_exact(stream, rows * header.row_bytes)
+        if len(data) < rows * header.row_bytes:
+            raise PNMStreamError(
+                f"PNM stream ended after {row + len(data) // header.row_bytes} of {header.height} rows"
+            )
+
+        band = Image.frombytes(header.mode, (header.width, rows), data, 'raw', header.rawmode)
+        image.paste(band, (0, row))
+        row += rows
+        received += len(data)
+
+        if on_data:
+            on_data(received, header.data_bytes)
+
+    return image
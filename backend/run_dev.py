@@ -0,0 +1,43 @@
+"""
+Development server - Scanner Bridge on Flask-SocketIO's built-in server
+
+Run from the backend directory:
+    python run_dev.py
+
+Production runs under gunicorn (see gunicorn.conf.py). Image engine
+workers re-run this script by path before their first task, so the app
+is only imported inside main(); importing this module builds nothing.
+"""
+
+import os
+import sys
+import signal
+
+
+def main():
+    """Initialize the app and serve it until interrupted"""
+    from app import app, socketio, config, logger, init_app, shutdown_app
+
+    def handle_sigterm(signum, frame):
+        shutdown_app(config.get('server', {}).get('graceful_timeout', 60))
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+    init_app(background_discovery=True)
+
+    api_config = config.get('api', {})
+    debug = os.environ.get('FLASK_DEBUG', 'false').lower() in ('1', 'true', 'yes')
+    logger.info("Starting Flask development server...")
+    socketio.run(
+        app,
+        host=api_config.get('host', '127.0.0.1'),
+        port=api_config.get('port', 5000),
+        debug=debug,
+        use_reloader=debug,
+        allow_unsafe_werkzeug=True
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,420 @@
+"""
+Scan Queue - Runs scan jobs asynchronously on per-scanner worker threads
+
+Each device has its own worker so devices scan in parallel while jobs for a
+single device are serialized. Jobs waiting on a device are scheduled by
+priority lane first, then round-robin across clients within a lane.
+"""
+
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from enum import Enum
+from typing import Dict, List, Optional, Any, Callable
+
+from scanner_manager import ScannerManager, ScanStatus, ScanCancelledError
+from metrics import QUEUE_WAIT
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATES = (
+    ScanStatus.COMPLETED.value,
+    ScanStatus.ERROR.value,
+    ScanStatus.CANCELLED.value,
+)
+
+
+class QueueFullError(Exception):
+    """Raised when a scanner's job queue is at capacity"""
+    pass
+
+
+class QueueClosedError(Exception):
+    """Raised when submitting to a queue that is shutting down"""
+    pass
+
+
+class JobPriority(Enum):
+    """Scheduling lanes, highest priority first"""
+    INTERACTIVE = "interactive"
+    BULK = "bulk"
+
+
+PRIORITY_LANES = [priority.value for priority in JobPriority]
+
+
+@dataclass
+class ScanJob:
+    """A queued or running scan request"""
+    job_id: str
+    scan_id: str
+    scanner_id: str
+    params: Dict[str, Any]
+    client_id: str = "anonymous"
+    priority: str = JobPriority.INTERACTIVE.value
+    status: str = ScanStatus.QUEUED.value
+    created_at: str = field(default_factory=lambda: datetime.now().isoformat())
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    error: Optional[str] = None
+    progress: int = 0
+    pages: List[Dict[str, Any]] = field(default_factory=list)
+    cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+    listener: Optional[Callable[["ScanJob"], None]] = field(default=None, repr=False)
+    progress_listener: Optional[Callable[["ScanJob"], None]] = field(default=None, repr=False)
+    page_listener: Optional[Callable[["ScanJob", Dict[str, Any]], None]] = field(default=None, repr=False)
+    min_progress_interval: float = field(default=0.25, repr=False)
+    _last_progress_at: float = field(default=0.0, init=False, repr=False)
+    _queued_at: float = field(default_factory=time.monotonic, init=False, repr=False)
+
+    @property
+    def cancelled(self) -> bool:
+        """Whether cancellation has been requested"""
+        return self.cancel_event.is_set()
+
+    @property
+    def finished(self) -> bool:
+        """Whether the job has reached a terminal state"""
+        return self.status in FINISHED_STATES
+
+    def set_status(self, status: str, error: Optional[str] = None):
+        """Update job status and notify the listener"""
+        self.status = status
+        if status == ScanStatus.SCANNING.value and not self.started_at:
+            self.started_at = datetime.now().isoformat()
+        if status in FINISHED_STATES:
+            self.finished_at = datetime.now().isoformat()
+        if error is not None:
+            self.error = error
+
+        if self.listener:
+            try:
+                self.listener(self)
+            except Exception as e:
+                logger.error(f"Error in job listener for {self.job_id}: {str(e)}")
+
+    def set_progress(self, progress: int):
+        """Update progress, notifying at most once per min_progress_interval"""
+        progress = max(0, min(100, int(progress)))
+        if progress == self.progress:
+            return
+        self.progress = progress
+
+        now = time.monotonic()
+        if progress < 100 and now - self._last_progress_at < self.min_progress_interval:
+            return
+        self._last_progress_at = now
+
+        if self.progress_listener:
+            try:
+                self.progress_listener(self)
+            except Exception as e:
+                logger.error(f"Error in progress listener for {self.job_id}: {str(e)}")
+
+    def add_page(self, page: Dict[str, Any]):
+        """Record a finished page of a batch job and notify the page listener"""
+        self.pages.append(page)
+
+        if self.page_listener:
+            try:
+                self.page_listener(self, page)
+            except Exception as e:
+                logger.error(f"Error in page listener for {self.job_id}: {str(e)}")
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize job for API responses"""
+        return {
+            'job_id': self.job_id,
+            'scan_id': self.scan_id,
+            'scanner_id': self.scanner_id,
+            'params': self.params,
+            'client_id': self.client_id,
+            'priority': self.priority,
+            'status': self.status,
+            'progress': self.progress,
+            'pages': list(self.pages),
+            'page_count': len(self.pages),
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'error': self.error
+        }
+
+
+class FairJobQueue:
+    """Bounded job queue with priority lanes and per-client round-robin"""
+
+    def __init__(self, maxsize: int):
+        """Initialize fair job queue"""
+        self.maxsize = maxsize
+        # lane -> client_id -> pending jobs; dict order is the round-robin order
+        self._lanes: Dict[str, "OrderedDict[str, deque]"] = {
+            lane: OrderedDict() for lane in PRIORITY_LANES
+        }
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def put(self, job: ScanJob):
+        """Add a job, raising QueueFullError at capacity"""
+        with self._cond:
+            if self._size >= self.maxsize:
+                raise QueueFullError(f"Scan queue full for scanner {job.scanner_id}")
+            lane = self._lanes[job.priority]
+            lane.setdefault(job.client_id, deque()).append(job)
+            self._size += 1
+            self._cond.notify()
+
+    def get(self) -> Optional[ScanJob]:
+        """Block until a job is available; returns None once closed and drained"""
+        with self._cond:
+            while self._size == 0 and not self._closed:
+                self._cond.wait()
+            if self._size == 0:
+                return None
+
+            for lane_name in PRIORITY_LANES:
+                lane = self._lanes[lane_name]
+                if not lane:
+                    continue
+                client_id, jobs = next(iter(lane.items()))
+                job = jobs.popleft()
+                # Serve the next client first on the following pick
+                if jobs:
+                    lane.move_to_end(client_id)
+                else:
+                    del lane[client_id]
+                self._size -= 1
+                return job
+            return None
+
+    def remove(self, job: ScanJob) -> bool:
+        """Remove a pending job, returning whether it was still queued"""
+        with self._cond:
+            lane = self._lanes[job.priority]
+            jobs = lane.get(job.client_id)
+            if not jobs or job not in jobs:
+                return False
+            jobs.remove(job)
+            if not jobs:
+                del lane[job.client_id]
+            self._size -= 1
+            return True
+
+    def close(self):
+        """Stop accepting work and wake the worker once the queue drains"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def qsize(self) -> int:
+        """Get number of pending jobs"""
+        with self._cond:
+            return self._size
+
+
+class ScanJobQueue:
+    """Bounded per-scanner job queues, each drained by its own worker thread"""
+
+    def __init__(
+        self,
+        scanner_manager: ScannerManager,
+        max_queue_size: int = 20,
+        max_finished_jobs: int = 500,
+        listener: Optional[Callable[[ScanJob], None]] = None,
+        progress_listener: Optional[Callable[[ScanJob], None]] = None,
+        page_listener: Optional[Callable[[ScanJob, Dict[str, Any]], None]] = None,
+        progress_updates_per_second: float = 4
+    ):
+        """Initialize scan job queue"""
+        self.scanner_manager = scanner_manager
+        self.max_queue_size = max_queue_size
+        self.max_finished_jobs = max_finished_jobs
+        self.listener = listener
+        self.progress_listener = progress_listener
+        self.page_listener = page_listener
+        self.min_progress_interval = 1.0 / progress_updates_per_second if progress_updates_per_second > 0 else 0.0
+        self.jobs: "OrderedDict[str, ScanJob]" = OrderedDict()
+        self._queues: Dict[str, FairJobQueue] = {}
+        self._workers: Dict[str, threading.Thread] = {}
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        scanner_id: str,
+        params: Dict[str, Any],
+        client_id: str = "anonymous",
+        priority: str = JobPriority.INTERACTIVE.value,
+        job_id: Optional[str] = None,
+        scan_id: Optional[str] = None
+    ) -> ScanJob:
+        """Queue a scan job and return immediately
+
+        job_id and scan_id are assigned by the caller when the job was
+        accepted by another worker process.
+        """
+        if not self.scanner_manager.has_scanner(scanner_id):
+            raise ValueError(f"Scanner not found: {scanner_id}")
+        if priority not in PRIORITY_LANES:
+            raise ValueError(f"Unknown priority: {priority}")
+
+        job = ScanJob(
+            job_id=job_id or self.new_job_id(),
+            scan_id=scan_id or self.scanner_manager.new_scan_id(),
+            scanner_id=scanner_id,
+            params=dict(params),
+            client_id=client_id,
+            priority=priority,
+            listener=self.listener,
+            progress_listener=self.progress_listener,
+            page_listener=self.page_listener,
+            min_progress_interval=self.min_progress_interval
+        )
+
+        with self._lock:
+            if self._closed:
+                raise QueueClosedError("Scan queue is shutting down")
+            job_queue = self._get_queue(scanner_id)
+            if job_queue.qsize() >= self.max_queue_size:
+                raise QueueFullError(f"Scan queue full for scanner {scanner_id}")
+            self.jobs[job.job_id] = job
+            self._prune_finished_jobs()
+            # Announce before the worker can pick the job up so events stay ordered
+            job.set_status(ScanStatus.QUEUED.value)
+            job_queue.put(job)
+
+        logger.info(f"Queued scan job {job.job_id} ({job.scan_id}) on scanner {scanner_id}")
+        return job
+
+    def new_job_id(self) -> str:
+        """Generate a unique job ID"""
+        return f"job_{uuid.uuid4().hex[:12]}"
+
+    def cancel(self, job_id: str) -> Optional[ScanJob]:
+        """Cancel a queued or running job"""
+        job = self.get_job(job_id)
+        if not job:
+            return None
+        if job.finished:
+            return job
+
+        job.cancel_event.set()
+        with self._lock:
+            job_queue = self._queues.get(job.scanner_id)
+        if job_queue and job_queue.remove(job):
+            # Never started, so free its slot now; running jobs stop in the worker
+            job.set_status(ScanStatus.CANCELLED.value)
+        logger.info(f"Cancellation requested for job {job_id}")
+        return job
+
+    def get_job(self, job_id: str) -> Optional[ScanJob]:
+        """Get a job by ID"""
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def list_jobs(
+        self,
+        scanner_id: Optional[str] = None,
+        status: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """List known jobs, newest first"""
+        with self._lock:
+            jobs = list(self.jobs.values())
+        jobs.reverse()
+        return [
+            job.to_dict() for job in jobs
+            if (scanner_id is None or job.scanner_id == scanner_id)
+            and (status is None or job.status == status)
+        ]
+
+    def queue_depth(self, scanner_id: str) -> int:
+        """Get number of jobs waiting for a scanner"""
+        with self._lock:
+            job_queue = self._queues.get(scanner_id)
+            return job_queue.qsize() if job_queue else 0
+
+    def _get_queue(self, scanner_id: str) -> FairJobQueue:
+        """Get or lazily create the queue and worker for a scanner (lock held)"""
+        job_queue = self._queues.get(scanner_id)
+        if job_queue is None:
+            job_queue = FairJobQueue(self.max_queue_size)
+            self._queues[scanner_id] = job_queue
+            worker = threading.Thread(
+                target=self._worker_loop,
+                args=(scanner_id, job_queue),
+                name=f"scan-worker-{scanner_id}",
+                daemon=True
+            )
+            self._workers[scanner_id] = worker
+            worker.start()
+        return job_queue
+
+    def _worker_loop(self, scanner_id: str, job_queue: FairJobQueue):
+        """Run jobs for one scanner in scheduling order"""
+        logger.info(f"Scan worker started for scanner {scanner_id}")
+        while True:
+            job = job_queue.get()
+            if job is None:
+                break
+            if job.cancelled:
+                # Dequeued before cancel() could remove it, so never marked
+                if not job.finished:
+                    job.set_status(ScanStatus.CANCELLED.value)
+                continue
+            self._run_job(job)
+        logger.info(f"Scan worker stopped for scanner {scanner_id}")
+
+    def _run_job(self, job: ScanJob):
+        """Execute a single job"""
+        QUEUE_WAIT.observe(time.monotonic() - job._queued_at)
+        try:
+            self.scanner_manager.start_scan(job.scanner_id, job.params, scan_id=job.scan_id, job=job)
+            job.set_status(ScanStatus.COMPLETED.value)
+        except ScanCancelledError:
+            job.set_status(ScanStatus.CANCELLED.value)
+        except Exception as e:
+            logger.error(f"Scan job {job.job_id} failed: {str(e)}")
+            job.set_status(ScanStatus.ERROR.value, error=str(e))
+
+    def _prune_finished_jobs(self):
+        """Drop the oldest finished jobs beyond the retention limit (lock held)"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[job_id]
+
+    def shutdown(self, timeout: Optional[float] = None) -> bool:
+        """Stop accepting jobs, cancel queued ones and let running scans finish
+
+        Scans still running when the timeout expires are cancelled. Returns
+        whether every worker finished within the timeout.
+        """
+        with self._lock:
+            self._closed = True
+            queues = list(self._queues.values())
+            workers = list(self._workers.values())
+            jobs = list(self.jobs.values())
+
+        for job in jobs:
+            if job.status == ScanStatus.QUEUED.value:
+                self.cancel(job.job_id)
+        for job_queue in queues:
+            job_queue.close()
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for worker in workers:
+            worker.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+
+        drained = not any(worker.is_alive() for worker in workers)
+        if not drained:
+            logger.warning("Scan jobs still running at shutdown deadline, cancelling them")
+            for job in jobs:
+                if not job.finished:
+                    job.cancel_event.set()
+            for worker in workers:
+                worker.join(5)
+        return drained
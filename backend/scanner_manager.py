@@ -10,10 +10,14 @@ import uuid
 import logging
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Callable, Tuple, TYPE_CHECKING
 from dataclasses import dataclass, asdict
 from enum import Enum
+import re
+import queue
+import shutil
 import subprocess
+import threading
 import time
 
 try:
@@ -21,8 +25,38 @@ try:
 except ImportError:
     win32com = None
 
+from pnm_stream import decode_pnm_stream, scale_to_8bit, PNMStreamError
+from history_store import ScanHistoryStore
+from capabilities import CapabilityCache, SaneCapabilityProbe, DEFAULT_CAPABILITIES, capabilities_from_options
+from libsane import (
+    InProcessSaneBackend, SaneError, load_sane_library, STATUS_CANCELLED, STATUS_INVAL, STATUS_UNSUPPORTED
+)
+from drivers import ScanDriver, DriverCancelledError
+from simulated_scanner import SimulatedScannerDriver
+from metrics import SCAN_DURATION, SCAN_STAGE_DURATION, SCANIMAGE_FAILURES
+
+if TYPE_CHECKING:
+    from PIL import Image
+    from scan_queue import ScanJob
+    from image_engine import ImageEngine
+
 logger = logging.getLogger(__name__)
 
+# scanimage reports the end of each batch page attempt on stderr, before it
+# closes and renames the page file; status 0 (good) or 5 (EOF) means a page
+# was scanned, anything else (7: feeder empty) that there is no page
+BATCH_PAGE_PATTERN = re.compile(r"Scanned page (\d+)\.(?:\s*\(scanner status = (\d+)\))?")
+# Printed when the next page starts, once the previous page file is in place
+BATCH_NEXT_PATTERN = re.compile(r"Scanning page (\d+)")
+BATCH_PAGE_STATUSES = (0, 5)
+
+# Document feeder sources, as named by most SANE backends
+SANE_SOURCES = {
+    'flatbed': 'Flatbed',
+    'adf': 'ADF',
+    'adf_duplex': 'ADF Duplex'
+}
+
 
 class ScannerStatus(Enum):
     """Scanner status enumeration"""
@@ -35,10 +69,17 @@ class ScannerStatus(Enum):
 class ScanStatus(Enum):
     """Scan operation status"""
     IDLE = "idle"
+    QUEUED = "queued"
     SCANNING = "scanning"
     PROCESSING = "processing"
     COMPLETED = "completed"
     ERROR = "error"
+    CANCELLED = "cancelled"
+
+
+class ScanCancelledError(Exception):
+    """Raised when a running scan is cancelled"""
+    pass
 
 
 @dataclass
@@ -66,21 +107,73 @@ class ScanInfo:
     file_path: str
     file_size: int
     status: str
+    batch_id: Optional[str] = None
+    page: Optional[int] = None
 
 
 class ScannerManager:
     """Manages scanner detection and control"""
     
-    def __init__(self):
-        """Initialize scanner manager"""
+    def __init__(
+        self,
+        scan_dir: str = "./scans",
+        history_db: Optional[str] = None,
+        max_history_items: Optional[int] = None,
+        capability_cache: Optional[str] = None,
+        sane_driver: str = "scanimage",
+        image_engine: Optional["ImageEngine"] = None
+    ):
+        """Initialize scanner manager
+        
+        sane_driver selects how SANE devices are driven on Linux: "scanimage"
+        runs one scanimage process per call, "libsane" talks to libsane
+        in-process and keeps device handles open between scans, and "fake"
+        uses an in-process simulated device. With an image_engine, scanned
+        pages are encoded in its process pool.
+        """
         self.scanners: Dict[str, Scanner] = {}
         self.current_scanner_id: Optional[str] = None
-        self.scan_history: Dict[str, ScanInfo] = {}
         self.current_scan_status = ScanStatus.IDLE.value
+        self.scanner_scan_status: Dict[str, str] = {}
+        self._lock = threading.RLock()
+        self._device_locks: Dict[str, threading.Lock] = {}
+        self._discovery_lock = threading.Lock()
         self.platform = self._detect_platform()
-        self.scan_dir = Path("./scans")
+        self.scan_dir = Path(scan_dir)
         self.scan_dir.mkdir(exist_ok=True)
+        self.image_engine = image_engine
+        self.history = ScanHistoryStore(
+            history_db or str(self.scan_dir / "history.sqlite3"),
+            max_items=max_history_items
+        )
+        library = load_sane_library(sane_driver) if self.platform == 'linux' else None
+        self.sane_backend: Optional[InProcessSaneBackend] = InProcessSaneBackend(library) if library else None
+        cache = CapabilityCache(capability_cache or str(self.scan_dir / "capabilities.json"))
+        if self.sane_backend:
+            backend = self.sane_backend
+            self.capability_probe = SaneCapabilityProbe(
+                cache,
+                prober=lambda device_id: capabilities_from_options(backend.describe_options(device_id)),
+                version_reader=backend.get_version
+            )
+        else:
+            self.capability_probe = SaneCapabilityProbe(cache)
+        # Pluggable drivers by the driver_type of the scanners they serve
+        self.drivers: Dict[str, ScanDriver] = {}
+        # Serves development scanners on platforms without a native scan path
+        self._fallback_driver: Optional[ScanDriver] = None
+        # Called with a scan ID after its record and file are removed
+        self.on_scan_removed: Optional[Callable[[str], None]] = None
+        # Called with a scan's history record after it is stored
+        self.on_scan_recorded: Optional[Callable[[Dict[str, Any]], None]] = None
+        # Called with the scanner list after every discovery pass
+        self.on_scanners_changed: Optional[Callable[[List[Dict[str, Any]]], None]] = None
         
+    def register_driver(self, driver: ScanDriver):
+        """Serve a driver's devices alongside the platform's scanners"""
+        self.drivers[driver.driver_type] = driver
+        logger.info(f"Registered scanner driver: {driver.driver_type}")
+    
     def _detect_platform(self) -> str:
         """Detect operating system"""
         if sys.platform == 'win32':
@@ -92,29 +185,86 @@ class ScannerManager:
         else:
             return 'unknown'
     
-    def initialize(self):
-        """Initialize scanner detection"""
-        logger.info(f"Initializing scanner detection for {self.platform}")
-        self.refresh_scanner_list()
+    def initialize(self, discover: bool = True):
+        """Initialize scan history and, unless discover=False, scanner detection
+        
+        Pass discover=False when a DiscoveryService runs detection in the
+        background, so startup does not wait on slow scanimage calls.
+        """
+        self.history.rebuild_from_directory(self.scan_dir)
+        logger.info(f"Scan history loaded: {self.history.count()} scan(s)")
+        
+        if discover:
+            logger.info(f"Initializing scanner detection for {self.platform}")
+            self.refresh_scanner_list()
     
-    def refresh_scanner_list(self):
-        """Refresh available scanners"""
-        logger.info("Refreshing scanner list...")
-        self.scanners.clear()
+    def refresh_scanner_list(self) -> Optional[Dict[str, List[Any]]]:
+        """Refresh available scanners
         
-        try:
-            if self.platform == 'windows':
-                self._detect_windows_scanners()
-            elif self.platform == 'linux':
-                self._detect_linux_scanners()
-            elif self.platform == 'macos':
-                self._detect_macos_scanners()
-            
-            logger.info(f"Found {len(self.scanners)} scanner(s)")
-        except Exception as e:
-            logger.error(f"Error refreshing scanner list: {str(e)}")
+        Returns the changes since the previous pass as {'added': [...],
+        'changed': [...], 'removed': [scanner_id, ...]}, or None when
+        detection failed and the previous list was kept.
+        """
+        with self._discovery_lock:
+            logger.debug("Refreshing scanner list...")
+            found: Dict[str, Scanner] = {}
+            
+            try:
+                if self.platform == 'windows':
+                    self._detect_windows_scanners(found)
+                elif self.platform == 'linux':
+                    self._detect_linux_scanners(found)
+                elif self.platform == 'macos':
+                    self._detect_macos_scanners(found)
+                for driver in self.drivers.values():
+                    self._detect_driver_scanners(driver, found)
+            except Exception as e:
+                logger.error(f"Error refreshing scanner list: {str(e)}")
+                return None
+            
+            # Swap in the new list atomically so readers never see a partial one
+            with self._lock:
+                previous = self.scanners
+                for scanner_id, scanner in previous.items():
+                    # A device that is mid-scan may not answer enumeration
+                    if scanner_id not in found and self._get_device_lock(scanner_id).locked():
+                        found[scanner_id] = scanner
+                self.scanners = found
+            
+            delta = {
+                'added': [asdict(found[s]) for s in found if s not in previous],
+                'changed': [asdict(found[s]) for s in found if s in previous and found[s] != previous[s]],
+                'removed': [s for s in previous if s not in found]
+            }
+            if any(delta.values()):
+                logger.info(
+                    f"Found {len(found)} scanner(s): {len(delta['added'])} added, "
+                    f"{len(delta['changed'])} changed, {len(delta['removed'])} removed"
+                )
+                if self.on_scanners_changed:
+                    try:
+                        self.on_scanners_changed(self.list_scanners())
+                    except Exception as e:
+                        logger.error(f"Error in scanners changed callback: {str(e)}")
+            return delta
     
-    def _detect_windows_scanners(self):
+    def _detect_driver_scanners(self, driver: ScanDriver, found: Dict[str, Scanner]):
+        """Detect the devices of a pluggable driver"""
+        for device in driver.discover():
+            scanner = Scanner(
+                id=device['id'],
+                name=device['name'],
+                manufacturer=device['manufacturer'],
+                model=device['model'],
+                status=ScannerStatus.AVAILABLE.value,
+                platform=driver.platform,
+                driver_type=driver.driver_type,
+                capabilities=device['capabilities']
+            )
+            found[scanner.id] = scanner
+            logger.debug(f"Detected {driver.driver_type} scanner: {scanner.name} ({scanner.id})")
+    
+    def _detect_windows_scanners(self, found: Dict[str, Scanner]):
         """Detect Windows scanners (WIA)"""
         if not win32com:
             logger.warning("win32com not available, skipping Windows scanner detection")
@@ -144,16 +294,19 @@ class ScannerManager:
                             "duplex": False
                         }
                     )
-                    self.scanners[scanner.id] = scanner
-                    logger.info(f"Detected WIA scanner: {scanner.name}")
+                    found[scanner.id] = scanner
+                    logger.debug(f"Detected WIA scanner: {scanner.name}")
 
         except Exception as e:
             logger.error(f"Error detecting Windows scanners: {str(e)}")
             # Fallback to mock only if explicitly requested or ensuring dev env works
-            # self._add_mock_scanner()
+            # self._add_mock_scanner(found)
     
-    def _detect_linux_scanners(self):
+    def _detect_linux_scanners(self, found: Dict[str, Scanner]):
         """Detect Linux scanners (SANE)"""
+        if self.sane_backend:
+            self._detect_in_process_scanners(found)
+            return
         try:
             # First clean run to get raw device list
             result = subprocess.run(
@@ -183,18 +336,13 @@ class ScannerManager:
                             status=ScannerStatus.AVAILABLE.value,
                             platform="linux",
                             driver_type="SANE",
-                            capabilities={
-                                "formats": ["jpeg", "png", "tiff"], # SANE typically outputs pnm/tiff, converted by us
-                                "resolutions": [75, 150, 300, 600],  # We could query this with --help -d device
-                                "color_modes": ["bw", "gray", "color"],
-                                "duplex": False
-                            }
+                            capabilities=self._sane_capabilities(device_name, vendor, model)
                         )
-                        self.scanners[scanner.id] = scanner
-                        logger.info(f"Detected SANE scanner: {scanner.name} ({scanner.id})")
+                        found[scanner.id] = scanner
+                        logger.debug(f"Detected SANE scanner: {scanner.name} ({scanner.id})")
             
             # Also try standard -L just in case formatted output fails or is unsupported on old versions
-            if not self.scanners:
+            if not found:
                 result_L = subprocess.run(['scanimage', '-L'], capture_output=True, text=True, timeout=10)
                 if result_L.returncode == 0:
                      for line in result_L.stdout.split('\n'):
@@ -220,20 +368,51 @@ class ScannerManager:
                                         "duplex": False
                                     }
                                 )
-                                 self.scanners[scanner.id] = scanner
+                                 found[scanner.id] = scanner
             
-            if not self.scanners:
-                 logger.info("No SANE scanners found.")
+            if not found:
+                 logger.debug("No SANE scanners found.")
                  # Only add mock if completely empty and explicitly wanted? 
                  # User said "DO NOT use mock scanners" as a primary strategy, but having ONE for dev is usually safe.
                  # I will NOT add it automatically to respect "DO NOT use mock scanners" strict instructions,
                  # unless the system is absolutely bare.
                  pass
 
+        except subprocess.TimeoutExpired:
+            SCANIMAGE_FAILURES.inc(operation='discovery')
+            # Keep the last known devices rather than reporting them all gone
+            raise
         except Exception as e:
             logger.warning(f"Could not detect Linux scanners: {str(e)}")
     
-    def _detect_macos_scanners(self):
+    def _detect_in_process_scanners(self, found: Dict[str, Scanner]):
+        """Detect SANE scanners through the in-process backend"""
+        for device in self.sane_backend.list_devices():
+            scanner = Scanner(
+                id=device['name'],
+                name=f"{device['vendor']} {device['model']}",
+                manufacturer=device['vendor'],
+                model=device['model'],
+                status=ScannerStatus.AVAILABLE.value,
+                platform="linux",
+                driver_type="SANE",
+                capabilities=self._sane_capabilities(device['name'], device['vendor'], device['model'])
+            )
+            found[scanner.id] = scanner
+            logger.debug(f"Detected SANE scanner: {scanner.name} ({scanner.id})")
+    
+    def _sane_capabilities(self, device_id: str, vendor: str, model: str) -> Dict[str, Any]:
+        """Get probed capabilities for a SANE device, falling back to generic ones"""
+        # Probing opens the device, so never do it while a scan holds it
+        busy = self._get_device_lock(device_id).locked()
+        capabilities = self.capability_probe.get(device_id, vendor, model, probe=not busy)
+        if capabilities is not None:
+            return capabilities
+        with self._lock:
+            previous = self.scanners.get(device_id)
+        return previous.capabilities if previous else dict(DEFAULT_CAPABILITIES)
+    
+    def _detect_macos_scanners(self, found: Dict[str, Scanner]):
         """Detect macOS scanners (ICA)"""
         try:
             import subprocess
@@ -260,13 +439,13 @@ class ScannerManager:
                     "duplex": False
                 }
             )
-            self.scanners[scanner.id] = scanner
+            found[scanner.id] = scanner
             
         except Exception as e:
             logger.warning(f"Could not detect macOS scanners: {str(e)}")
-            self._add_mock_scanner()
+            self._add_mock_scanner(found)
     
-    def _add_mock_scanner(self):
+    def _add_mock_scanner(self, found: Dict[str, Scanner]):
         """Add a mock scanner for testing/development"""
         scanner = Scanner(
             id="scanner_mock",
@@ -283,17 +462,21 @@ class ScannerManager:
                 "duplex": False
             }
         )
-        self.scanners[scanner.id] = scanner
+        found[scanner.id] = scanner
         logger.info("Added mock scanner for development")
     
     def list_scanners(self) -> List[Dict[str, Any]]:
         """Get list of available scanners"""
-        return [asdict(scanner) for scanner in self.scanners.values()]
+        with self._lock:
+            scanners = list(self.scanners.values())
+        return [asdict(scanner) for scanner in scanners]
     
     def get_scanner_info(self, scanner_id: str) -> Optional[Dict[str, Any]]:
         """Get detailed information about a scanner"""
-        if scanner_id in self.scanners:
-            return asdict(self.scanners[scanner_id])
+        with self._lock:
+            scanner = self.scanners.get(scanner_id)
+        if scanner:
+            return asdict(scanner)
         return None
     
     def select_scanner(self, scanner_id: str) -> bool:
@@ -316,8 +499,26 @@ class ScannerManager:
         """Get current scanner ID"""
         return self.current_scanner_id
     
-    def start_scan(self, scanner_id: str, params: Dict[str, Any]) -> str:
-        """Start a scan operation"""
+    def new_scan_id(self) -> str:
+        """Generate a unique scan ID"""
+        return f"scan_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+    
+    def has_scanner(self, scanner_id: str) -> bool:
+        """Check whether a scanner ID can be scanned from"""
+        return scanner_id in self.scanners or scanner_id == "scanner_mock"
+    
+    def start_scan(
+        self,
+        scanner_id: str,
+        params: Dict[str, Any],
+        scan_id: Optional[str] = None,
+        job: Optional["ScanJob"] = None
+    ) -> str:
+        """Run a scan operation to completion
+        
+        When a job is given, its status is advanced as the scan moves from
+        acquisition to processing and its cancel flag is honoured.
+        """
         if scanner_id not in self.scanners:
              # Check if it was a mock ID from a previous session or fallback
              if scanner_id == "scanner_mock":
@@ -325,24 +526,67 @@ class ScannerManager:
              else:
                 raise ValueError(f"Scanner not found: {scanner_id}")
         
-        scan_id = f"scan_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        scan_id = scan_id or self.new_scan_id()
+        
+        # Only one scan may drive a device at a time; other devices run in parallel
+        with self._get_device_lock(scanner_id):
+            return self._run_scan(scanner_id, scan_id, params, job)
+    
+    def _get_device_lock(self, scanner_id: str) -> threading.Lock:
+        """Get the lock serializing access to a device"""
+        with self._lock:
+            if scanner_id not in self._device_locks:
+                self._device_locks[scanner_id] = threading.Lock()
+            return self._device_locks[scanner_id]
+    
+    def _set_scan_status(self, scanner_id: str, status: str):
+        """Record scan status for a device"""
+        with self._lock:
+            self.scanner_scan_status[scanner_id] = status
+            self.current_scan_status = status
+    
+    def _run_scan(
+        self,
+        scanner_id: str,
+        scan_id: str,
+        params: Dict[str, Any],
+        job: Optional["ScanJob"] = None
+    ) -> str:
+        """Acquire and record a scan (device lock held)"""
+        with self._lock:
+            scanner = self.scanners.get(scanner_id)
+        platform = scanner.platform if scanner else self.platform
+        driver = self._get_driver(scanner, platform)
+        started = time.perf_counter()
         
         try:
-            self.current_scan_status = ScanStatus.SCANNING.value
+            self._set_scan_status(scanner_id, ScanStatus.SCANNING.value)
+            if job is not None:
+                job.set_status(ScanStatus.SCANNING.value)
             logger.info(f"Starting scan: {scan_id} on scanner {scanner_id}")
             
+            if params.get('batch'):
+                if driver:
+                    self._scan_driver_batch(driver, scanner_id, scan_id, params, job)
+                elif platform == "linux":
+                    self._scan_linux_batch(scanner_id, scan_id, params, job)
+                else:
+                    raise ValueError(f"Batch scanning is not supported on {platform}")
+                SCAN_DURATION.observe(time.perf_counter() - started, outcome='completed')
+                self._set_scan_status(scanner_id, ScanStatus.COMPLETED.value)
+                logger.info(f"Batch scan completed: {scan_id}")
+                return scan_id
+            
             file_path = None
             
-            if self.scanners[scanner_id].platform == "windows":
-                file_path = self._scan_windows(scanner_id, scan_id, params)
-            elif self.scanners[scanner_id].platform == "linux":
-                file_path = self._scan_linux(scanner_id, scan_id, params)
-            elif self.scanners[scanner_id].platform == "macos":
-                # Fallback implementation for macOS (not prioritized)
-                file_path = self._create_mock_scan(scan_id, params)
+            if driver:
+                file_path = self._scan_driver(driver, scanner_id, scan_id, params, job)
+            elif platform == "windows":
+                # WIA transfers an encoded file, so acquisition includes encoding
+                with SCAN_STAGE_DURATION.time(stage='acquire'):
+                    file_path = self._scan_windows(scanner_id, scan_id, params)
             else:
-                 # Mock fallback
-                 file_path = self._create_mock_scan(scan_id, params)
+                file_path = self._scan_linux(scanner_id, scan_id, params, job)
 
             # Store scan info
             scan_info = ScanInfo(
@@ -356,18 +600,113 @@ class ScannerManager:
                 file_size=os.path.getsize(file_path) if os.path.exists(file_path) else 0,
                 status=ScanStatus.COMPLETED.value
             )
-            self.scan_history[scan_id] = scan_info
+            self._record_scan(scan_info)
+            SCAN_DURATION.observe(time.perf_counter() - started, outcome='completed')
             
-            self.current_scan_status = ScanStatus.COMPLETED.value
+            self._set_scan_status(scanner_id, ScanStatus.COMPLETED.value)
             logger.info(f"Scan completed: {scan_id}")
             
             return scan_id
             
+        except ScanCancelledError:
+            SCAN_DURATION.observe(time.perf_counter() - started, outcome='cancelled')
+            self._set_scan_status(scanner_id, ScanStatus.CANCELLED.value)
+            logger.info(f"Scan cancelled: {scan_id}")
+            raise
         except Exception as e:
-            self.current_scan_status = ScanStatus.ERROR.value
+            SCAN_DURATION.observe(time.perf_counter() - started, outcome='error')
+            self._set_scan_status(scanner_id, ScanStatus.ERROR.value)
             logger.error(f"Error during scan: {str(e)}")
             raise
 
+    def _get_driver(self, scanner: Optional[Scanner], platform: str) -> Optional[ScanDriver]:
+        """Get the pluggable driver for a scanner, or None for the built-in scan paths"""
+        if scanner and scanner.driver_type in self.drivers:
+            return self.drivers[scanner.driver_type]
+        if platform in ("windows", "linux") and not (scanner and scanner.driver_type == "Mock"):
+            return None
+        # Development scanners (macOS, mock devices) are served by an instant simulator
+        if self._fallback_driver is None:
+            self._fallback_driver = SimulatedScannerDriver()
+        return self._fallback_driver
+    
+    def _driver_pages(
+        self,
+        driver: ScanDriver,
+        scanner_id: str,
+        scan_id: str,
+        params: Dict[str, Any],
+        job: Optional["ScanJob"] = None
+    ):
+        """Stream pages from a driver, relaying progress and cancellation"""
+        def on_data(received: int, expected: int):
+            if job is not None:
+                job.set_progress(received * 100 // max(expected, 1))
+        
+        # Start the scan before watching for cancellation, so the driver
+        # already knows the scan when a cancel arrives
+        pages = driver.scan_stream(scanner_id, params, on_data)
+        done = threading.Event()
+        if job is not None:
+            threading.Thread(
+                target=self._watch_driver_cancel,
+                args=(driver, scanner_id, job, done),
+                daemon=True
+            ).start()
+        try:
+            yield from pages
+        except DriverCancelledError:
+            raise ScanCancelledError(f"Scan cancelled: {scan_id}")
+        finally:
+            done.set()
+    
+    def _watch_driver_cancel(self, driver: ScanDriver, scanner_id: str, job: "ScanJob", done: threading.Event):
+        """Cancel a driver scan as soon as its job is cancelled"""
+        while not done.is_set():
+            if job.cancel_event.wait(0.5):
+                logger.info(f"Cancelling {driver.driver_type} scan {job.scan_id}")
+                driver.cancel(scanner_id)
+                return
+    
+    def _scan_driver(
+        self,
+        driver: ScanDriver,
+        scanner_id: str,
+        scan_id: str,
+        params: Dict[str, Any],
+        job: Optional["ScanJob"] = None
+    ) -> str:
+        """Perform a single-page scan through a pluggable driver"""
+        fmt = params.get('format', 'jpeg').lower()
+        file_path = self.scan_dir / f"{scan_id}.{fmt}"
+        pages = self._driver_pages(driver, scanner_id, scan_id, dict(params, batch=False), job)
+        try:
+            with SCAN_STAGE_DURATION.time(stage='acquire'):
+                image = next(pages)
+        finally:
+            pages.close()
+        
+        if job is not None:
+            job.set_status(ScanStatus.PROCESSING.value)
+        self._save_image(image, file_path, fmt)
+        return str(file_path)
+    
+    def _scan_driver_batch(
+        self,
+        driver: ScanDriver,
+        scanner_id: str,
+        scan_id: str,
+        params: Dict[str, Any],
+        job: Optional["ScanJob"] = None
+    ) -> List[ScanInfo]:
+        """Perform a multi-page batch scan through a pluggable driver"""
+        pages: List[ScanInfo] = []
+        for image in self._driver_pages(driver, scanner_id, scan_id, params, job):
+            pages.append(self._process_batch_page(scanner_id, scan_id, len(pages) + 1, image, params, job))
+        if not pages:
+            raise Exception("Document feeder out of documents")
+        return pages
+    
     def _scan_windows(self, scanner_id: str, scan_id: str, params: Dict[str, Any]) -> str:
         """Perform WIA scan on Windows"""
         if not win32com:
@@ -414,94 +753,460 @@ class ScannerManager:
             logger.error(f"WIA Scan error: {e}")
             raise
 
-    def _scan_linux(self, scanner_id: str, scan_id: str, params: Dict[str, Any]) -> str:
+    def _drain_stderr(
+        self,
+        process: subprocess.Popen,
+        lines: List[str],
+        on_line: Optional[Callable[[str], None]] = None
+    ):
+        """Collect subprocess stderr so the pipe never fills up"""
+        for raw in iter(process.stderr.readline, b''):
+            line = raw.decode(errors='replace')
+            lines.append(line)
+            if on_line:
+                on_line(line)
+    
+    def _sane_names(self, scanner_id: str, kind: str) -> Dict[str, str]:
+        """Get the device's own names for modes or sources, if probed"""
+        with self._lock:
+            scanner = self.scanners.get(scanner_id)
+        if not scanner:
+            return {}
+        return scanner.capabilities.get('sane_names', {}).get(kind, {})
+    
+    def _sane_mode(self, mode: str, scanner_id: Optional[str] = None) -> str:
+        """Map API color mode to SANE mode"""
+        device_modes = self._sane_names(scanner_id, 'modes') if scanner_id else {}
+        if mode in device_modes:
+            return device_modes[mode]
+        if mode == 'bw':
+            return 'Lineart'
+        elif mode == 'gray':
+            return 'Gray'
+        return 'Color'
+    
+    def _sane_source(self, source: Optional[str], scanner_id: Optional[str] = None) -> Optional[str]:
+        """Map API source to SANE source, passing unknown names through"""
+        if not source:
+            return None
+        device_sources = self._sane_names(scanner_id, 'sources') if scanner_id else {}
+        if source.lower() in device_sources:
+            return device_sources[source.lower()]
+        return SANE_SOURCES.get(source.lower(), source)
+    
+    def _check_rejected_options(self, scanner_id: str, stderr_lines: List[str]):
+        """Re-probe a device whose backend rejected options we believed it supports"""
+        if any('Invalid argument' in line for line in stderr_lines):
+            self._invalidate_capabilities(scanner_id)
+    
+    def _invalidate_capabilities(self, scanner_id: str):
+        """Drop the cached capabilities of a SANE device so it is probed again"""
+        with self._lock:
+            scanner = self.scanners.get(scanner_id)
+        if scanner and scanner.driver_type == "SANE":
+            self.capability_probe.invalidate(scanner_id, scanner.manufacturer, scanner.model)
+    
+    def _watch_cancel(self, process: subprocess.Popen, job: "ScanJob"):
+        """Terminate a subprocess as soon as its job is cancelled"""
+        while process.poll() is None:
+            if job.cancel_event.wait(0.5):
+                logger.info(f"Terminating scanimage for cancelled scan {job.scan_id}")
+                process.terminate()
+                return
+    
+    def _scan_linux(
+        self,
+        scanner_id: str,
+        scan_id: str,
+        params: Dict[str, Any],
+        job: Optional["ScanJob"] = None
+    ) -> str:
         """Perform SANE scan on Linux"""
+        if self.sane_backend:
+            return self._scan_in_process(scanner_id, scan_id, params, job)
         try:
             fmt = params.get('format', 'jpeg').lower()
             resolution = params.get('resolution', 300)
-            mode = params.get('color_mode', 'color')
-            
-            # Map modes
-            sane_mode = 'Color'
-            if mode == 'bw': sane_mode = 'Lineart'
-            elif mode == 'gray': sane_mode = 'Gray'
+            sane_mode = self._sane_mode(params.get('color_mode', 'color'), scanner_id)
             
             file_path = self.scan_dir / f"{scan_id}.{fmt}"
             
             # Build command
-            # scanimage --device "device_id" --resolution 300 --mode Color --format=jpeg -o output.jpg
-            # Note: native format support depends on scanimage version. 
-            # Often scanimage only outputs pnm/tiff, requiring conversion.
-            # We'll output to pnm then convert with Pillow to be safe universally.
-            
-            temp_pnm = self.scan_dir / f"{scan_id}.pnm"
-            
+            # scanimage writes PNM to stdout by default. Native format support
+            # depends on the scanimage version, so we decode the PNM stream
+            # ourselves and encode with Pillow, without a temp file.
             cmd = [
                 'scanimage',
                 '-d', scanner_id,
                 '--resolution', str(resolution),
                 '--mode', sane_mode
             ]
+            source = self._sane_source(params.get('source'), scanner_id)
+            if source:
+                cmd += ['--source', source]
             
             logger.info(f"Running SANE command: {' '.join(cmd)}")
             
-            with open(temp_pnm, 'w') as f:
-                # scanimage writes to stdout by default usually
-                process = subprocess.run(cmd, stdout=f, stderr=subprocess.PIPE)
-                
-            if process.returncode != 0:
-                raise Exception(f"SANE error: {process.stderr.decode()}")
-                
-            # Convert PNM to requested format using Pillow (which we have)
-            from PIL import Image
-            with Image.open(temp_pnm) as img:
-                img.save(str(file_path), quality=90)
-                
-            # Cleanup temp
-            if temp_pnm.exists():
-                os.remove(temp_pnm)
-                
+            acquire_started = time.perf_counter()
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            stderr_lines: List[str] = []
+            stderr_thread = threading.Thread(
+                target=self._drain_stderr,
+                args=(process, stderr_lines),
+                daemon=True
+            )
+            stderr_thread.start()
+            if job is not None:
+                threading.Thread(target=self._watch_cancel, args=(process, job), daemon=True).start()
+            
+            def on_data(received: int, expected: int):
+                # Progress is measured as raw bytes received against the image size
+                if job is not None:
+                    job.set_progress(received * 100 // max(expected, 1))
+            
+            image = None
+            stream_error = None
+            try:
+                image = decode_pnm_stream(process.stdout, on_data)
+            except PNMStreamError as e:
+                stream_error = e
+            finally:
+                process.stdout.close()
+                returncode = process.wait()
+                stderr_thread.join()
+            
+            if job is not None and job.cancelled:
+                raise ScanCancelledError(f"Scan cancelled: {scan_id}")
+            if returncode != 0 or stream_error:
+                SCANIMAGE_FAILURES.inc(operation='scan')
+            if returncode != 0:
+                self._check_rejected_options(scanner_id, stderr_lines)
+                raise Exception(f"SANE error: {''.join(stderr_lines)}")
+            if stream_error:
+                raise stream_error
+            SCAN_STAGE_DURATION.observe(time.perf_counter() - acquire_started, stage='acquire')
+            
+            if job is not None:
+                job.set_status(ScanStatus.PROCESSING.value)
+            
+            self._save_image(image, file_path, fmt)
             return str(file_path)
 
+        except ScanCancelledError:
+            raise
         except Exception as e:
             logger.error(f"SANE Scan error: {e}")
             raise
     
-    def get_scan_status(self) -> str:
-        """Get current scan status"""
-        return self.current_scan_status
+    def _scan_linux_batch(
+        self,
+        scanner_id: str,
+        scan_id: str,
+        params: Dict[str, Any],
+        job: Optional["ScanJob"] = None
+    ) -> List[ScanInfo]:
+        """Perform a multi-page SANE batch scan
+        
+        Each page is encoded and recorded as soon as its file is complete,
+        which scanimage signals by starting the next page or exiting, while
+        the feeder keeps scanning the next one.
+        """
+        if self.sane_backend:
+            return self._scan_in_process_batch(scanner_id, scan_id, params, job)
+        
+        batch_dir = self.scan_dir / f"{scan_id}_batch"
+        batch_dir.mkdir(exist_ok=True)
+        
+        cmd = [
+            'scanimage',
+            '-d', scanner_id,
+            '--resolution', str(params.get('resolution', 300)),
+            '--mode', self._sane_mode(params.get('color_mode', 'color'), scanner_id),
+            '--format=pnm',
+            f"--batch={batch_dir / 'page%04d.pnm'}"
+        ]
+        source = self._sane_source(params.get('source') or 'adf', scanner_id)
+        cmd += ['--source', source]
+        
+        logger.info(f"Running SANE batch command: {' '.join(cmd)}")
+        
+        pages: List[ScanInfo] = []
+        page_queue: queue.Queue = queue.Queue()
+        stderr_lines: List[str] = []
+        # Pages scanned but possibly not yet renamed from their .part file
+        scanned: List[int] = []
+        
+        def on_line(line: str):
+            match = BATCH_PAGE_PATTERN.search(line)
+            if match:
+                if match.group(2) is None or int(match.group(2)) in BATCH_PAGE_STATUSES:
+                    scanned.append(int(match.group(1)))
+                return
+            if BATCH_NEXT_PATTERN.search(line):
+                while scanned:
+                    page_queue.put(scanned.pop(0))
+        
+        process: Optional[subprocess.Popen] = None
+        try:
+            process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            
+            def read_stderr():
+                self._drain_stderr(process, stderr_lines, on_line)
+                process.wait()
+                while scanned:
+                    page_queue.put(scanned.pop(0))
+                page_queue.put(None)
+            
+            threading.Thread(target=read_stderr, daemon=True).start()
+            if job is not None:
+                threading.Thread(target=self._watch_cancel, args=(process, job), daemon=True).start()
+            
+            # Encode pages on this thread while scanimage keeps feeding
+            while True:
+                page = page_queue.get()
+                if page is None:
+                    break
+                pnm_path = batch_dir / f"page{page:04d}.pnm"
+                if not pnm_path.exists():
+                    # scanimage was stopped before it could finish the page file
+                    logger.warning(f"Batch page {page} of {scan_id} has no complete file, skipping")
+                    continue
+                with open(pnm_path, 'rb') as f:
+                    image = decode_pnm_stream(f)
+                os.remove(pnm_path)
+                pages.append(self._process_batch_page(scanner_id, scan_id, page, image, params, job))
+            
+            returncode = process.wait()
+        finally:
+            if process is not None and process.poll() is None:
+                process.kill()
+                process.wait()
+            # Anything left over is a partial page from an aborted feed
+            shutil.rmtree(batch_dir, ignore_errors=True)
+        
+        if job is not None and job.cancelled:
+            raise ScanCancelledError(f"Batch scan cancelled after {len(pages)} page(s): {scan_id}")
+        # scanimage exits non-zero when the feeder runs dry, which is fine once pages arrived
+        if not pages and returncode != 0:
+            SCANIMAGE_FAILURES.inc(operation='batch')
+            self._check_rejected_options(scanner_id, stderr_lines)
+            raise Exception(f"SANE error: {''.join(stderr_lines)}")
+        
+        return pages
+    
+    def _process_batch_page(
+        self,
+        scanner_id: str,
+        scan_id: str,
+        page: int,
+        image: "Image.Image",
+        params: Dict[str, Any],
+        job: Optional["ScanJob"] = None
+    ) -> ScanInfo:
+        """Encode and record a single batch page"""
+        fmt = params.get('format', 'jpeg').lower()
+        page_scan_id = f"{scan_id}_p{page:03d}"
+        file_path = self.scan_dir / f"{page_scan_id}.{fmt}"
+        self._save_image(image, file_path, fmt)
+        
+        scan_info = ScanInfo(
+            scan_id=page_scan_id,
+            scanner_id=scanner_id,
+            timestamp=datetime.now().isoformat(),
+            format=fmt,
+            resolution=params.get('resolution', 300),
+            color_mode=params.get('color_mode', 'color'),
+            file_path=str(file_path),
+            file_size=os.path.getsize(file_path),
+            status=ScanStatus.COMPLETED.value,
+            batch_id=scan_id,
+            page=page
+        )
+        self._record_scan(scan_info)
+        
+        logger.info(f"Batch page {page} stored: {page_scan_id}")
+        if job is not None:
+            job.add_page(asdict(scan_info))
+        return scan_info
+    
+    def _save_image(self, image: "Image.Image", file_path: Path, fmt: str):
+        """Encode a scanned image, leaving no partial file behind on failure"""
+        with SCAN_STAGE_DURATION.time(stage='encode'):
+            # JPEG cannot store 1-bit or 16-bit images
+            if image.mode == '1' and fmt in ('jpeg', 'jpg'):
+                image = image.convert('L')
+            elif image.mode == 'I;16' and fmt in ('jpeg', 'jpg'):
+                image = scale_to_8bit(image)
+            try:
+                if self.image_engine:
+                    # The page is already scanned; wait for a slot rather than drop it
+                    self.image_engine.encode(image, file_path, {'quality': 90}, block=True)
+                else:
+                    image.save(str(file_path), quality=90)
+            except Exception:
+                if file_path.exists():
+                    os.remove(file_path)
+                raise
+    
+    def _sane_settings(self, scanner_id: str, params: Dict[str, Any], source: Optional[str]) -> Dict[str, Any]:
+        """SANE option values for a scan through the in-process backend"""
+        return {
+            'source': self._sane_source(source, scanner_id),
+            'mode': self._sane_mode(params.get('color_mode', 'color'), scanner_id),
+            'resolution': int(params.get('resolution', 300))
+        }
+    
+    def _check_in_process_error(self, scanner_id: str, scan_id: str, error: SaneError):
+        """Translate a SANE error from the in-process backend"""
+        if error.status == STATUS_CANCELLED:
+            raise ScanCancelledError(f"Scan cancelled: {scan_id}")
+        if error.status in (STATUS_INVAL, STATUS_UNSUPPORTED):
+            self._invalidate_capabilities(scanner_id)
+        raise Exception(f"SANE error: {str(error)}")
+    
+    def _scan_in_process(
+        self,
+        scanner_id: str,
+        scan_id: str,
+        params: Dict[str, Any],
+        job: Optional["ScanJob"] = None
+    ) -> str:
+        """Perform SANE scan through libsane on an already open device handle"""
+        fmt = params.get('format', 'jpeg').lower()
+        file_path = self.scan_dir / f"{scan_id}.{fmt}"
+        settings = self._sane_settings(scanner_id, params, params.get('source'))
+        logger.info(f"Scanning in-process on {scanner_id}: {settings}")
+        
+        def on_data(received: int, expected: int):
+            if job is not None:
+                job.set_progress(received * 100 // max(expected, 1))
+        
+        try:
+            with SCAN_STAGE_DURATION.time(stage='acquire'):
+                image = self.sane_backend.scan(
+                    scanner_id,
+                    settings,
+                    on_data,
+                    cancelled=(lambda: job.cancelled) if job is not None else None
+                )
+        except SaneError as e:
+            self._check_in_process_error(scanner_id, scan_id, e)
+        
+        if job is not None:
+            job.set_status(ScanStatus.PROCESSING.value)
+        self._save_image(image, file_path, fmt)
+        return str(file_path)
+    
+    def _scan_in_process_batch(
+        self,
+        scanner_id: str,
+        scan_id: str,
+        params: Dict[str, Any],
+        job: Optional["ScanJob"] = None
+    ) -> List[ScanInfo]:
+        """Perform a multi-page batch scan through libsane"""
+        settings = self._sane_settings(scanner_id, params, params.get('source') or 'adf')
+        logger.info(f"Batch scanning in-process on {scanner_id}: {settings}")
+        
+        pages: List[ScanInfo] = []
+        try:
+            for image in self.sane_backend.scan_pages(
+                scanner_id,
+                settings,
+                cancelled=(lambda: job.cancelled) if job is not None else None
+            ):
+                pages.append(self._process_batch_page(scanner_id, scan_id, len(pages) + 1, image, params, job))
+        except SaneError as e:
+            if e.status == STATUS_CANCELLED:
+                raise ScanCancelledError(f"Batch scan cancelled after {len(pages)} page(s): {scan_id}")
+            self._check_in_process_error(scanner_id, scan_id, e)
+        
+        if not pages:
+            raise Exception("SANE error: Document feeder out of documents")
+        return pages
+    
+    def close(self):
+        """Release open device handles and drivers"""
+        if self.sane_backend:
+            self.sane_backend.close()
+        for driver in self.drivers.values():
+            driver.close()
+    
+    def get_scan_status(self, scanner_id: Optional[str] = None) -> str:
+        """Get scan status for a device, or the most recent status overall"""
+        with self._lock:
+            if scanner_id:
+                return self.scanner_scan_status.get(scanner_id, ScanStatus.IDLE.value)
+            return self.current_scan_status
+    
+    def _record_scan(self, scan_info: ScanInfo):
+        """Persist a finished scan, removing files of scans past the retention limit"""
+        pruned = self.history.add(asdict(scan_info))
+        if self.on_scan_recorded:
+            try:
+                self.on_scan_recorded(self.history.get(scan_info.scan_id))
+            except Exception as e:
+                logger.error(f"Error in scan recorded hook for {scan_info.scan_id}: {str(e)}")
+        for record in pruned:
+            if os.path.exists(record['file_path']):
+                os.remove(record['file_path'])
+            self._notify_scan_removed(record['scan_id'])
+            logger.info(f"Pruned scan past history limit: {record['scan_id']}")
+    
+    def _notify_scan_removed(self, scan_id: str):
+        """Let dependents clean up after a removed scan"""
+        if self.on_scan_removed:
+            try:
+                self.on_scan_removed(scan_id)
+            except Exception as e:
+                logger.error(f"Error in scan removal hook for {scan_id}: {str(e)}")
     
     def get_scan_image(self, scan_id: str) -> Optional[str]:
         """Get path to scanned image"""
-        if scan_id in self.scan_history:
-            return self.scan_history[scan_id].file_path
+        record = self.history.get(scan_id)
+        if record:
+            return record['file_path']
         return None
     
     def get_scan_info(self, scan_id: str) -> Optional[Dict[str, Any]]:
         """Get scan information"""
-        if scan_id in self.scan_history:
-            return asdict(self.scan_history[scan_id])
-        return None
+        return self.history.get(scan_id)
+    
+    def get_batch_pages(self, batch_id: str) -> List[Dict[str, Any]]:
+        """Get the scans of a batch, first page first"""
+        return self.history.batch_pages(batch_id)
     
-    def get_scan_history(self, limit: int = 50) -> List[Dict[str, Any]]:
-        """Get scan history"""
-        items = list(self.scan_history.values())
-        # Sort by timestamp descending
-        items.sort(key=lambda x: x.timestamp, reverse=True)
-        return [asdict(item) for item in items[:limit]]
+    def get_scan_history(
+        self,
+        limit: int = 50,
+        before: Optional[str] = None,
+        scanner_id: Optional[str] = None,
+        status: Optional[str] = None,
+        batch_id: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Get a page of scan history, newest first, with the next page cursor"""
+        return self.history.query(
+            limit=limit,
+            before=before,
+            scanner_id=scanner_id,
+            status=status,
+            batch_id=batch_id
+        )
     
     def delete_scan(self, scan_id: str) -> bool:
         """Delete a scanned image"""
-        if scan_id not in self.scan_history:
+        record = self.history.get(scan_id)
+        if not record:
             return False
         
         try:
-            file_path = self.scan_history[scan_id].file_path
+            file_path = record['file_path']
             if os.path.exists(file_path):
                 os.remove(file_path)
                 logger.info(f"Deleted scan file: {file_path}")
             
-            del self.scan_history[scan_id]
+            self.history.delete(scan_id)
+            self._notify_scan_removed(scan_id)
             logger.info(f"Deleted scan record: {scan_id}")
             return True
         except Exception as e:
@@ -0,0 +1,313 @@
+"""
+Simulated Scanner - Driver producing realistic pages without hardware
+
+Pages are rendered at the requested resolution and color mode with paper
+noise, text lines and a figure, so encoding costs and file sizes resemble
+real documents. They are delivered band by band at a configurable line
+rate, and paper jams and stalls can be injected at random or on demand to
+exercise error handling under load.
+"""
+
+import time
+import random
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any, Callable, Iterator, Tuple
+
+try:
+    from PIL import Image, ImageDraw
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+
+from capabilities import OUTPUT_FORMATS
+from drivers import ScanDriver, PaperJamError, DriverTimeoutError, DriverCancelledError
+from pnm_stream import BAND_ROWS
+
+logger = logging.getLogger(__name__)
+
+# US Letter, in mm
+PAGE_SIZE_MM = (215.9, 279.4)
+
+SIMULATED_CAPABILITIES = {
+    "formats": OUTPUT_FORMATS,
+    "resolutions": [75, 150, 200, 300, 400, 600, 1200],
+    "color_modes": ["bw", "gray", "color"],
+    "sources": ["flatbed", "adf", "adf_duplex"],
+    "duplex": True,
+    "bit_depths": [1, 8],
+    "page_size": {"width": PAGE_SIZE_MM[0], "height": PAGE_SIZE_MM[1], "unit": "mm"}
+}
+
+FAULTS = ("jam", "timeout")
+
+
+def _row_bytes(page: "Image.Image") -> int:
+    """Size of one row of a page as a device delivers it"""
+    width = page.size[0]
+    if page.mode == '1':
+        return (width + 7) // 8
+    return width * len(page.getbands())
+
+
+def render_page(width: int, height: int, dpi: int, color_mode: str, seed: int) -> "Image.Image":
+    """Render a document-like page: noisy paper, lines of words and a figure"""
+    rng = random.Random(seed)
+
+    # Off-white paper with sensor noise
+    paper_lut = [min(255, max(0, 236 + (v - 128) // 6)) for v in range(256)]
+    paper = Image.effect_noise((width, height), 24).point(paper_lut)
+    if color_mode == 'color':
+        warm_lut = [max(0, v - 6) for v in range(256)]
+        page = Image.merge('RGB', (paper, paper, paper.point(warm_lut)))
+        ink = (28, 30, 44)
+    else:
+        page = paper
+        ink = 30
+    draw = ImageDraw.Draw(page)
+
+    margin = dpi
+    line_height = max(dpi // 6, 2)
+    x_height = max(dpi // 12, 1)
+    figure_top = height // 3 if seed % 2 else None
+    figure_bottom = figure_top + height // 4 if figure_top else None
+
+    # Lines of words, with paragraph breaks
+    y = margin
+    while y + line_height < height - margin:
+        if figure_top and figure_top <= y < figure_bottom:
+            y = figure_bottom + line_height
+            continue
+        if rng.random() < 0.08:
+            y += line_height
+            continue
+        x = margin
+        line_end = width - margin - (rng.randint(0, width // 3) if rng.random() < 0.15 else 0)
+        while x < line_end:
+            word = rng.randint(dpi // 10, dpi // 2)
+            draw.rectangle([x, y, min(x + word, line_end), y + x_height], fill=ink)
+            x += word + max(dpi // 16, 1)
+        y += line_height
+
+    # A photo-like figure made of gradients
+    if figure_top:
+        box = (margin, figure_top, width - margin, figure_bottom)
+        size = (box[2] - box[0], box[3] - box[1])
+        if size[0] > 0 and size[1] > 0:
+            linear = Image.linear_gradient('L').resize(size)
+            radial = Image.radial_gradient('L').resize(size)
+            if color_mode == 'color':
+                figure = Image.merge('RGB', (linear, radial, linear.transpose(Image.Transpose.ROTATE_180)))
+            else:
+                figure = Image.blend(linear, radial, 0.5)
+            page.paste(figure, box[:2])
+
+    if color_mode == 'bw':
+        return page.point(lambda v: 255 if v > 128 else 0).convert('1', dither=Image.Dither.NONE)
+    return page
+
+
+class SimulatedScannerDriver(ScanDriver):
+    """Simulated flatbed scanners with a duplex document feeder"""
+
+    platform = "simulated"
+    driver_type = "Simulated"
+
+    def __init__(
+        self,
+        devices: int = 1,
+        line_rate: float = 0,
+        warmup_seconds: float = 0,
+        feeder_pages: int = 5,
+        jam_rate: float = 0,
+        timeout_rate: float = 0,
+        timeout: float = 30,
+        seed: Optional[int] = None,
+        page_cache_size: int = 64 * 1024 * 1024
+    ):
+        """Initialize simulated driver
+
+        line_rate is the number of scan lines delivered per second (0 for
+        as fast as possible). jam_rate and timeout_rate are per-page
+        probabilities of a paper jam or of the device stalling for timeout
+        seconds. Rendered pages are cached by size, mode and layout, up to
+        page_cache_size bytes, so load tests measure the pipeline rather
+        than the renderer.
+        """
+        if not HAS_PIL:
+            raise ImportError("PIL not available")
+        self.device_count = devices
+        self.line_rate = line_rate
+        self.warmup_seconds = warmup_seconds
+        self.feeder_pages = feeder_pages
+        self.jam_rate = jam_rate
+        self.timeout_rate = timeout_rate
+        self.timeout = timeout
+        self.page_cache_size = page_cache_size
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._cancel_events: Dict[str, threading.Event] = {}
+        self._faults: Dict[str, List[str]] = {}
+        self._pages: "OrderedDict[Tuple[int, int, int, str, int], Image.Image]" = OrderedDict()
+        self._page_bytes = 0
+        self.pages_scanned = 0
+
+    def discover(self) -> List[Dict[str, Any]]:
+        """List the simulated devices"""
+        return [
+            {
+                "id": f"sim:{index}",
+                "name": f"Simulated Scanner {index}",
+                "manufacturer": "Simulated",
+                "model": "Duplex Document Scanner",
+                "capabilities": self.capabilities(f"sim:{index}")
+            }
+            for index in range(self.device_count)
+        ]
+
+    def capabilities(self, device_id: str) -> Dict[str, Any]:
+        """Every simulated device has the same capabilities"""
+        return dict(SIMULATED_CAPABILITIES)
+
+    def inject_fault(self, device_id: str, fault: str):
+        """Make the next page scanned on a device fail with a jam or timeout"""
+        if fault not in FAULTS:
+            raise ValueError(f"Unknown fault: {fault}")
+        with self._lock:
+            self._faults.setdefault(device_id, []).append(fault)
+
+    def cancel(self, device_id: str):
+        """Stop the scan running on a device"""
+        with self._lock:
+            event = self._cancel_events.get(device_id)
+        if event:
+            event.set()
+
+    def _next_fault(self, device_id: str) -> Optional[str]:
+        """Pick the fault for the next page, if any"""
+        with self._lock:
+            queued = self._faults.get(device_id)
+            if queued:
+                return queued.pop(0)
+            roll = self._rng.random()
+        if roll < self.jam_rate:
+            return "jam"
+        if roll < self.jam_rate + self.timeout_rate:
+            return "timeout"
+        return None
+
+    def _page(self, width: int, height: int, dpi: int, color_mode: str, layout: int) -> "Image.Image":
+        """Get a fresh copy of a rendered page"""
+        key = (width, height, dpi, color_mode, layout)
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+        if page is None:
+            page = render_page(width, height, dpi, color_mode, layout)
+            size = _row_bytes(page) * height
+            with self._lock:
+                if size <= self.page_cache_size and key not in self._pages:
+                    self._pages[key] = page
+                    self._page_bytes += size
+                    while self._page_bytes > self.page_cache_size:
+                        _, evicted = self._pages.popitem(last=False)
+                        self._page_bytes -= _row_bytes(evicted) * evicted.size[1]
+        # A real device hands over a new buffer for every page
+        return page.copy()
+
+    def _deliver(
+        self,
+        device_id: str,
+        page: "Image.Image",
+        fault: Optional[str],
+        cancel_event: threading.Event,
+        on_data: Optional[Callable[[int, int], None]]
+    ):
+        """Pace a page out band by band at the line rate, injecting its fault"""
+        height = page.size[1]
+        row_bytes = _row_bytes(page)
+        fault_line = self._rng.randint(height // 4, max(height * 3 // 4, 1)) if fault else None
+
+        started = time.monotonic()
+        row = 0
+        while row < height:
+            if cancel_event.is_set():
+                raise DriverCancelledError(f"Scan cancelled on {device_id}")
+            if fault_line is not None and row >= fault_line:
+                if fault == "jam":
+                    raise PaperJamError(f"Paper jam on {device_id} at line {row} of {height}")
+                logger.debug(f"Simulated stall on {device_id} at line {row}")
+                if cancel_event.wait(self.timeout):
+                    raise DriverCancelledError(f"Scan cancelled on {device_id}")
+                raise DriverTimeoutError(f"Timed out waiting for data from {device_id} after {self.timeout}s")
+
+            row = min(row + BAND_ROWS, height)
+            if self.line_rate > 0:
+                delay = started + row / self.line_rate - time.monotonic()
+                if delay > 0 and cancel_event.wait(delay):
+                    raise DriverCancelledError(f"Scan cancelled on {device_id}")
+            if on_data:
+                on_data(row * row_bytes, height * row_bytes)
+
+    def scan_stream(
+        self,
+        device_id: str,
+        params: Dict[str, Any],
+        on_data: Optional[Callable[[int, int], None]] = None
+    ) -> Iterator["Image.Image"]:
+        """Scan pages at the requested resolution and color mode
+
+        The scan is registered for cancel() before this returns, so a cancel
+        arriving before the first page is requested is not lost.
+        """
+        dpi = int(params.get('resolution', 300))
+        color_mode = params.get('color_mode', 'color')
+        source = (params.get('source') or ('adf' if params.get('batch') else 'flatbed')).lower()
+        width = max(1, round(PAGE_SIZE_MM[0] / 25.4 * dpi))
+        height = max(1, round(PAGE_SIZE_MM[1] / 25.4 * dpi))
+
+        if not params.get('batch'):
+            pages = 1
+        elif source == 'adf_duplex':
+            pages = self.feeder_pages * 2
+        else:
+            pages = self.feeder_pages
+
+        cancel_event = threading.Event()
+        with self._lock:
+            self._cancel_events[device_id] = cancel_event
+        return self._stream(device_id, width, height, dpi, color_mode, pages, cancel_event, on_data)
+
+    def _stream(
+        self,
+        device_id: str,
+        width: int,
+        height: int,
+        dpi: int,
+        color_mode: str,
+        pages: int,
+        cancel_event: threading.Event,
+        on_data: Optional[Callable[[int, int], None]]
+    ) -> Iterator["Image.Image"]:
+        """Deliver the pages of a registered scan"""
+        try:
+            if self.warmup_seconds and cancel_event.wait(self.warmup_seconds):
+                raise DriverCancelledError(f"Scan cancelled on {device_id}")
+            for number in range(pages):
+                page = self._page(width, height, dpi, color_mode, number % 4)
+                self._deliver(device_id, page, self._next_fault(device_id), cancel_event, on_data)
+                with self._lock:
+                    self.pages_scanned += 1
+                yield page
+        finally:
+            with self._lock:
+                if self._cancel_events.get(device_id) is cancel_event:
+                    del self._cancel_events[device_id]
+
+    def close(self):
+        """Drop cached pages"""
+        with self._lock:
+            self._pages.clear()
+            self._page_bytes = 0
@@ -0,0 +1,90 @@
+"""
+Sync Log - Sequence-numbered changes to scan history and the scanner list
+
+Every change gets the next sequence number and is kept in a bounded log
+of recent changes:
+
+    {"seq": 42, "entity": "scan", "id": "scan_...", "op": "upsert", "data": {...}}
+    {"seq": 43, "entity": "scanner", "id": "sane:...", "op": "delete", "data": null}
+
+A client that remembers the last sequence number it applied catches up
+with only the changes after it, instead of reloading history and the
+scanner list. The log lives in the coordination store, so all workers
+number their changes in one sequence and a client can sync with any of
+them. Sequence numbers belong to one log, identified by its epoch; a
+client from another epoch (a server restarted with a local store) or one
+that fell behind the log needs a full snapshot.
+"""
+
+import logging
+import threading
+from typing import Dict, List, Optional, Any, Callable, Tuple
+
+logger = logging.getLogger(__name__)
+
+SYNC_ENTITIES = ('scan', 'scanner')
+
+
+class SyncLog:
+    """Recent history and scanner list changes, kept in a coordination store"""
+
+    def __init__(self, store, capacity: int = 1000):
+        """Initialize sync log on a coordination store's change log"""
+        self.store = store
+        self.capacity = max(1, capacity)
+        self.epoch = store.sync_epoch()
+        self._lock = threading.Lock()
+        # Called with each change after it is recorded, in this process's seq order
+        self.on_change: Optional[Callable[[Dict[str, Any]], None]] = None
+
+    @property
+    def seq(self) -> int:
+        """Sequence number of the latest change, from any worker"""
+        return self.store.changes_after(None)[1]
+
+    def record(self, entity: str, entity_id: str, data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Record an upsert of data, or a delete when data is None"""
+        if entity not in SYNC_ENTITIES:
+            raise ValueError(f"Unknown sync entity: {entity}")
+        change = {
+            'entity': entity,
+            'id': entity_id,
+            'op': 'delete' if data is None else 'upsert',
+            'data': data
+        }
+        # Emitting with the lock held keeps this process's pushes in seq order
+        with self._lock:
+            change = {'seq': self.store.append_change(change, self.capacity), **change}
+            if self.on_change:
+                try:
+                    self.on_change(change)
+                except Exception as e:
+                    logger.error(f"Error in sync change callback: {str(e)}")
+        return change
+
+    def changes_since(self, since: int, epoch: Optional[str] = None) -> Tuple[int, Optional[List[Dict[str, Any]]]]:
+        """Get (current seq, changes after since)
+
+        Only the latest change per scan or scanner is returned. Changes are
+        None when the client needs a snapshot instead: its epoch differs,
+        or changes after since have already left the log.
+        """
+        oldest, seq, changes = self.store.changes_after(since)
+        if epoch != self.epoch or since > seq or since < oldest - 1:
+            return seq, None
+        latest: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for change in changes:
+            key = (change['entity'], change['id'])
+            latest.pop(key, None)
+            latest[key] = change
+        return seq, list(latest.values())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get epoch, sequence number and log usage"""
+        oldest, seq, _ = self.store.changes_after(None)
+        return {
+            "epoch": self.epoch,
+            "seq": seq,
+            "buffered": seq - oldest + 1,
+            "capacity": self.capacity
+        }
@@ -0,0 +1,27 @@
+import json
+
+from benchmarks.run import main
+from benchmarks.suites import SUITES
+
+
+def test_quick_run_covers_every_suite(tmp_path):
+    output = tmp_path / 'latest.json'
+    status = main([
+        '--quick', '--repeat', '1', '--allow-missing-baseline',
+        '--output', str(output), '--baseline', str(tmp_path / 'baseline.json')
+    ])
+    assert status == 0
+    with open(output) as f:
+        document = json.load(f)
+    assert document['quick']
+    assert {name.split('.')[0] for name in document['results']} == set(SUITES)
+    for result in document['results'].values():
+        assert len(result['samples']) == 1 and result['samples'][0] > 0
+
+
+def test_missing_baseline_fails_without_flag(tmp_path):
+    status = main([
+        '--quick', '--repeat', '1', '-s', 'history',
+        '--output', str(tmp_path / 'latest.json'), '--baseline', str(tmp_path / 'baseline.json')
+    ])
+    assert status == 2
@@ -0,0 +1,68 @@
+from capabilities import parse_scanimage_options, validate_scan_params
+
+SCANIMAGE_OUTPUT = """
+All options specific to device `epson2:libusb:001:004':
+  Scan Mode:
+    --mode Lineart|Gray|Color [Lineart]
+        Selects the scan mode (e.g., lineart, monochrome, or color).
+    --depth 8|16 [8]
+        Number of bits per sample, typical values are 1 for "line-art" and 8
+        for multibit scans.
+    --resolution 50..1200dpi (in steps of 25) [300]
+        Sets the resolution of the scanned image.
+  Geometry:
+    -l 0..215.9mm [0]
+        Top-left x position of scan area.
+    -t 0..297.18mm [0]
+        Top-left y position of scan area.
+    -x 0..215.9mm [215.9]
+        Width of scan-area.
+    -y 0..297.18mm [297.18]
+        Height of scan-area.
+  Optional equipment:
+    --source Flatbed|Automatic Document Feeder [Flatbed]
+        Selects the scan source (such as a document-feeder).
+    --adf-mode Simplex|Duplex [inactive]
+        Selects the ADF mode (simplex/duplex)
+"""
+
+
+def test_parse_scanimage_options():
+    capabilities = parse_scanimage_options(SCANIMAGE_OUTPUT)
+    assert capabilities['resolution_range'] == {'min': 50, 'max': 1200, 'step': 25}
+    assert capabilities['resolutions'] == [75, 100, 150, 200, 300, 400, 600, 1200]
+    assert capabilities['color_modes'] == ['bw', 'gray', 'color']
+    assert capabilities['bit_depths'] == [8, 16]
+    assert capabilities['sources'] == ['flatbed', 'adf']
+    assert not capabilities['duplex']
+    assert capabilities['page_size'] == {'width': 215.9, 'height': 297.18, 'unit': 'mm'}
+    assert capabilities['sane_names']['modes']['bw'] == 'Lineart'
+
+
+def test_standard_resolutions_follow_the_step():
+    output = SCANIMAGE_OUTPUT.replace('50..1200dpi (in steps of 25)', '100..1200dpi (in steps of 100)')
+    assert parse_scanimage_options(output)['resolutions'] == [100, 200, 300, 400, 600, 1200]
+
+
+def test_validate_resolution_against_range_and_step():
+    capabilities = parse_scanimage_options(SCANIMAGE_OUTPUT)
+    assert validate_scan_params(capabilities, {'resolution': 325}) == []
+    assert validate_scan_params(capabilities, {'resolution': 50}) == []
+    assert validate_scan_params(capabilities, {'resolution': 310}) == [
+        "Resolution 310 not supported, use 50-1200 in steps of 25"
+    ]
+    assert validate_scan_params(capabilities, {'resolution': 1225}) == [
+        "Resolution 1225 outside supported range 50-1200"
+    ]
+    assert validate_scan_params(capabilities, {'resolution': 'high'}) == ["Invalid resolution: high"]
+
+
+def test_validate_other_params():
+    capabilities = parse_scanimage_options(SCANIMAGE_OUTPUT)
+    params = {'resolution': 300, 'color_mode': 'gray', 'format': 'PNG', 'source': 'adf'}
+    assert validate_scan_params(capabilities, params) == []
+    errors = validate_scan_params(capabilities, {'resolution': 300, 'color_mode': 'sepia', 'source': 'adf_duplex'})
+    assert errors == [
+        "Color mode sepia not supported, use one of bw, gray, color",
+        "Source adf_duplex not supported, use one of flatbed, adf"
+    ]
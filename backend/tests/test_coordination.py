@@ -0,0 +1,112 @@
+import json
+import uuid
+
+import pytest
+
+from coordination import LocalCoordinationStore, LocalPubSubManager, SQLiteCoordinationStore
+
+
+@pytest.fixture(params=['local', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'local':
+        store = LocalCoordinationStore()
+    else:
+        store = SQLiteCoordinationStore(str(tmp_path / 'coordination.sqlite3'))
+    yield store
+    store.close()
+
+
+def test_lease_is_exclusive_until_released(store):
+    assert store.claim_device('a', 'w1', {'id': 'a'}, ttl=30)
+    assert not store.claim_device('a', 'w2', {'id': 'a'}, ttl=30)
+    # The holder renews by claiming again
+    assert store.claim_device('a', 'w1', {'id': 'a', 'name': 'renamed'}, ttl=30)
+    assert store.device_owner('a') == 'w1'
+    assert store.list_devices() == [{'id': 'a', 'name': 'renamed', 'owner': 'w1'}]
+
+    store.release_devices('w1')
+    assert store.device_owner('a') is None
+    assert store.claim_device('a', 'w2', {'id': 'a'}, ttl=30)
+
+
+def test_expired_lease_can_be_taken_over(store):
+    assert store.claim_device('a', 'w1', {'id': 'a'}, ttl=-1)
+    assert store.device_owner('a') is None
+    assert store.list_devices() == [] and store.count_devices() == 0
+    assert store.claim_device('a', 'w2', {'id': 'a'}, ttl=30)
+    assert store.device_owner('a') == 'w2'
+
+
+def test_renew_leases_extends_every_lease_of_the_owner(store):
+    store.claim_device('a', 'w1', {'id': 'a'}, ttl=-1)
+    store.claim_device('b', 'w1', {'id': 'b'}, ttl=-1)
+    store.claim_device('c', 'w2', {'id': 'c'}, ttl=-1)
+    store.renew_leases('w1', ttl=30)
+    assert [store.device_owner(device_id) for device_id in 'abc'] == ['w1', 'w1', None]
+    assert store.count_devices() == 2
+
+
+def test_release_devices_keeps_listed(store):
+    for device_id in 'ab':
+        store.claim_device(device_id, 'w1', {'id': device_id}, ttl=30)
+    store.claim_device('c', 'w2', {'id': 'c'}, ttl=30)
+    store.release_devices('w1', keep=['b'])
+    assert [store.device_owner(device_id) for device_id in 'abc'] == [None, 'w1', 'w2']
+
+
+def test_command_inbox_is_per_owner_and_drained_in_order(store):
+    store.send_command('w1', {'action': 'scan', 'n': 1})
+    store.send_command('w2', {'action': 'cancel'})
+    store.send_command('w1', {'action': 'scan', 'n': 2})
+    assert store.take_commands('w1') == [{'action': 'scan', 'n': 1}, {'action': 'scan', 'n': 2}]
+    assert store.take_commands('w1') == []
+    assert store.take_commands('w2') == [{'action': 'cancel'}]
+
+
+def test_append_change_keeps_the_newest(store):
+    assert store.changes_after(None) == (1, 0, [])
+    seqs = [store.append_change({'entity': 'job', 'id': str(n)}, keep=3) for n in range(1, 6)]
+    assert seqs == [1, 2, 3, 4, 5]
+    assert store.changes_after(None) == (3, 5, [])
+    oldest, latest, changes = store.changes_after(0)
+    assert (oldest, latest) == (3, 5)
+    assert [(change['seq'], change['id']) for change in changes] == [(3, '3'), (4, '4'), (5, '5')]
+    assert [change['seq'] for change in store.changes_after(4)[2]] == [5]
+    assert store.changes_after(5)[2] == []
+
+
+def test_sync_epoch_is_stable(store):
+    assert store.sync_epoch() == store.sync_epoch()
+
+
+def test_sqlite_store_is_shared_between_workers(tmp_path):
+    path = str(tmp_path / 'coordination.sqlite3')
+    first, second = SQLiteCoordinationStore(path), SQLiteCoordinationStore(path)
+    try:
+        assert first.claim_device('a', 'w1', {'id': 'a'}, ttl=30)
+        assert not second.claim_device('a', 'w2', {'id': 'a'}, ttl=30)
+        second.send_command('w1', {'action': 'scan'})
+        assert first.take_commands('w1') == [{'action': 'scan'}]
+
+        assert first.sync_epoch() == second.sync_epoch()
+        first.append_change({'entity': 'job', 'id': '1'}, keep=10)
+        assert second.append_change({'entity': 'job', 'id': '2'}, keep=10) == 2
+        assert [change['id'] for change in first.changes_after(0)[2]] == ['1', '2']
+    finally:
+        first.close()
+        second.close()
+
+
+def test_local_pubsub_delivers_to_every_subscriber_on_the_channel():
+    channel = f"test-{uuid.uuid4().hex}"
+    first, second = LocalPubSubManager(channel=channel), LocalPubSubManager(channel=channel)
+    other = LocalPubSubManager(channel=f"{channel}-other")
+    message = {'method': 'emit', 'event': 'scan_progress', 'data': [{'progress': 50}]}
+
+    first._publish(message)
+    # Every manager on the channel, the publisher included, gets a serialized copy
+    for manager in (first, second):
+        received = next(manager._listen())
+        assert isinstance(received, str)
+        assert json.loads(received) == message
+    assert other._queue.empty()
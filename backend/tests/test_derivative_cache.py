@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+
+import pytest
+
+from derivative_cache import DerivativeCache
+
+
+def _source(tmp_path, name='page.jpeg'):
+    path = tmp_path / name
+    path.write_bytes(b'source')
+    return str(path)
+
+
+def _producer(data, calls=None, gate=None):
+    def produce(output_path):
+        if calls is not None:
+            calls.append(output_path)
+        if gate is not None:
+            gate.wait(5)
+        with open(output_path, 'wb') as f:
+            f.write(data)
+    return produce
+
+
+def test_concurrent_requests_share_one_build(tmp_path):
+    cache = DerivativeCache(str(tmp_path / 'cache'))
+    source = _source(tmp_path)
+    calls = []
+    gate = threading.Event()
+    results = []
+
+    def request():
+        with cache.get_or_create(source, 'convert', {'format': 'png'}, 'png', _producer(b'png', calls, gate)) as f:
+            results.append(f.read())
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    while not calls:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert results == [b'png'] * 8
+    stats = cache.get_stats()
+    assert (stats['misses'], stats['hits']) == (1, 7)
+
+
+def test_failed_build_leaves_no_files(tmp_path):
+    cache = DerivativeCache(str(tmp_path / 'cache'))
+    source = _source(tmp_path)
+
+    def fail(output_path):
+        with open(output_path, 'wb') as f:
+            f.write(b'partial')
+        raise ValueError('broken')
+
+    with pytest.raises(ValueError):
+        cache.get_or_create(source, 'convert', {}, 'png', fail)
+    assert os.listdir(tmp_path / 'cache') == []
+
+
+def test_lru_eviction_keeps_recently_used(tmp_path):
+    cache = DerivativeCache(str(tmp_path / 'cache'), max_bytes=25)
+    source = _source(tmp_path)
+    build = lambda angle: cache.get_or_create(source, 'rotate', {'angle': angle}, 'jpg', _producer(b'x' * 10))
+
+    build(90).close()
+    build(180).close()
+    # Touch 90 so 180 is the least recently used when 270 pushes the cache over budget
+    build(90).close()
+    build(270).close()
+
+    stats = cache.get_stats()
+    assert stats['evictions'] == 1
+    assert stats['entries'] == 2 and stats['total_bytes'] == 20
+    names = set(os.listdir(tmp_path / 'cache'))
+    assert f"{cache.make_key(source, 'rotate', {'angle': 180})}.jpg" not in names
+    assert f"{cache.make_key(source, 'rotate', {'angle': 90})}.jpg" in names
+
+
+def test_handle_survives_eviction(tmp_path):
+    cache = DerivativeCache(str(tmp_path / 'cache'), max_bytes=10)
+    source = _source(tmp_path)
+    with cache.get_or_create(source, 'rotate', {'angle': 90}, 'jpg', _producer(b'a' * 10)) as served:
+        # Another request pushes the file being served out of the cache
+        cache.get_or_create(source, 'rotate', {'angle': 180}, 'jpg', _producer(b'b' * 10)).close()
+        assert not os.path.exists(served.name)
+        assert served.read() == b'a' * 10
+
+
+def test_evicted_file_is_rebuilt(tmp_path):
+    cache = DerivativeCache(str(tmp_path / 'cache'))
+    source = _source(tmp_path)
+    calls = []
+    produce = _producer(b'png', calls)
+    cache.get_or_create(source, 'convert', {}, 'png', produce).close()
+    # Deleted by another worker's eviction
+    for name in os.listdir(tmp_path / 'cache'):
+        os.unlink(tmp_path / 'cache' / name)
+    with cache.get_or_create(source, 'convert', {}, 'png', produce) as f:
+        assert f.read() == b'png'
+    assert len(calls) == 2
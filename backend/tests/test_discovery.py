@@ -0,0 +1,57 @@
+import threading
+
+from discovery import DiscoveryService
+
+
+class FakeScannerManager:
+    """Holds each discovery pass until it is released"""
+
+    def __init__(self):
+        self.passes = 0
+        self.entered = threading.Semaphore(0)
+        self.release = threading.Semaphore(0)
+
+    def refresh_scanner_list(self):
+        self.passes += 1
+        self.entered.release()
+        self.release.acquire(timeout=5)
+        return {"added": [], "removed": [], "updated": []}
+
+
+def test_wait_idle_ignores_pass_already_running():
+    manager = FakeScannerManager()
+    discovery = DiscoveryService(manager, interval=0)
+    discovery.start(immediate=True)
+    try:
+        assert manager.entered.acquire(timeout=5)
+        generation = discovery.trigger()
+        # The pass that was running when trigger() was called finishes first
+        manager.release.release()
+        assert not discovery.wait_idle(0.2, generation)
+
+        assert manager.entered.acquire(timeout=5)
+        manager.release.release()
+        assert discovery.wait_idle(5, generation)
+        assert manager.passes == 2
+    finally:
+        manager.release.release()
+        discovery.stop(timeout=5)
+
+
+def test_triggers_during_a_pass_share_the_next_one():
+    manager = FakeScannerManager()
+    discovery = DiscoveryService(manager, interval=0)
+    discovery.start(immediate=False)
+    try:
+        first = discovery.trigger()
+        assert manager.entered.acquire(timeout=5)
+        second = discovery.trigger()
+        third = discovery.trigger()
+        manager.release.release()
+        assert discovery.wait_idle(5, first)
+        assert manager.entered.acquire(timeout=5)
+        manager.release.release()
+        assert discovery.wait_idle(5, second) and discovery.wait_idle(5, third)
+        assert manager.passes == 2
+    finally:
+        discovery.stop(timeout=5)
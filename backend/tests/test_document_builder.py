@@ -0,0 +1,106 @@
+import io
+import re
+import zlib
+
+from PIL import Image, ImageDraw
+
+from document_builder import encode_page, stream_document
+
+
+def _page(path, mode, size=(120, 90), **save_kwargs):
+    image = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(image)
+    for y in range(10, size[1] - 10, 12):
+        draw.line((8, y, size[0] - 8, y + 3), fill=(20, 40, 200), width=3)
+    image.convert(mode).save(path, **save_kwargs)
+    return str(path)
+
+
+def _build(paths, target_format):
+    pages = [encode_page(path, target_format, 300) for path in paths]
+    return b''.join(stream_document(iter(pages), len(pages), target_format))
+
+
+def _pdf_objects(data):
+    """Map object number -> offset from the xref table"""
+    start = int(re.search(rb'startxref\n(\d+)\n%%EOF\n$', data).group(1))
+    lines = data[start:].split(b'\n')
+    assert lines[0] == b'xref'
+    count = int(lines[1].split()[1])
+    return {number: int(lines[2 + number][:10]) for number in range(1, count)}
+
+
+def _pdf_image(data, offsets, number):
+    """Read the image XObject with the given object number"""
+    start = data.index(b'stream\n', offsets[number]) + len(b'stream\n')
+    header = data[offsets[number]:start].decode('latin1')
+    length = int(re.search(r'/Length (\d+)', header).group(1))
+    assert data[start + length:].startswith(b'\nendstream\nendobj\n')
+    return header, data[start:start + length]
+
+
+def test_pdf_xref_offsets_point_at_objects(tmp_path):
+    paths = [
+        _page(tmp_path / 'a.jpeg', 'RGB', quality=85),
+        _page(tmp_path / 'b.png', 'L'),
+        _page(tmp_path / 'c.png', '1', size=(121, 91))
+    ]
+    data = _build(paths, 'pdf')
+    offsets = _pdf_objects(data)
+    assert len(offsets) == 3 * len(paths) + 2
+    for number, offset in offsets.items():
+        assert data[offset:].startswith(f"{number} 0 obj\n".encode())
+
+
+def test_pdf_passes_jpeg_through_and_deflates_the_rest(tmp_path):
+    jpeg = _page(tmp_path / 'a.jpeg', 'RGB', quality=85)
+    png = _page(tmp_path / 'b.png', 'RGB')
+    data = _build([jpeg, png], 'pdf')
+    offsets = _pdf_objects(data)
+
+    header, stream = _pdf_image(data, offsets, 4)
+    assert '/DCTDecode' in header
+    with open(jpeg, 'rb') as f:
+        assert stream == f.read()
+
+    header, stream = _pdf_image(data, offsets, 7)
+    assert '/FlateDecode' in header and '/DeviceRGB' in header
+    assert Image.frombytes('RGB', (120, 90), zlib.decompress(stream)).tobytes() == Image.open(png).tobytes()
+
+
+def test_pdf_one_bit_page(tmp_path):
+    path = _page(tmp_path / 'bw.png', '1', size=(121, 91))
+    data = _build([path], 'pdf')
+    header, stream = _pdf_image(data, _pdf_objects(data), 4)
+    assert '/BitsPerComponent 1' in header
+    assert Image.frombytes('1', (121, 91), zlib.decompress(stream)).tobytes() == Image.open(path).tobytes()
+
+
+def test_sixteen_bit_page_is_scaled_to_eight_bits(tmp_path):
+    image = Image.new('I;16', (4, 1))
+    image.putdata([0, 1000, 30000, 65535])
+    path = tmp_path / 'deep.png'
+    image.save(path)
+    page = encode_page(str(path), 'pdf')
+    assert page.mode == 'L'
+    assert list(zlib.decompress(page.data)) == [0, 3, 117, 255]
+
+
+def test_tiff_round_trip(tmp_path):
+    paths = [
+        _page(tmp_path / 'a.jpeg', 'RGB', quality=90, dpi=(150, 150)),
+        _page(tmp_path / 'b.png', 'L'),
+        _page(tmp_path / 'c.png', '1', size=(121, 91)),
+        _page(tmp_path / 'd.png', 'RGB')
+    ]
+    document = Image.open(io.BytesIO(_build(paths, 'tiff')))
+    assert document.n_frames == len(paths)
+    for index, path in enumerate(paths):
+        document.seek(index)
+        source = Image.open(path)
+        assert document.size == source.size
+        assert document.mode == source.mode
+        if source.format == 'PNG':
+            assert document.tobytes() == source.tobytes()
+        else:
+            assert document.info['compression'] == 'jpeg'
@@ -0,0 +1,97 @@
+from event_bus import BATCH_EVENT, EventBus
+
+
+class FakeSocketIO:
+    """Records emitted frames"""
+
+    def __init__(self):
+        self.frames = []
+
+    def emit(self, event, data, to=None):
+        self.frames.append((event, data, tuple(to)))
+
+
+def _events(frames):
+    """Unpack batches into (event, data) in arrival order"""
+    events = []
+    for event, data, _ in frames:
+        if event == BATCH_EVENT:
+            events.extend((item['event'], item['data']) for item in data['events'])
+        else:
+            events.append((event, data))
+    return events
+
+
+def _bus(max_batch_size=100):
+    socketio = FakeSocketIO()
+    # A long interval so only explicit flushes send
+    return socketio, EventBus(socketio, flush_interval=60, max_batch_size=max_batch_size)
+
+
+def test_superseding_event_moves_behind_events_published_since():
+    socketio, bus = _bus()
+    rooms = ['scan:s1']
+    bus.publish('scan_job_updated', {'status': 'scanning'}, rooms, key='j1')
+    bus.publish('scan_started', {'scan_id': 's1'}, rooms)
+    bus.publish('scan_progress', {'progress': 50}, rooms, key='s1')
+    bus.publish('scan_completed', {'scan_id': 's1'}, rooms)
+    bus.publish('scan_job_updated', {'status': 'completed'}, rooms, key='j1')
+    bus.flush()
+    assert _events(socketio.frames) == [
+        ('scan_started', {'scan_id': 's1'}),
+        ('scan_progress', {'progress': 50}),
+        ('scan_completed', {'scan_id': 's1'}),
+        ('scan_job_updated', {'status': 'completed'})
+    ]
+    assert len(socketio.frames) == 1
+    bus.stop()
+
+
+def test_superseding_full_list_goes_after_queued_delta():
+    socketio, bus = _bus()
+    rooms = ['scanners']
+    bus.publish('scanners_updated', {'scanners': ['a']}, rooms, key='full')
+    bus.publish('scanners_updated', {'added': ['b']}, rooms, key='delta')
+    bus.publish('scanners_updated', {'scanners': ['a', 'b']}, rooms, key='full')
+    bus.flush()
+    assert _events(socketio.frames) == [
+        ('scanners_updated', {'added': ['b']}),
+        ('scanners_updated', {'scanners': ['a', 'b']})
+    ]
+    bus.stop()
+
+
+def test_coalesced_events_are_merged():
+    socketio, bus = _bus()
+    merge = lambda old, new: {'ids': old['ids'] + new['ids']}
+    for ids in (['a'], ['b']):
+        bus.publish('scanners_updated', {'ids': ids}, ['scanners'], key='delta', merge=merge)
+    bus.flush()
+    assert _events(socketio.frames) == [('scanners_updated', {'ids': ['a', 'b']})]
+    bus.stop()
+
+
+def test_keys_coalesce_per_target():
+    socketio, bus = _bus()
+    bus.publish('scan_progress', {'progress': 10}, ['scan:s1'], key='s1')
+    bus.publish('scan_progress', {'progress': 10}, ['scanner:a'], key='s1')
+    bus.publish('scan_progress', {'progress': 20}, ['scan:s1'], key='s1')
+    bus.flush()
+    assert [(event, data, target) for event, data, target in socketio.frames] == [
+        ('scan_progress', {'progress': 10}, ('scanner:a',)),
+        ('scan_progress', {'progress': 20}, ('scan:s1',))
+    ]
+    bus.stop()
+
+
+def test_runs_are_split_by_target_and_batch_size():
+    socketio, bus = _bus(max_batch_size=2)
+    for n in range(3):
+        bus.publish('scan_completed', {'n': n}, ['a'])
+    bus.publish('scan_completed', {'n': 3}, ['b'])
+    bus.flush()
+    assert [(event, target) for event, _, target in socketio.frames] == [
+        (BATCH_EVENT, ('a',)), ('scan_completed', ('a',)), ('scan_completed', ('b',))
+    ]
+    assert [data['n'] for _, data in _events(socketio.frames)] == [0, 1, 2, 3]
+    bus.stop()
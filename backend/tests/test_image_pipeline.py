@@ -0,0 +1,126 @@
+import io
+import shutil
+
+import pytest
+from PIL import Image
+
+from image_pipeline import PipelineError, lossless_jpeg_transform, parse_pipeline
+from image_processor import _run_pipeline
+
+FORMATS = ['jpeg', 'jpg', 'png', 'tiff', 'bmp', 'gif']
+
+needs_jpegtran = pytest.mark.skipif(shutil.which('jpegtran') is None, reason="jpegtran is not installed")
+
+
+def _ops(*operations):
+    return parse_pipeline(list(operations), FORMATS)[0]
+
+
+def _jpeg(path, size=(64, 48), subsampling=2):
+    image = Image.new('RGB', size, 'white')
+    image.paste((200, 30, 30), (0, 0, size[0] // 2, size[1] // 2))
+    # subsampling 2 is 4:2:0, a 16x16 MCU
+    image.save(path, quality=90, subsampling=subsampling)
+    return str(path)
+
+
+def test_rotations_are_normalized():
+    assert _ops({'op': 'rotate', 'angle': 90}, {'op': 'rotate', 'angle': 180}) == [{'op': 'rotate', 'angle': 270}]
+    assert _ops({'op': 'rotate', 'angle': -90}) == [{'op': 'rotate', 'angle': 270}]
+    assert _ops({'op': 'rotate', 'angle': 450}) == [{'op': 'rotate', 'angle': 90}]
+    assert _ops({'op': 'rotate', 'angle': 1.5}) == [{'op': 'rotate', 'angle': 1.5}]
+
+
+def test_no_op_rotations_are_dropped():
+    assert _ops({'op': 'rotate', 'angle': 0}, {'op': 'grayscale'}) == [{'op': 'grayscale'}]
+    assert _ops({'op': 'rotate', 'angle': 360}, {'op': 'grayscale'}) == [{'op': 'grayscale'}]
+    assert _ops({'op': 'rotate', 'angle': 90}, {'op': 'rotate', 'angle': 270}, {'op': 'grayscale'}) == [
+        {'op': 'grayscale'}
+    ]
+
+
+def test_only_adjacent_quarter_turns_merge():
+    assert _ops({'op': 'rotate', 'angle': 10}, {'op': 'rotate', 'angle': 90}) == [
+        {'op': 'rotate', 'angle': 10}, {'op': 'rotate', 'angle': 90}
+    ]
+    crop = {'op': 'crop', 'left': 0, 'top': 0, 'right': 10, 'bottom': 10}
+    assert _ops({'op': 'rotate', 'angle': 90}, crop, {'op': 'rotate', 'angle': 90}) == [
+        {'op': 'rotate', 'angle': 90}, crop, {'op': 'rotate', 'angle': 90}
+    ]
+
+
+def test_format_must_be_last():
+    with pytest.raises(PipelineError, match="format must be the last operation"):
+        parse_pipeline([{'op': 'format', 'format': 'png'}, {'op': 'grayscale'}], FORMATS)
+    assert parse_pipeline([{'op': 'grayscale'}], FORMATS)[1:] == ('jpeg', None)
+    assert parse_pipeline([{'op': 'grayscale'}, {'op': 'format', 'format': '.JPG'}], FORMATS)[1] == 'jpeg'
+    with pytest.raises(PipelineError, match="Unsupported format: webp"):
+        parse_pipeline([{'op': 'format', 'format': 'webp'}], FORMATS)
+
+
+def test_quality_is_none_unless_given():
+    assert parse_pipeline([{'op': 'format', 'format': 'jpeg'}], FORMATS)[2] is None
+    assert parse_pipeline([{'op': 'format', 'format': 'jpeg', 'quality': 100}], FORMATS)[2] == 100
+    assert parse_pipeline([{'op': 'format', 'format': 'jpeg', 'quality': 1}], FORMATS)[2] == 1
+
+
+@pytest.mark.parametrize('quality', [0, 101, 85.5, True, '85'])
+def test_quality_bounds(quality):
+    with pytest.raises(PipelineError):
+        parse_pipeline([{'op': 'format', 'format': 'jpeg', 'quality': quality}], FORMATS)
+
+
+@pytest.mark.parametrize('operations', [
+    [],
+    {'op': 'rotate'},
+    [{'op': 'blur'}],
+    [{'op': 'rotate'}],
+    [{'op': 'crop', 'left': 10, 'top': 0, 'right': 10, 'bottom': 5}],
+    [{'op': 'resize'}],
+    [{'op': 'deskew', 'max_angle': 45}]
+])
+def test_invalid_pipelines(operations):
+    with pytest.raises(PipelineError):
+        parse_pipeline(operations, FORMATS)
+
+
+def test_lossless_needs_a_quarter_turn_jpeg_chain(tmp_path):
+    jpeg = _jpeg(tmp_path / 'page.jpeg')
+    assert lossless_jpeg_transform(jpeg, [{'op': 'rotate', 'angle': 45}]) is None
+    assert lossless_jpeg_transform(jpeg, [{'op': 'grayscale'}]) is None
+    png = tmp_path / 'page.png'
+    Image.open(jpeg).save(png)
+    assert lossless_jpeg_transform(str(png), []) is None
+    with open(jpeg, 'rb') as f:
+        assert lossless_jpeg_transform(jpeg, []) == f.read()
+
+
+def test_quality_forces_a_decode(tmp_path):
+    jpeg = _jpeg(tmp_path / 'page.jpeg')
+    output = tmp_path / 'out.jpeg'
+    assert _run_pipeline(jpeg, str(output), [], 'jpeg', 50) == 'decoded'
+    assert _run_pipeline(jpeg, str(output), [{'op': 'rotate', 'angle': 45}], 'jpeg', None) == 'decoded'
+
+
+@needs_jpegtran
+def test_lossless_crop_must_be_mcu_aligned(tmp_path):
+    jpeg = _jpeg(tmp_path / 'page.jpeg')
+    # 4:2:0 has a 16x16 MCU
+    assert lossless_jpeg_transform(jpeg, [{'op': 'crop', 'left': 8, 'top': 0, 'right': 40, 'bottom': 32}]) is None
+    data = lossless_jpeg_transform(jpeg, [{'op': 'crop', 'left': 16, 'top': 16, 'right': 48, 'bottom': 40}])
+    assert Image.open(io.BytesIO(data)).size == (32, 24)
+    # 4:4:4 has an 8x8 MCU
+    jpeg = _jpeg(tmp_path / 'full.jpeg', subsampling=0)
+    data = lossless_jpeg_transform(jpeg, [{'op': 'crop', 'left': 8, 'top': 8, 'right': 40, 'bottom': 32}])
+    assert Image.open(io.BytesIO(data)).size == (32, 24)
+
+
+@needs_jpegtran
+def test_lossless_rotation_swaps_the_mcu_grid(tmp_path):
+    # 4:2:2 has a 16x8 MCU, which becomes 8x16 after a quarter turn
+    jpeg = _jpeg(tmp_path / 'page.jpeg', subsampling=1)
+    crop = {'op': 'crop', 'left': 8, 'top': 16, 'right': 40, 'bottom': 48}
+    data = lossless_jpeg_transform(jpeg, [{'op': 'rotate', 'angle': 90}, crop])
+    assert Image.open(io.BytesIO(data)).size == (32, 32)
+    assert lossless_jpeg_transform(jpeg, [{'op': 'rotate', 'angle': 90}, dict(crop, left=8, top=8)]) is None
+    assert _run_pipeline(jpeg, str(tmp_path / 'out.jpeg'), [{'op': 'rotate', 'angle': 180}], 'jpeg', None) == 'lossless'
@@ -0,0 +1,187 @@
+import os
+import threading
+
+import pytest
+
+from libsane import FakeLibSane, InProcessSaneBackend, SaneError, STATUS_CANCELLED, STATUS_IO_ERROR, STATUS_INVAL
+
+SETTINGS = {'source': 'Flatbed', 'mode': 'Gray', 'resolution': 75}
+FEEDER = {'source': 'ADF', 'mode': 'Gray', 'resolution': 75}
+
+
+class ExclusiveLibSane(FakeLibSane):
+    """FakeLibSane that records calls made while another call is running"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.overlaps = 0
+        self._owner = None
+        self._depth = 0
+        self._guard = threading.Lock()
+
+    def __getattribute__(self, name):
+        attr = super().__getattribute__(name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def call(*args):
+            me = threading.get_ident()
+            with self._guard:
+                if self._depth and self._owner != me:
+                    self.overlaps += 1
+                self._owner = me
+                self._depth += 1
+            try:
+                return attr(*args)
+            finally:
+                with self._guard:
+                    self._depth -= 1
+        return call
+
+
+def test_scan_reuses_handle_and_options():
+    library = FakeLibSane()
+    backend = InProcessSaneBackend(library)
+    first = backend.scan('fake:0', SETTINGS)
+    second = backend.scan('fake:0', SETTINGS)
+    assert first.mode == second.mode == 'L'
+    assert first.size == second.size
+    assert library.calls['open'] == 1
+    assert library.calls['set_option'] == 3
+
+
+def test_scan_pages_reads_until_feeder_is_empty():
+    backend = InProcessSaneBackend(FakeLibSane(feeder_pages=3))
+    assert len(list(backend.scan_pages('fake:0', FEEDER))) == 3
+
+
+def test_close_idle_skips_device_mid_batch():
+    library = FakeLibSane(feeder_pages=2)
+    backend = InProcessSaneBackend(library, idle_timeout=0)
+    pages = backend.scan_pages('fake:0', FEEDER)
+    next(pages)
+    backend.close_idle()
+    assert library.calls.get('close', 0) == 0
+    assert len(list(pages)) == 1
+    backend.close_idle()
+    assert library.calls['close'] == 1
+
+
+def test_io_error_releases_device():
+    library = FakeLibSane()
+    backend = InProcessSaneBackend(library)
+
+    def broken_start(handle):
+        raise SaneError(STATUS_IO_ERROR)
+    library.start = broken_start
+    with pytest.raises(SaneError):
+        backend.scan('fake:0', SETTINGS)
+    assert library.calls['close'] == 1
+
+
+def test_rejected_option_raises_sane_error():
+    backend = InProcessSaneBackend(FakeLibSane())
+    with pytest.raises(SaneError) as error:
+        backend.scan('fake:0', dict(SETTINGS, resolution=123))
+    assert error.value.status == STATUS_INVAL
+
+
+def test_library_calls_are_serialized():
+    library = ExclusiveLibSane(feeder_pages=4)
+    backend = InProcessSaneBackend(library, idle_timeout=0)
+    done = threading.Event()
+
+    def poll():
+        while not done.is_set():
+            backend.list_devices()
+            backend.describe_options('fake:0')
+
+    poller = threading.Thread(target=poll)
+    poller.start()
+    try:
+        scans = [
+            threading.Thread(target=lambda: list(backend.scan_pages('fake:0', FEEDER))),
+            threading.Thread(target=lambda: backend.scan('fake:0', SETTINGS))
+        ]
+        for thread in scans:
+            thread.start()
+        for thread in scans:
+            thread.join()
+    finally:
+        done.set()
+        poller.join()
+    assert library.overlaps == 0
+    assert library.calls['get_devices'] > 0
+
+
+class SlowLibSane(FakeLibSane):
+    """FakeLibSane whose 'slow:0' device has no data until ready is set"""
+
+    def __init__(self):
+        super().__init__(devices=[
+            {'name': 'fast:0', 'vendor': 'Fake', 'model': 'Fast', 'type': 'flatbed scanner'},
+            {'name': 'slow:0', 'vendor': 'Fake', 'model': 'Slow', 'type': 'flatbed scanner'}
+        ])
+        self.names = {}
+        self.waiting = threading.Event()
+        self.ready = threading.Event()
+        self.read_fd, self.write_fd = os.pipe()
+
+    def open(self, name):
+        handle = super().open(name)
+        self.names[handle] = name
+        return handle
+
+    def get_select_fd(self, handle):
+        return self.read_fd if self.names[handle] == 'slow:0' else None
+
+    def read(self, handle, max_length):
+        if self.names[handle] == 'slow:0' and not self.ready.is_set():
+            self.waiting.set()
+            return None
+        return super().read(handle, max_length)
+
+    def close_pipe(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+
+def test_waiting_device_does_not_stall_others():
+    library = SlowLibSane()
+    backend = InProcessSaneBackend(library)
+    result = {}
+    slow = threading.Thread(target=lambda: result.setdefault('slow', backend.scan('slow:0', SETTINGS)))
+    slow.start()
+    try:
+        assert library.waiting.wait(5)
+        # Scans on another device proceed while the slow one waits for data
+        assert backend.scan('fast:0', SETTINGS).mode == 'L'
+        assert slow.is_alive()
+    finally:
+        library.ready.set()
+        os.write(library.write_fd, b'x')
+        slow.join(5)
+        library.close_pipe()
+    assert result['slow'].mode == 'L'
+    assert library.calls['set_io_mode'] == 2
+
+
+def test_waiting_scan_can_be_cancelled():
+    library = SlowLibSane()
+    backend = InProcessSaneBackend(library)
+    cancel = threading.Event()
+    errors = []
+
+    def scan():
+        try:
+            backend.scan('slow:0', SETTINGS, cancelled=cancel.is_set)
+        except SaneError as e:
+            errors.append(e.status)
+
+    thread = threading.Thread(target=scan)
+    thread.start()
+    assert library.waiting.wait(5)
+    cancel.set()
+    thread.join(5)
+    library.close_pipe()
+    assert errors == [STATUS_CANCELLED]
@@ -0,0 +1,80 @@
+import io
+import struct
+
+import pytest
+from PIL import Image
+
+from pnm_stream import PNMStreamError, decode_pnm_stream, read_pnm_header, scale_to_8bit
+
+
+def test_header_with_comments():
+    stream = io.BytesIO(b"P6\n# scanimage\n4 3\n# depth\n255\nrest")
+    header = read_pnm_header(stream)
+    assert (header.magic, header.width, header.height, header.maxval) == ('P6', 4, 3, 255)
+    assert header.row_bytes == 12
+    assert stream.read() == b"rest"
+
+
+def test_pbm_header_has_no_maxval():
+    header = read_pnm_header(io.BytesIO(b"P4\n9 2\n"))
+    assert header.mode == '1'
+    assert header.row_bytes == 2
+
+
+@pytest.mark.parametrize('data', [b"P3\n1 1\n255\n", b"P5\n0 1\n255\n", b"P5\nx 1\n255\n", b"P5\n1"])
+def test_invalid_headers(data):
+    with pytest.raises(PNMStreamError):
+        read_pnm_header(io.BytesIO(data))
+
+
+def test_decode_gray_in_bands():
+    width, height = 5, 300
+    rows = bytes(range(width)) * height
+    received = []
+    image = decode_pnm_stream(
+        io.BytesIO(b"P5\n5 300\n255\n" + rows),
+        on_data=lambda done, total: received.append((done, total))
+    )
+    assert image.mode == 'L' and image.size == (width, height)
+    assert image.tobytes() == rows
+    assert received[-1] == (len(rows), len(rows))
+    assert len(received) > 1
+
+
+def test_decode_pbm_inverts_bits():
+    image = decode_pnm_stream(io.BytesIO(b"P4\n8 1\n" + bytes([0b10000000])))
+    # PBM 1 is black
+    assert image.getpixel((0, 0)) == 0
+    assert image.getpixel((1, 0)) == 255
+
+
+def test_truncated_stream():
+    with pytest.raises(PNMStreamError, match="ended after 1 of 3 rows"):
+        decode_pnm_stream(io.BytesIO(b"P5\n4 3\n255\n" + b"\0" * 6))
+
+
+def test_sixteen_bit_gray():
+    samples = [0, 1000, 30000, 65535]
+    image = decode_pnm_stream(io.BytesIO(b"P5\n4 1\n65535\n" + struct.pack('>4H', *samples)))
+    assert image.mode == 'I;16'
+    assert [image.getpixel((x, 0)) for x in range(4)] == samples
+    assert list(scale_to_8bit(image).tobytes()) == [0, 3, 117, 255]
+
+
+def test_sixteen_bit_color_is_reduced_to_rgb():
+    image = decode_pnm_stream(io.BytesIO(b"P6\n1 1\n65535\n" + struct.pack('>3H', 65535, 32768, 0)))
+    assert image.mode == 'RGB'
+    assert image.getpixel((0, 0)) == (255, 128, 0)
+
+
+def test_sixteen_bit_scan_saves_as_jpeg(tmp_path):
+    from scanner_manager import ScannerManager
+
+    manager = ScannerManager(scan_dir=str(tmp_path / "scans"))
+    try:
+        image = decode_pnm_stream(io.BytesIO(b"P5\n4 1\n65535\n" + struct.pack('>4H', 0, 1000, 30000, 65535)))
+        path = tmp_path / "scans" / "page.jpeg"
+        manager._save_image(image, path, 'jpeg')
+        assert Image.open(path).mode == 'L'
+    finally:
+        manager.history.close()
@@ -0,0 +1,135 @@
+import threading
+
+from scan_queue import FairJobQueue, ScanJob, ScanJobQueue, JobPriority
+from scanner_manager import ScanStatus
+
+
+class FakeScannerManager:
+    """Records scans and holds each one until its scanner is released"""
+
+    def __init__(self, scanners=('a', 'b')):
+        self.scanners = set(scanners)
+        self.started = []
+        self.running = {scanner_id: 0 for scanner_id in scanners}
+        self.overlaps = 0
+        self.release = {scanner_id: threading.Event() for scanner_id in scanners}
+        self.entered = threading.Semaphore(0)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def has_scanner(self, scanner_id):
+        return scanner_id in self.scanners
+
+    def new_scan_id(self):
+        with self._lock:
+            self._count += 1
+            return f"scan_{self._count}"
+
+    def start_scan(self, scanner_id, params, scan_id=None, job=None):
+        with self._lock:
+            self.started.append(job.job_id)
+            self.running[scanner_id] += 1
+            if self.running[scanner_id] > 1:
+                self.overlaps += 1
+        self.entered.release()
+        self.release[scanner_id].wait(5)
+        with self._lock:
+            self.running[scanner_id] -= 1
+
+
+def _job(job_id, client_id='c1', priority=JobPriority.INTERACTIVE.value):
+    return ScanJob(job_id=job_id, scan_id=f"scan_{job_id}", scanner_id='a', params={},
+                   client_id=client_id, priority=priority)
+
+
+def test_fair_queue_round_robins_clients():
+    queue = FairJobQueue(maxsize=10)
+    for job_id, client_id in [('a1', 'alice'), ('a2', 'alice'), ('a3', 'alice'), ('b1', 'bob'), ('c1', 'carol')]:
+        queue.put(_job(job_id, client_id))
+    assert [queue.get().job_id for _ in range(5)] == ['a1', 'b1', 'c1', 'a2', 'a3']
+
+
+def test_fair_queue_serves_interactive_lane_first():
+    queue = FairJobQueue(maxsize=10)
+    queue.put(_job('bulk1', priority=JobPriority.BULK.value))
+    queue.put(_job('bulk2', priority=JobPriority.BULK.value))
+    queue.put(_job('now', client_id='c2'))
+    assert [queue.get().job_id for _ in range(3)] == ['now', 'bulk1', 'bulk2']
+
+
+def test_fair_queue_remove_and_close():
+    queue = FairJobQueue(maxsize=2)
+    first, second = _job('1'), _job('2')
+    queue.put(first)
+    queue.put(second)
+    assert queue.remove(first)
+    assert not queue.remove(first)
+    queue.close()
+    assert queue.get() is second
+    assert queue.get() is None
+
+
+def test_jobs_for_one_scanner_run_one_at_a_time():
+    manager = FakeScannerManager()
+    jobs = ScanJobQueue(manager)
+    first = jobs.submit('a', {})
+    second = jobs.submit('a', {})
+    other = jobs.submit('b', {})
+    # Both devices start; the second job for 'a' waits for the first
+    assert manager.entered.acquire(timeout=5) and manager.entered.acquire(timeout=5)
+    assert set(manager.started) == {first.job_id, other.job_id}
+    assert second.status == ScanStatus.QUEUED.value
+
+    manager.release['a'].set()
+    manager.release['b'].set()
+    assert manager.entered.acquire(timeout=5)
+    assert jobs.shutdown(timeout=5)
+    assert manager.started.index(second.job_id) > manager.started.index(first.job_id)
+    assert manager.overlaps == 0
+    assert [job.status for job in (first, second, other)] == [ScanStatus.COMPLETED.value] * 3
+
+
+def test_cancel_queued_job():
+    manager = FakeScannerManager()
+    jobs = ScanJobQueue(manager)
+    running = jobs.submit('a', {})
+    assert manager.entered.acquire(timeout=5)
+    queued = jobs.submit('a', {})
+    jobs.cancel(queued.job_id)
+    assert queued.status == ScanStatus.CANCELLED.value
+    manager.release['a'].set()
+    assert jobs.shutdown(timeout=5)
+    assert manager.started == [running.job_id]
+
+
+def test_job_cancelled_after_dequeue_is_marked_cancelled():
+    manager = FakeScannerManager()
+    jobs = ScanJobQueue(manager)
+    job_queue = FairJobQueue(maxsize=1)
+    job = _job('late')
+    job_queue.put(job)
+    # cancel() arrives once the worker has taken the job but before it runs
+    job.cancel_event.set()
+    job_queue.close()
+    jobs._worker_loop('a', job_queue)
+    assert job.status == ScanStatus.CANCELLED.value
+    assert manager.started == []
+
+
+def test_set_progress_is_throttled():
+    notified = []
+    job = _job('p')
+    job.progress_listener = lambda j: notified.append(j.progress)
+    job.min_progress_interval = 60
+    for progress in (10, 10, 20, 30, 100):
+        job.set_progress(progress)
+    assert notified == [10, 100]
+    assert job.progress == 100
+
+
+def test_set_progress_clamps():
+    job = _job('p')
+    job.set_progress(150)
+    assert job.progress == 100
+    job.set_progress(-5)
+    assert job.progress == 0
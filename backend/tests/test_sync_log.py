@@ -0,0 +1,89 @@
+import pytest
+
+from coordination import LocalCoordinationStore
+from sync_log import SyncLog
+from websocket_handler import merge_scanner_deltas
+
+
+def _log(capacity=10):
+    return SyncLog(LocalCoordinationStore(), capacity=capacity)
+
+
+def test_record_numbers_changes_and_notifies():
+    log = _log()
+    pushed = []
+    log.on_change = pushed.append
+    upsert = log.record('scan', 's1', {'status': 'completed'})
+    delete = log.record('scanner', 'd1')
+    assert (upsert['seq'], upsert['op']) == (1, 'upsert')
+    assert (delete['seq'], delete['op'], delete['data']) == (2, 'delete', None)
+    assert pushed == [upsert, delete]
+    assert log.seq == 2
+    with pytest.raises(ValueError):
+        log.record('job', 'j1', {})
+
+
+def test_changes_since_keeps_the_latest_change_per_entity():
+    log = _log()
+    log.record('scan', 's1', {'status': 'scanning'})
+    log.record('scanner', 'd1', {'name': 'A'})
+    log.record('scan', 's1', {'status': 'completed'})
+    log.record('scan', 's2', {'status': 'scanning'})
+    log.record('scanner', 'd1')
+
+    seq, changes = log.changes_since(0, log.epoch)
+    assert seq == 5
+    # Ordered by each entity's latest change
+    assert [(c['seq'], c['entity'], c['id'], c['op']) for c in changes] == [
+        (3, 'scan', 's1', 'upsert'),
+        (4, 'scan', 's2', 'upsert'),
+        (5, 'scanner', 'd1', 'delete')
+    ]
+    assert changes[0]['data'] == {'status': 'completed'}
+    assert log.changes_since(5, log.epoch) == (5, [])
+
+
+def test_changes_since_asks_for_a_snapshot():
+    log = _log(capacity=3)
+    for n in range(6):
+        log.record('scan', f"s{n}", {'n': n})
+    # seqs 4..6 are kept, so a client at 3 can still catch up
+    assert [c['seq'] for c in log.changes_since(3, log.epoch)[1]] == [4, 5, 6]
+    # Another epoch: a different log, e.g. before a restart
+    assert log.changes_since(3, 'other-epoch') == (6, None)
+    assert log.changes_since(3, None) == (6, None)
+    # Ahead of the log
+    assert log.changes_since(7, log.epoch) == (6, None)
+    # Fell behind: seq 3 has already been trimmed
+    assert log.changes_since(2, log.epoch) == (6, None)
+
+
+def test_stats_report_buffered_changes():
+    log = _log(capacity=3)
+    assert log.get_stats()['buffered'] == 0
+    for n in range(5):
+        log.record('scan', f"s{n}", {})
+    assert log.get_stats() == {'epoch': log.epoch, 'seq': 5, 'buffered': 3, 'capacity': 3}
+
+
+def _delta(added=(), changed=(), removed=(), **extra):
+    return dict(extra, added=[{'id': i, 'v': v} for i, v in added],
+                changed=[{'id': i, 'v': v} for i, v in changed], removed=list(removed))
+
+
+def test_merge_scanner_deltas():
+    older = _delta(added=[('a', 1), ('b', 1)], changed=[('c', 1)], removed=['d'], seq=1)
+    newer = _delta(added=[('d', 2)], changed=[('a', 2), ('c', 2)], removed=['b', 'e'], seq=2)
+    merged = merge_scanner_deltas(older, newer)
+    assert merged['seq'] == 2
+    # A change to a scanner added earlier stays an add, with the newer data
+    assert merged['added'] == [{'id': 'a', 'v': 2}, {'id': 'd', 'v': 2}]
+    assert merged['changed'] == [{'id': 'c', 'v': 2}]
+    # Re-added 'd' is no longer removed; 'b' stays removed in case the
+    # client knew it before an earlier merged remove and re-add
+    assert merged['removed'] == ['b', 'e']
+
+
+def test_merge_scanner_deltas_removed_after_change():
+    merged = merge_scanner_deltas(_delta(changed=[('a', 1)]), _delta(removed=['a']))
+    assert merged == _delta(removed=['a'])
@@ -1,109 +1,385 @@
 """
 WebSocket Handler - Manages real-time communication with clients
+
+Events go to subscription rooms rather than to every client, so the cost
+of an event scales with the clients interested in it. Clients subscribe
+to a scanner, a scan job, a single scan, their session (the client_id
+scans were submitted with), the scanner list or the scan history.
+
+The handler is also the registry of connected clients. Each connection
+records when the client was last heard from; clients send a "heartbeat"
+event between other events. A reaper thread disconnects clients that
+stay silent past the idle timeout or whose outbound packet queue grows
+past its limit (a consumer too slow to keep up), and forgets entries
+whose socket has already gone.
 """
 
+import time
+import queue
 import logging
+import threading
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, List, Optional, Any, Callable, Hashable, TYPE_CHECKING
+
+from metrics import SOCKETIO_DISCONNECTS
+
+if TYPE_CHECKING:
+    from event_bus import EventBus
 
 logger = logging.getLogger(__name__)
 
+# Subscription kinds that take an id, e.g. "scanner:sane:epson2:libusb:001:004"
+ROOM_KINDS = ('scanner', 'job', 'scan', 'session')
+# Room of clients following scanner list changes
+SCANNERS_ROOM = 'scanners'
+# Room of clients following scan history changes
+HISTORY_ROOM = 'history'
+MAX_SUBSCRIPTIONS = 100
+
+
+class SubscriptionError(ValueError):
+    """Raised for an invalid or excess subscription"""
+    pass
+
+
+class ConnectionLimitError(Exception):
+    """Raised when a connection would exceed max_connections"""
+    pass
+
+
+@dataclass
+class Connection:
+    """A connected Socket.IO client"""
+    client_id: str
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    subscriptions: List[str] = field(default_factory=list)
+    connected_at: str = field(default_factory=lambda: datetime.now().isoformat())
+    last_seen: float = field(default_factory=time.monotonic)
+    outbound_queue: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize connection for status responses"""
+        return {
+            'connected_at': self.connected_at,
+            'idle_seconds': round(time.monotonic() - self.last_seen, 1),
+            'outbound_queue': self.outbound_queue,
+            'metadata': self.metadata,
+            'subscriptions': list(self.subscriptions)
+        }
+
+
+def merge_scanner_deltas(older: Dict[str, Any], newer: Dict[str, Any]) -> Dict[str, Any]:
+    """Combine two consecutive scanner list deltas into one"""
+    added = {scanner['id']: scanner for scanner in older['added']}
+    changed = {scanner['id']: scanner for scanner in older['changed']}
+    removed = list(older['removed'])
+    for scanner in newer['added']:
+        if scanner['id'] in removed:
+            removed.remove(scanner['id'])
+        added[scanner['id']] = scanner
+    for scanner in newer['changed']:
+        if scanner['id'] in added:
+            added[scanner['id']] = scanner
+        else:
+            changed[scanner['id']] = scanner
+    for scanner_id in newer['removed']:
+        added.pop(scanner_id, None)
+        changed.pop(scanner_id, None)
+        if scanner_id not in removed:
+            removed.append(scanner_id)
+    return dict(newer, added=list(added.values()), changed=list(changed.values()), removed=removed)
+
 
 class WebSocketHandler:
     """Handles WebSocket connections and events"""
     
-    def __init__(self, socketio):
-        """Initialize WebSocket handler"""
+    def __init__(
+        self,
+        socketio,
+        bus: Optional["EventBus"] = None,
+        max_connections: int = 1000,
+        idle_timeout: float = 300,
+        max_outbound_queue: int = 1000,
+        reap_interval: float = 10
+    ):
+        """Initialize WebSocket handler; with a bus, room events are coalesced and batched
+        
+        An idle_timeout or max_outbound_queue of 0 disables that check.
+        """
         self.socketio = socketio
-        self.connections: Dict[str, Dict[str, Any]] = {}
+        self.bus = bus
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.max_outbound_queue = max_outbound_queue
+        self.reap_interval = reap_interval
+        self.connections: Dict[str, Connection] = {}
+        self.rejected = 0
+        self.dropped: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
     
     def register_connection(self, client_id: str, metadata: Dict[str, Any] = None):
-        """Register a new connection"""
-        self.connections[client_id] = {
-            'connected_at': datetime.now().isoformat(),
-            'metadata': metadata or {},
-            'subscriptions': []
-        }
+        """Register a new connection, raising ConnectionLimitError when full"""
+        with self._lock:
+            if client_id not in self.connections and len(self.connections) >= self.max_connections:
+                self.rejected += 1
+                SOCKETIO_DISCONNECTS.inc(reason='limit')
+                raise ConnectionLimitError(f"Server is at its limit of {self.max_connections} connections")
+            self.connections[client_id] = Connection(client_id, metadata or {})
         logger.info(f"Registered connection: {client_id}")
     
     def unregister_connection(self, client_id: str):
-        """Unregister a connection"""
-        if client_id in self.connections:
-            del self.connections[client_id]
+        """Unregister a connection; Socket.IO drops its rooms on disconnect"""
+        with self._lock:
+            connection = self.connections.pop(client_id, None)
+        if connection:
             logger.info(f"Unregistered connection: {client_id}")
     
+    def touch(self, client_id: str):
+        """Record that a client was heard from"""
+        connection = self.connections.get(client_id)
+        if connection:
+            connection.last_seen = time.monotonic()
+    
+    @staticmethod
+    def room_name(kind: str, room_id: Optional[str] = None) -> str:
+        """Room name for a subscription"""
+        if kind in (SCANNERS_ROOM, HISTORY_ROOM) and not room_id:
+            return kind
+        if kind not in ROOM_KINDS:
+            raise SubscriptionError(f"Unknown subscription type: {kind}")
+        if not room_id:
+            raise SubscriptionError(f"{kind} subscriptions need an id")
+        return f"{kind}:{room_id}"
+    
+    def subscribe(self, client_id: str, kind: str, room_id: Optional[str] = None) -> str:
+        """Add a client to a subscription room"""
+        room = self.room_name(kind, room_id)
+        connection = self.connections.get(client_id)
+        if connection is None:
+            raise SubscriptionError(f"Unknown connection: {client_id}")
+        subscriptions = connection.subscriptions
+        if room not in subscriptions:
+            if len(subscriptions) >= MAX_SUBSCRIPTIONS:
+                raise SubscriptionError(f"At most {MAX_SUBSCRIPTIONS} subscriptions per connection")
+            self.socketio.server.enter_room(client_id, room, namespace='/')
+            subscriptions.append(room)
+            logger.debug(f"Client {client_id} subscribed to {room}")
+        return room
+    
+    def unsubscribe(self, client_id: str, kind: str, room_id: Optional[str] = None) -> str:
+        """Remove a client from a subscription room"""
+        room = self.room_name(kind, room_id)
+        connection = self.connections.get(client_id)
+        if connection and room in connection.subscriptions:
+            self.socketio.server.leave_room(client_id, room, namespace='/')
+            connection.subscriptions.remove(room)
+            logger.debug(f"Client {client_id} unsubscribed from {room}")
+        return room
+    
+    def get_subscriptions(self, client_id: str) -> List[str]:
+        """Rooms a client is subscribed to"""
+        connection = self.connections.get(client_id)
+        return list(connection.subscriptions) if connection else []
+    
+    def rooms_for(
+        self,
+        scan_id: Optional[str] = None,
+        scanner_id: Optional[str] = None,
+        job_id: Optional[str] = None,
+        session_id: Optional[str] = None
+    ) -> List[str]:
+        """Rooms interested in an event about these objects"""
+        rooms = []
+        for kind, room_id in (('scan', scan_id), ('job', job_id), ('scanner', scanner_id), ('session', session_id)):
+            if room_id:
+                rooms.append(f"{kind}:{room_id}")
+        return rooms
+    
+    def _emit(
+        self,
+        event: str,
+        data: Dict[str, Any],
+        rooms: List[str],
+        key: Optional[Hashable] = None,
+        merge: Optional[Callable[[Dict[str, Any], Dict[str, Any]], Dict[str, Any]]] = None
+    ):
+        """Emit to the union of rooms; a client in several rooms gets the event once
+        
+        Events with a key are superseded by later events with the same key
+        while both are still queued on the bus.
+        """
+        if self.bus:
+            self.bus.publish(event, data, rooms, key=key, merge=merge)
+        elif rooms:
+            self.socketio.emit(event, data, to=rooms)
+    
     def broadcast_scanner_update(self, scanners: list):
-        """Broadcast scanner list update to all clients"""
+        """Send the full scanner list to scanner list subscribers"""
         try:
-            self.socketio.emit('scanners_updated', {
+            self._emit('scanners_updated', {
                 'scanners': scanners,
                 'timestamp': datetime.now().isoformat()
-            })
+            }, [SCANNERS_ROOM], key='full')
             logger.info("Broadcasted scanner update")
         except Exception as e:
             logger.error(f"Error broadcasting scanner update: {str(e)}")
     
-    def broadcast_scan_started(self, scan_id: str, scanner_id: str):
-        """Broadcast scan started event"""
+    def broadcast_scanner_changes(self, delta: Dict[str, list]):
+        """Send scanners added, changed or removed since the last discovery pass
+        
+        Goes to scanner list subscribers and to subscribers of each
+        affected scanner.
+        """
+        try:
+            affected = [scanner['id'] for scanner in delta.get('added', []) + delta.get('changed', [])]
+            affected += delta.get('removed', [])
+            self._emit('scanners_updated', {
+                'added': delta.get('added', []),
+                'changed': delta.get('changed', []),
+                'removed': delta.get('removed', []),
+                'timestamp': datetime.now().isoformat()
+            }, [SCANNERS_ROOM] + [self.room_name('scanner', scanner_id) for scanner_id in affected],
+                key='delta', merge=merge_scanner_deltas)
+            logger.info(
+                f"Broadcasted scanner changes: +{len(delta.get('added', []))} "
+                f"~{len(delta.get('changed', []))} -{len(delta.get('removed', []))}"
+            )
+        except Exception as e:
+            logger.error(f"Error broadcasting scanner changes: {str(e)}")
+    
+    def broadcast_scan_started(
+        self,
+        scan_id: str,
+        scanner_id: str,
+        job_id: Optional[str] = None,
+        session_id: Optional[str] = None
+    ):
+        """Send scan started event to subscribers of the scan, job, scanner and session"""
         try:
-            self.socketio.emit('scan_started', {
+            self._emit('scan_started', {
                 'scan_id': scan_id,
                 'scanner_id': scanner_id,
+                'job_id': job_id,
                 'timestamp': datetime.now().isoformat()
-            })
+            }, self.rooms_for(scan_id, scanner_id, job_id, session_id))
             logger.info(f"Broadcasted scan started: {scan_id}")
         except Exception as e:
             logger.error(f"Error broadcasting scan started: {str(e)}")
     
-    def broadcast_scan_progress(self, scan_id: str, progress: int, status: str):
-        """Broadcast scan progress update"""
+    def broadcast_scan_progress(
+        self,
+        scan_id: str,
+        progress: int,
+        status: str,
+        scanner_id: Optional[str] = None,
+        job_id: Optional[str] = None,
+        session_id: Optional[str] = None
+    ):
+        """Send scan progress update to subscribers of the scan, job, scanner and session"""
         try:
-            self.socketio.emit('scan_progress', {
+            self._emit('scan_progress', {
                 'scan_id': scan_id,
                 'progress': progress,
                 'status': status,
                 'timestamp': datetime.now().isoformat()
-            })
+            }, self.rooms_for(scan_id, scanner_id, job_id, session_id), key=scan_id)
             logger.debug(f"Broadcasted scan progress: {scan_id} - {progress}%")
         except Exception as e:
             logger.error(f"Error broadcasting scan progress: {str(e)}")
     
-    def broadcast_scan_completed(self, scan_id: str, image_path: str, file_size: int):
-        """Broadcast scan completed event"""
+    def broadcast_scan_completed(
+        self,
+        scan_id: str,
+        image_path: str,
+        file_size: int,
+        scanner_id: Optional[str] = None,
+        job_id: Optional[str] = None,
+        session_id: Optional[str] = None,
+        batch_scan_id: Optional[str] = None
+    ):
+        """Send scan completed event to subscribers of the scan, job, scanner and session
+        
+        Pages of a batch go to the room of the batch's scan_id; nobody can
+        have subscribed to a page's own, freshly generated scan_id.
+        """
         try:
-            self.socketio.emit('scan_completed', {
+            self._emit('scan_completed', {
                 'scan_id': scan_id,
                 'image_path': image_path,
                 'file_size': file_size,
                 'timestamp': datetime.now().isoformat()
-            })
+            }, self.rooms_for(batch_scan_id or scan_id, scanner_id, job_id, session_id))
             logger.info(f"Broadcasted scan completed: {scan_id}")
         except Exception as e:
             logger.error(f"Error broadcasting scan completed: {str(e)}")
     
-    def broadcast_scan_error(self, scan_id: str, error_message: str):
-        """Broadcast scan error event"""
+    def broadcast_scan_error(
+        self,
+        scan_id: str,
+        error_message: str,
+        scanner_id: Optional[str] = None,
+        job_id: Optional[str] = None,
+        session_id: Optional[str] = None
+    ):
+        """Send scan error event to subscribers of the scan, job, scanner and session"""
         try:
-            self.socketio.emit('scan_error', {
+            self._emit('scan_error', {
                 'scan_id': scan_id,
                 'error': error_message,
                 'timestamp': datetime.now().isoformat()
-            })
+            }, self.rooms_for(scan_id, scanner_id, job_id, session_id))
             logger.error(f"Broadcasted scan error: {scan_id} - {error_message}")
         except Exception as e:
             logger.error(f"Error broadcasting scan error: {str(e)}")
     
+    def broadcast_job_update(self, job: Dict[str, Any]):
+        """Send scan job state change to subscribers of the job, its scan, scanner and session"""
+        try:
+            self._emit('scan_job_updated', {
+                'job': job,
+                'timestamp': datetime.now().isoformat()
+            }, self.rooms_for(job.get('scan_id'), job.get('scanner_id'), job['job_id'], job.get('client_id')),
+                key=job['job_id'])
+            logger.debug(f"Broadcasted job update: {job['job_id']} - {job['status']}")
+        except Exception as e:
+            logger.error(f"Error broadcasting job update: {str(e)}")
+    
     def broadcast_scanner_selected(self, scanner_id: str):
-        """Broadcast scanner selected event"""
+        """Send scanner selected event to scanner list and scanner subscribers"""
         try:
-            self.socketio.emit('scanner_selected', {
+            self._emit('scanner_selected', {
                 'scanner_id': scanner_id,
                 'timestamp': datetime.now().isoformat()
-            })
+            }, [SCANNERS_ROOM, self.room_name('scanner', scanner_id)], key='selected')
             logger.info(f"Broadcasted scanner selected: {scanner_id}")
         except Exception as e:
             logger.error(f"Error broadcasting scanner selected: {str(e)}")
     
+    def broadcast_scan_deleted(self, scan_id: str, scanner_id: Optional[str] = None):
+        """Send scan deleted event to subscribers of the scan and its scanner"""
+        try:
+            self._emit('scan_deleted', {
+                'scan_id': scan_id,
+                'timestamp': datetime.now().isoformat()
+            }, self.rooms_for(scan_id, scanner_id))
+            logger.info(f"Broadcasted scan deleted: {scan_id}")
+        except Exception as e:
+            logger.error(f"Error broadcasting scan deleted: {str(e)}")
+    
+    def broadcast_sync_change(self, change: Dict[str, Any], epoch: str):
+        """Send a sequence-numbered history or scanner list change to its followers"""
+        try:
+            self._emit('sync_changes', {
+                'epoch': epoch,
+                'changes': [change]
+            }, [HISTORY_ROOM if change['entity'] == 'scan' else SCANNERS_ROOM])
+            logger.debug(f"Broadcasted sync change {change['seq']}: {change['entity']} {change['id']} {change['op']}")
+        except Exception as e:
+            logger.error(f"Error broadcasting sync change: {str(e)}")
+    
     def send_to_client(self, client_id: str, event: str, data: Dict[str, Any]):
         """Send event to specific client"""
         try:
@@ -112,10 +388,113 @@ class WebSocketHandler:
         except Exception as e:
             logger.error(f"Error sending to client {client_id}: {str(e)}")
     
+    def _engine_socket(self, client_id: str):
+        """Engine.IO socket carrying a client's packets, if it is on this server"""
+        try:
+            eio_sid = self.socketio.server.manager.eio_sid_from_sid(client_id, '/')
+            return self.socketio.server.eio.sockets.get(eio_sid) if eio_sid else None
+        except Exception:
+            return None
+    
+    def _drop(self, client_id: str, reason: str):
+        """Disconnect a client and discard the packets still queued for it"""
+        self.dropped[reason] = self.dropped.get(reason, 0) + 1
+        SOCKETIO_DISCONNECTS.inc(reason=reason)
+        socket = self._engine_socket(client_id)
+        if socket is None:
+            self.socketio.server.disconnect(client_id, namespace='/', ignore_queue=True)
+            return
+        # Closing without waiting: a slow consumer would never drain the queue
+        socket.close(wait=False, abort=True)
+        while True:
+            try:
+                socket.queue.get_nowait()
+            except queue.Empty:
+                break
+            socket.queue.task_done()
+        # Let the writer thread exit
+        socket.queue.put(None)
+    
+    def reap(self) -> Dict[str, int]:
+        """Forget gone connections and disconnect idle or backed-up clients"""
+        now = time.monotonic()
+        reaped = {'stale': 0, 'idle': 0, 'slow': 0}
+        with self._lock:
+            connections = list(self.connections.values())
+        for connection in connections:
+            client_id = connection.client_id
+            if not self.socketio.server.manager.is_connected(client_id, '/'):
+                # Disconnected without the disconnect handler running
+                with self._lock:
+                    self.connections.pop(client_id, None)
+                reaped['stale'] += 1
+                SOCKETIO_DISCONNECTS.inc(reason='stale')
+                continue
+            socket = self._engine_socket(client_id)
+            connection.outbound_queue = socket.queue.qsize() if socket else 0
+            if self.max_outbound_queue and connection.outbound_queue > self.max_outbound_queue:
+                logger.warning(
+                    f"Dropping slow client {client_id}: {connection.outbound_queue} packets queued"
+                )
+                reason = 'slow'
+            elif self.idle_timeout and now - connection.last_seen > self.idle_timeout:
+                logger.info(f"Dropping idle client {client_id}: silent for {now - connection.last_seen:.0f}s")
+                reason = 'idle'
+            else:
+                continue
+            reaped[reason] += 1
+            try:
+                self._drop(client_id, reason)
+            except Exception as e:
+                logger.error(f"Error disconnecting client {client_id}: {str(e)}")
+            self.unregister_connection(client_id)
+        return reaped
+    
+    def start(self):
+        """Start the reaper thread"""
+        if self._thread or self.reap_interval <= 0:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="connection-reaper", daemon=True)
+        self._thread.start()
+        logger.info(
+            f"Connection reaper every {self.reap_interval}s: idle timeout {self.idle_timeout}s, "
+            f"outbound queue limit {self.max_outbound_queue}"
+        )
+    
+    def stop(self):
+        """Stop the reaper thread"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+    
+    def _run(self):
+        """Reap every reap_interval until stopped"""
+        while not self._stop_event.wait(self.reap_interval):
+            try:
+                self.reap()
+            except Exception as e:
+                logger.error(f"Error reaping connections: {str(e)}")
+    
     def get_connection_count(self) -> int:
         """Get number of active connections"""
-        return len(self.connections)
+        with self._lock:
+            return len(self.connections)
     
     def get_connections(self) -> Dict[str, Dict[str, Any]]:
         """Get all active connections"""
-        return self.connections.copy()
+        with self._lock:
+            connections = list(self.connections.values())
+        return {connection.client_id: connection.to_dict() for connection in connections}
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get connection counts and limits"""
+        return {
+            "connections": self.get_connection_count(),
+            "max_connections": self.max_connections,
+            "idle_timeout": self.idle_timeout,
+            "max_outbound_queue": self.max_outbound_queue,
+            "rejected": self.rejected,
+            "dropped": dict(self.dropped)
+        }
@@ -9,7 +9,7 @@ echo "Starting Scanner Bridge..."
 # Start Python backend in background
 echo "Starting Python backend service..."
 cd /app/backend
-python app.py &
+gunicorn -c gunicorn.conf.py app:app &
 BACKEND_PID=$!
 
 # Wait for backend to be ready
@@ -44,5 +44,8 @@ echo "Scanner Bridge is running!"
 echo "Frontend: http://localhost:3000"
 echo "Backend API: http://localhost:5000"
 
+# Forward SIGTERM so gunicorn can drain in-flight scans
+trap 'kill -TERM $BACKEND_PID $FRONTEND_PID; wait $BACKEND_PID' TERM INT
+
 # Keep the container running
 wait $BACKEND_PID $FRONTEND_PID
@@ -14,6 +14,7 @@ import ImageOverlay from './components/ImageOverlay'
 function App() {
   const {
     setScanners,
+    setScanHistory,
     setCurrentScanner,
     setLoadingScanners,
     setConnectionStatus,
@@ -47,8 +48,17 @@ function App() {
       onError: () => {
         setConnectionStatus('error')
       },
-      onScannersUpdated: (data: any) => {
-        setScanners(data.scanners)
+      // Scanner list and history changes arrive as sequence-numbered changes
+      onSync: (result: any) => {
+        if (result.snapshot) {
+          setScanners(result.scanners)
+          setScanHistory(result.history)
+        } else {
+          applySyncChanges(result.changes)
+        }
+      },
+      onSyncChanges: (changes: any[]) => {
+        applySyncChanges(changes)
       },
       onScannerSelected: (_data: any) => {
         // Selection handled
@@ -60,6 +70,33 @@ function App() {
     }
   }, [])
 
+  const applySyncChanges = (changes: any[]) => {
+    let { scanners, scanHistory } = useAppStore.getState()
+    for (const change of changes) {
+      if (change.entity === 'scanner') {
+        const exists = scanners.some((s) => s.id === change.id)
+        if (change.op === 'delete') {
+          scanners = scanners.filter((s) => s.id !== change.id)
+        } else {
+          scanners = exists
+            ? scanners.map((s) => (s.id === change.id ? change.data : s))
+            : [...scanners, change.data]
+        }
+      } else {
+        const exists = scanHistory.some((s) => s.scan_id === change.id)
+        if (change.op === 'delete') {
+          scanHistory = scanHistory.filter((s) => s.scan_id !== change.id)
+        } else {
+          scanHistory = exists
+            ? scanHistory.map((s) => (s.scan_id === change.id ? change.data : s))
+            : [change.data, ...scanHistory]
+        }
+      }
+    }
+    setScanners(scanners)
+    setScanHistory(scanHistory)
+  }
+
   const initializeApp = async () => {
     try {
       setLoadingScanners(true)
@@ -151,7 +151,7 @@ export default function ImageGallery() {
                       : "w-20 h-20 bg-bg-tertiary rounded-lg shrink-0 overflow-hidden relative"
                   }>
                     <img
-                      src={scanAPI.getImage(scan.scan_id)}
+                      src={scanAPI.getImage(scan.scan_id, 'thumb')}
                       alt={scan.scan_id}
                       className="w-full h-full object-cover transition-transform duration-500 group-hover:scale-105"
                       loading="lazy"
@@ -163,7 +163,7 @@ export default function ImageGallery() {
                         <div className="flex items-center justify-center gap-2 mb-4">
                           <button
                             onClick={() => {
-                              setPreviewImage(scanAPI.getImage(scan.scan_id))
+                              setPreviewImage(scanAPI.getImage(scan.scan_id, 'preview'))
                               setShowImagePreview(true)
                             }}
                             className="p-2 rounded-lg bg-white/20 backdrop-blur-sm text-white hover:bg-white/40 transition-colors"
@@ -222,7 +222,7 @@ export default function ImageGallery() {
                     <div className="flex items-center gap-2 pr-2 opacity-0 group-hover:opacity-100 transition-opacity">
                       <button
                         onClick={() => {
-                          setPreviewImage(scanAPI.getImage(scan.scan_id))
+                          setPreviewImage(scanAPI.getImage(scan.scan_id, 'preview'))
                           setShowImagePreview(true)
                         }}
                         className="p-2 rounded-lg text-text-secondary hover:bg-bg-tertiary hover:text-primary transition-colors"
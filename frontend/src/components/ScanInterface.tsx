@@ -28,21 +28,22 @@ export default function ScanInterface() {
       setScanError(null)
       setScanProgress(0)
 
-      // Start scan
-      const result = await scanAPI.startScan(currentScanner.scanner_id, {
+      // Queue scan, then follow its progress until the job finishes
+      const job = await scanAPI.startScan(currentScanner.scanner_id, {
         format,
         resolution,
         mode: colorMode
       })
 
-      // In a real app we would track progress here
-      // For now we simulate it
-      for (let i = 0; i <= 100; i += 10) {
-        setScanProgress(i)
-        await new Promise(resolve => setTimeout(resolve, 200))
-      }
+      const result = await scanAPI.waitForJob(job, setScanProgress)
+      setScanProgress(100)
 
-      addScan(result)
+      // The job is not a scan record; fetch the stored record of each page
+      const scanIds: string[] = result.pages?.length
+        ? result.pages.map((page: any) => page.scan_id)
+        : [result.scan_id]
+      const scans = await Promise.all(scanIds.map((scanId) => scanAPI.getScanInfo(scanId)))
+      scans.forEach((scan) => addScan(scan))
     } catch (error: any) {
       setScanError(error.message || 'Scan failed')
     } finally {
@@ -14,6 +14,17 @@ const api = axios.create({
 
 // WebSocket instance
 let socket: Socket | null = null
+let heartbeat: ReturnType<typeof setInterval> | null = null
+// Position in the server's change log, kept across reconnects so they only fetch what changed
+let syncEpoch: string | null = null
+let syncSeq: number | null = null
+
+const stopHeartbeat = () => {
+  if (heartbeat) {
+    clearInterval(heartbeat)
+    heartbeat = null
+  }
+}
 
 // Scanner API
 export const scannerAPI = {
@@ -53,6 +64,47 @@ export const scanAPI = {
     return response.data
   },
 
+  getJob: async (jobId: string) => {
+    const response = await api.get(`/api/scan/jobs/${jobId}`)
+    return response.data.job
+  },
+
+  cancelJob: async (jobId: string) => {
+    const response = await api.post(`/api/scan/jobs/${jobId}/cancel`)
+    return response.data.job
+  },
+
+  // Resolve once a job finishes, reporting progress pushed over the WebSocket
+  waitForJob: (job: any, onProgress?: (progress: number) => void): Promise<any> => {
+    return new Promise((resolve, reject) => {
+      const finished = ['completed', 'error', 'cancelled']
+      const s = socket
+      if (!s) {
+        reject(new Error('WebSocket not connected'))
+        return
+      }
+
+      const onScanProgress = (data: any) => {
+        if (data.scan_id === job.scan_id) onProgress?.(data.progress)
+      }
+      const onJobUpdated = (data: any) => {
+        if (data.job?.job_id !== job.job_id || !finished.includes(data.job.status)) return
+        s.off('scan_progress', onScanProgress)
+        s.off('scan_job_updated', onJobUpdated)
+        s.emit('unsubscribe_scan', { scan_id: job.scan_id })
+        if (data.job.status === 'completed') resolve(data.job)
+        else reject(new Error(data.job.error || `Scan ${data.job.status}`))
+      }
+
+      s.on('scan_progress', onScanProgress)
+      s.on('scan_job_updated', onJobUpdated)
+      s.emit('subscribe_scan', { scan_id: job.scan_id })
+
+      // The job may have finished before we subscribed
+      scanAPI.getJob(job.job_id).then((current) => onJobUpdated({ job: current })).catch(() => {})
+    })
+  },
+
   getStatus: async () => {
     const response = await api.get('/api/scan/status')
     return response.data.status
@@ -63,8 +115,9 @@ export const scanAPI = {
     return response.data.history
   },
 
-  getImage: (scanId: string): string => {
-    return `${API_BASE_URL}/api/scan/${scanId}`
+  // size: 'thumb' (256px), 'preview' (1024px) or omitted for the full scan
+  getImage: (scanId: string, size?: 'thumb' | 'preview'): string => {
+    return `${API_BASE_URL}/api/scan/${scanId}${size ? `?size=${size}` : ''}`
   },
 
   getScanInfo: async (scanId: string) => {
@@ -76,6 +129,14 @@ export const scanAPI = {
     const response = await api.delete(`/api/scan/${scanId}`)
     return response.data
   },
+
+  // Multi-page PDF or TIFF download of scans in the given order, or of a batch scan's pages
+  getDocumentUrl: (pages: { scanIds?: string[]; batchId?: string }, format: 'pdf' | 'tiff' = 'pdf'): string => {
+    const params = new URLSearchParams({ format })
+    if (pages.scanIds) params.set('scan_ids', pages.scanIds.join(','))
+    if (pages.batchId) params.set('batch_id', pages.batchId)
+    return `${API_BASE_URL}/api/document?${params}`
+  },
 }
 
 // Image API
@@ -99,16 +160,58 @@ export const wsAPI = {
       reconnectionAttempts: 5,
     })
 
+    // Catch up on what changed since syncSeq; the server falls back to a snapshot
+    const sync = () => {
+      socket?.emit('sync', { since: syncSeq, epoch: syncEpoch }, (result: any) => {
+        if (result.error) return
+        // A snapshot or a new epoch restarts the sequence, which may go down
+        const restarted = result.snapshot || result.epoch !== syncEpoch
+        syncEpoch = result.epoch
+        syncSeq = restarted ? result.seq : Math.max(result.seq, syncSeq ?? 0)
+        callbacks?.onSync?.(result)
+      })
+    }
+
     socket.on('connect', () => {
       console.log('WebSocket connected')
+      // Events are only sent to subscribers; rooms are rejoined on every reconnect
+      socket?.emit('subscribe', { type: 'scanners' })
+      socket?.emit('subscribe', { type: 'history' })
+      sync()
       callbacks?.onConnect?.()
     })
 
+    // The server drops clients it has not heard from within its idle timeout
+    socket.on('connected', (data: { heartbeat_interval?: number }) => {
+      stopHeartbeat()
+      const interval = (data.heartbeat_interval ?? 30) * 1000
+      heartbeat = setInterval(() => socket?.emit('heartbeat'), interval)
+    })
+
     socket.on('disconnect', () => {
       console.log('WebSocket disconnected')
+      stopHeartbeat()
       callbacks?.onDisconnect?.()
     })
 
+    // Events sent in the same tick arrive as one batch frame; dispatch each as if sent alone
+    socket.on('event_batch', (batch: { events: { event: string; data: any }[] }) => {
+      for (const { event, data } of batch.events) {
+        socket?.listeners(event).forEach((listener) => listener(data))
+      }
+    })
+
+    socket.on('sync_changes', (data: { epoch: string; changes: any[] }) => {
+      callbacks?.onSyncChanges?.(data.changes)
+      if (data.epoch === syncEpoch) {
+        syncSeq = Math.max(syncSeq ?? 0, ...data.changes.map((change) => change.seq))
+      } else if (syncEpoch !== null) {
+        // The server's log was reset; our cursor no longer means anything there
+        syncSeq = null
+        sync()
+      }
+    })
+
     socket.on('scanners_updated', (data) => {
       callbacks?.onScannersUpdated?.(data)
     })
@@ -141,6 +244,7 @@ export const wsAPI = {
   },
 
   disconnect: () => {
+    stopHeartbeat()
     if (socket) {
       socket.disconnect()
       socket = null
@@ -126,7 +126,11 @@ export const useAppStore = create<AppState>()(
       // Scan Actions
       setCurrentScan: (scan) => set({ currentScan: scan }),
       setScanHistory: (history) => set({ scanHistory: history }),
-      addScan: (scan) => set((state) => ({ scanHistory: [scan, ...state.scanHistory] })),
+      // A sync push may have delivered the same scan already
+      addScan: (scan) =>
+        set((state) => ({
+          scanHistory: [scan, ...state.scanHistory.filter((s) => s.scan_id !== scan.scan_id)],
+        })),
       setScanning: (scanning) => set({ isScanning: scanning }),
       setScanProgress: (progress) => set({ scanProgress: progress }),
       setScanError: (error) => set({ scanError: error }),